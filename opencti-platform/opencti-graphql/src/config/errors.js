@@ -86,7 +86,8 @@ export const UnsupportedError = (reason, data) => error(UNSUPPORTED_ERROR, reaso
   ...data,
 });
 
-export const FunctionalError = (reason, data) => error('FUNCTIONAL_ERROR', reason || 'Business validation', {
+export const FUNCTIONAL_ERROR = 'FUNCTIONAL_ERROR';
+export const FunctionalError = (reason, data) => error(FUNCTIONAL_ERROR, reason || 'Business validation', {
   http_status: 400,
   genre: CATEGORY_BUSINESS,
   ...data,
@@ -3,22 +3,46 @@ import { SemanticAttributes } from '@opentelemetry/semantic-conventions';
 import * as nodecallspython from 'node-calls-python';
 import nconf from 'nconf';
 import { DEV_MODE, logApp } from '../config/conf';
-import { UnknownError, UnsupportedError } from '../config/errors';
+import { FUNCTIONAL_ERROR, FunctionalError, UnknownError, UnsupportedError } from '../config/errors';
 import { telemetry } from '../config/tracing';
 import { cleanupIndicatorPattern, STIX_PATTERN_TYPE } from '../utils/syntax';
 import { isEmptyField } from '../database/utils';
 
 const PYTHON_EXECUTOR = nconf.get('app:python_execution') ?? 'native';
 const USE_NATIVE_EXEC = PYTHON_EXECUTOR === 'native';
+const PYTHON_RUNTIME_POOL_SIZE = nconf.get('app:python_runtime:pool_size') ?? 2;
+const PYTHON_RUNTIME_TIMEOUT = nconf.get('app:python_runtime:timeout') ?? 30000;
+const PYTHON_RUNTIME_HEALTH_INTERVAL = nconf.get('app:python_runtime:health_interval') ?? 60000;
+const VALIDATION_CACHE_MAX_SIZE = nconf.get('app:python_validation_cache:max_size') ?? 10000;
+const VALIDATION_CACHE_TTL = nconf.get('app:python_validation_cache:ttl') ?? 3600;
+const PYTHON_NATIVE_POOL_SIZE = nconf.get('app:python_native:pool_size') ?? 2;
+const PYTHON_NATIVE_QUEUE_SIZE = nconf.get('app:python_native:queue_size') ?? 1000;
+const PYTHON_NATIVE_TIMEOUT = nconf.get('app:python_native:timeout') ?? 30000;
 
 // Importing python runtime scripts
 const py = nodecallspython.interpreter;
 const pyCheckIndicator = py.importSync('./src/python/runtime/check_indicator.py');
 const CHECK_INDICATOR_SCRIPT = { fn: 'check_indicator', py: pyCheckIndicator };
+const CHECK_INDICATORS_BATCH_SCRIPT = { fn: 'check_indicators_batch', py: pyCheckIndicator };
+const CONFIGURE_VALIDATION_CACHE_SCRIPT = { fn: 'configure_validation_cache', py: pyCheckIndicator };
+const VALIDATION_CACHE_STATISTICS_SCRIPT = { fn: 'validation_cache_statistics', py: pyCheckIndicator };
+if (USE_NATIVE_EXEC) {
+  py.callSync(pyCheckIndicator, CONFIGURE_VALIDATION_CACHE_SCRIPT.fn, VALIDATION_CACHE_MAX_SIZE, VALIDATION_CACHE_TTL);
+}
 
 const pyCreatePattern = py.importSync('./src/python/runtime/stix2_create_pattern.py');
 const CREATE_PATTERN_SCRIPT = { fn: 'stix2_create_pattern', py: pyCreatePattern };
 
+// Checks not run (timeout, queue full) are rejected with their functional
+// error, the callers accepting the patterns of a null result
+const catchCheckError = (err) => {
+  if (err.name === FUNCTIONAL_ERROR) {
+    throw err;
+  }
+  logApp.warn(err);
+  return null;
+};
+
 // region child
 export const execChildPython = async (context, user, scriptPath, scriptName, args, stopCondition) => {
   const execPythonTestingProcessFn = async () => {
@@ -72,46 +96,218 @@ export const execChildPython = async (context, user, scriptPath, scriptName, arg
     [SemanticAttributes.DB_NAME]: 'python_testing_engine',
   }, execPythonTestingProcessFn);
 };
-const createChildStixPattern = async (context, user, observableType, observableValue) => {
-  try {
-    const result = await execChildPython(
-      context,
-      user,
-      './src/python/runtime',
-      'stix2_create_pattern.py',
-      [observableType, observableValue]
-    );
-    return result.data;
-  } catch (err) {
+// endregion
+
+// region runtime
+// Resident Python processes (runtime_server.py) serving the runtime scripts in
+// child mode, so the interpreter and the parsers are loaded once. Requests and
+// responses are JSON lines matched by id, a process answering its requests in
+// order (the timeout applies to the request being served). Processes exiting,
+// failing a health check or stuck on a request are replaced on the next call,
+// their pending requests being rejected.
+const runtimePool = [];
+let runtimeRequestId = 0;
+let runtimeHealthTimer;
+const startRuntimeProcess = () => {
+  const shell = new PythonShell('runtime_server.py', {
+    mode: 'text',
+    pythonPath: DEV_MODE ? 'python' : 'python3',
+    scriptPath: './src/python/runtime',
+  });
+  const runtime = { shell, pending: new Map(), alive: true };
+  runtime.terminate = (error) => {
+    if (!runtime.alive) {
+      return;
+    }
+    runtime.alive = false;
+    clearTimeout(runtime.timeout);
+    shell.kill();
+    runtime.pending.forEach((request) => request.reject(error));
+    runtime.pending.clear();
+  };
+  runtime.watch = () => {
+    clearTimeout(runtime.timeout);
+    if (runtime.pending.size > 0) {
+      const [{ fn }] = runtime.pending.values();
+      runtime.timeout = setTimeout(() => {
+        runtime.terminate(FunctionalError('Python runtime timeout', { fn, timeout: PYTHON_RUNTIME_TIMEOUT }));
+      }, PYTHON_RUNTIME_TIMEOUT);
+    }
+  };
+  shell.on('message', (message) => {
+    let response;
+    try {
+      response = JSON.parse(message);
+    } catch (e) {
+      logApp.error('[BRIDGE] Invalid python runtime response', { message });
+      return;
+    }
+    const request = runtime.pending.get(response.id);
+    if (request) {
+      runtime.pending.delete(response.id);
+      runtime.watch();
+      request.resolve(response);
+    }
+  });
+  shell.on('stderr', (stderr) => {
+    logApp.error(`[stderr] ${stderr}`);
+  });
+  shell.on('error', (err) => {
+    runtime.terminate(UnknownError('Python runtime process error', { cause: err }));
+  });
+  shell.on('close', () => {
+    runtime.terminate(UnknownError('Python runtime process exited'));
+  });
+  // First request of the process, served before any check
+  const cacheArgs = [VALIDATION_CACHE_MAX_SIZE, VALIDATION_CACHE_TTL];
+  sendRuntimeRequest(runtime, CONFIGURE_VALIDATION_CACHE_SCRIPT.fn, cacheArgs).catch((err) => {
     logApp.warn(err);
-    return null;
+  });
+  return runtime;
+};
+const sendRuntimeRequest = (runtime, fn, args) => {
+  return new Promise((resolve, reject) => {
+    runtimeRequestId += 1;
+    const id = runtimeRequestId;
+    runtime.pending.set(id, { fn, resolve, reject });
+    if (runtime.pending.size === 1) {
+      runtime.watch();
+    }
+    runtime.shell.send(JSON.stringify({ id, fn, args }));
+  });
+};
+const checkRuntimeProcesses = () => {
+  runtimePool.filter((runtime) => runtime.alive).forEach((runtime) => {
+    sendRuntimeRequest(runtime, 'health', []).then((response) => {
+      if (response.status !== 'success') {
+        runtime.terminate(UnknownError('Python runtime health check failed', response));
+      }
+    }).catch((err) => {
+      logApp.warn(err);
+    });
+  });
+};
+const getRuntimeProcess = () => {
+  for (let index = 0; index < PYTHON_RUNTIME_POOL_SIZE; index += 1) {
+    if (!runtimePool[index]?.alive) {
+      runtimePool[index] = startRuntimeProcess();
+    }
+  }
+  if (!runtimeHealthTimer) {
+    runtimeHealthTimer = setInterval(checkRuntimeProcesses, PYTHON_RUNTIME_HEALTH_INTERVAL);
+    runtimeHealthTimer.unref();
   }
+  // Least loaded process
+  return runtimePool.reduce((selected, runtime) => (runtime.pending.size < selected.pending.size ? runtime : selected));
 };
-const checkChildIndicatorSyntax = async (context, user, patternType, indicatorValue) => {
-  try {
-    const result = await execChildPython(
-      context,
-      user,
-      './src/python/runtime',
-      'check_indicator.py',
-      [patternType, indicatorValue]
-    );
-    return result.data;
-  } catch (err) {
+const execRuntimePython = async (context, user, fn, ...args) => {
+  const execRuntimePythonFn = async () => {
+    const result = await sendRuntimeRequest(getRuntimeProcess(), fn, args);
+    if (result.status === 'success') {
+      return result.data;
+    }
+    throw UnknownError('[BRIDGE] execRuntimePython error', result);
+  };
+  return telemetry(context, user, `PYTHON ${fn}`, {
+    [SemanticAttributes.DB_NAME]: 'python_runtime_server',
+  }, execRuntimePythonFn);
+};
+const createChildStixPattern = async (context, user, observableType, observableValue) => {
+  return execRuntimePython(context, user, CREATE_PATTERN_SCRIPT.fn, observableType, observableValue).catch((err) => {
     logApp.warn(err);
     return null;
-  }
+  });
+};
+const checkChildIndicatorSyntax = async (context, user, patternType, indicatorValue) => {
+  return execRuntimePython(context, user, CHECK_INDICATOR_SCRIPT.fn, patternType, indicatorValue).catch(catchCheckError);
+};
+const checkChildIndicatorsSyntax = async (context, user, items) => {
+  return execRuntimePython(context, user, CHECK_INDICATORS_BATCH_SCRIPT.fn, items).catch(catchCheckError);
+};
+const getChildValidationCacheStatistics = async (context, user) => {
+  const getStatisticsFn = async () => {
+    getRuntimeProcess();
+    const responses = await Promise.all(runtimePool.map((runtime) => {
+      return sendRuntimeRequest(runtime, VALIDATION_CACHE_STATISTICS_SCRIPT.fn, []);
+    }));
+    // Sum of the caches of the processes
+    const statistics = { size: 0, max_size: 0, ttl: VALIDATION_CACHE_TTL, hits: 0, misses: 0, evictions: 0 };
+    responses.forEach(({ data }) => {
+      ['size', 'max_size', 'hits', 'misses', 'evictions'].forEach((field) => {
+        statistics[field] += data[field];
+      });
+    });
+    return statistics;
+  };
+  return telemetry(context, user, `PYTHON ${VALIDATION_CACHE_STATISTICS_SCRIPT.fn}`, {
+    [SemanticAttributes.DB_NAME]: 'python_runtime_server',
+  }, getStatisticsFn);
 };
 const checkChildPythonAvailability = async (context, user) => {
-  const result = await execChildPython(context, user, './src/python/runtime', 'stix2_create_pattern.py', ['check', 'health']);
-  return result.data;
+  return execRuntimePython(context, user, CREATE_PATTERN_SCRIPT.fn, 'Text', 'test');
 };
 // endregion
 
 // region native
+// Python calls run outside of the event loop (threads of the libuv pool, shared
+// with fs and dns), at most PYTHON_NATIVE_POOL_SIZE at once, the others waiting
+// in a bounded queue. Calls taking more than PYTHON_NATIVE_TIMEOUT (queue wait
+// included) are rejected, a running Python call keeping its slot until it ends.
+const nativeQueue = [];
+let nativeRunning = 0;
+const acquireNativeSlot = (fn, deadline) => {
+  return new Promise((resolve, reject) => {
+    if (nativeRunning < PYTHON_NATIVE_POOL_SIZE) {
+      nativeRunning += 1;
+      resolve();
+      return;
+    }
+    if (nativeQueue.length >= PYTHON_NATIVE_QUEUE_SIZE) {
+      reject(FunctionalError('[BRIDGE] Python native queue is full', { fn, size: PYTHON_NATIVE_QUEUE_SIZE }));
+      return;
+    }
+    const waiting = {};
+    waiting.timeout = setTimeout(() => {
+      nativeQueue.splice(nativeQueue.indexOf(waiting), 1);
+      reject(FunctionalError('[BRIDGE] Python native queue timeout', { fn, timeout: PYTHON_NATIVE_TIMEOUT }));
+    }, deadline - Date.now());
+    waiting.start = () => {
+      clearTimeout(waiting.timeout);
+      resolve();
+    };
+    nativeQueue.push(waiting);
+  });
+};
+const releaseNativeSlot = () => {
+  const waiting = nativeQueue.shift();
+  if (waiting) {
+    waiting.start();
+  } else {
+    nativeRunning -= 1;
+  }
+};
+const callNativePython = (script, args, deadline) => {
+  return new Promise((resolve, reject) => {
+    const timeout = setTimeout(() => {
+      reject(FunctionalError('[BRIDGE] Python native timeout', { fn: script.fn, timeout: PYTHON_NATIVE_TIMEOUT }));
+    }, Math.max(0, deadline - Date.now()));
+    const call = new Promise((callResolve) => {
+      callResolve(py.call(script.py, script.fn, ...args));
+    });
+    call.then(resolve, reject).finally(() => {
+      clearTimeout(timeout);
+      releaseNativeSlot();
+    });
+  });
+};
 const execNativePython = async (context, user, script, ...args) => {
+  const deadline = Date.now() + PYTHON_NATIVE_TIMEOUT;
+  await telemetry(context, user, `PYTHON ${script.fn} queue`, {
+    [SemanticAttributes.DB_NAME]: 'python_runtime_engine',
+    'python.queue.length': nativeQueue.length,
+  }, () => acquireNativeSlot(script.fn, deadline));
   const execNativePythonFn = async () => {
-    const result = py.callSync(script.py, script.fn, ...args);
+    const result = await callNativePython(script, args, deadline);
     if (result.status === 'success') {
       return result.data;
     }
@@ -128,10 +324,13 @@ const createNativeStixPattern = async (context, user, observableType, observable
   });
 };
 const checkNativeIndicatorSyntax = async (context, user, patternType, indicatorValue) => {
-  return execNativePython(context, user, CHECK_INDICATOR_SCRIPT, patternType, indicatorValue).catch((err) => {
-    logApp.warn(err);
-    return null;
-  });
+  return execNativePython(context, user, CHECK_INDICATOR_SCRIPT, patternType, indicatorValue).catch(catchCheckError);
+};
+const checkNativeIndicatorsSyntax = async (context, user, items) => {
+  return execNativePython(context, user, CHECK_INDICATORS_BATCH_SCRIPT, items).catch(catchCheckError);
+};
+const getNativeValidationCacheStatistics = async (context, user) => {
+  return execNativePython(context, user, VALIDATION_CACHE_STATISTICS_SCRIPT);
 };
 const checkNativePythonAvailability = async (context, user) => {
   return createStixPattern(context, user, 'Text', 'test');
@@ -150,6 +349,27 @@ export const checkIndicatorSyntax = async (context, user, patternType, indicator
   }
   return checkChildIndicatorSyntax(context, user, patternType, indicatorValue);
 };
+// Check many [patternType, indicatorValue] pairs in one call, results in the
+// same order with the value checkIndicatorSyntax would return for each pair
+export const checkIndicatorsSyntax = async (context, user, items) => {
+  if (items.length === 0) {
+    return [];
+  }
+  const results = await (USE_NATIVE_EXEC ? checkNativeIndicatorsSyntax(context, user, items)
+    : checkChildIndicatorsSyntax(context, user, items));
+  if (results === null) {
+    return items.map(() => null);
+  }
+  return results.map((result) => (result.status === 'success' ? result.data : null));
+};
+// Statistics of the cache of the syntax checks (size, hits, misses, evictions),
+// summed over the runtime processes in child mode
+export const getValidationCacheStatistics = async (context, user) => {
+  const statistics = await (USE_NATIVE_EXEC ? getNativeValidationCacheStatistics(context, user)
+    : getChildValidationCacheStatistics(context, user));
+  const checks = statistics.hits + statistics.misses;
+  return { ...statistics, hit_rate: checks > 0 ? statistics.hits / checks : 0 };
+};
 export const checkPythonAvailability = async (context, user) => {
   if (USE_NATIVE_EXEC) {
     return checkNativePythonAvailability(context, user);
@@ -1,68 +1,170 @@
+# Parsers are imported by their validator on first use, a process only loads
+# the ones of the pattern types it checks. Checks can run in concurrent threads.
+# pylint: disable=import-outside-toplevel
 import sys
+import threading
 
-import eql
-import plyara
-from parsuricata import parse_rules
-from sigma.parser.collection import SigmaCollectionParser
-from snort.snort_parser import Parser
-from stix2patterns.validator import run_validator
-from utils.runtime_utils import return_data
+from utils.runtime_utils import return_data, validate_stix_pattern
+from utils.validation_cache import ValidationCache
 
+# Results of the recent checks, disabled until configure_validation_cache
+VALIDATION_CACHE = ValidationCache()
 
-def check_indicator(pattern_type, indicator_value):  # pylint: disable=too-many-branches
-    if pattern_type == "stix":
-        result = False
-        try:
-            errors = run_validator(indicator_value)
-            if len(errors) == 0:
-                result = True
-        except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
+# One yara parser per thread, built one at a time as plyara writes its parsing
+# tables in the temporary directory
+YARA_PARSERS = threading.local()
+YARA_PARSER_LOCK = threading.Lock()
 
-    if pattern_type == "yara":
-        parser = plyara.Plyara()
-        try:
-            parser.parse_string(indicator_value)
-            result = True
-        except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
 
-    if pattern_type == "sigma":
+def validate_all(values, validate):
+    results = []
+    for value in values:
         try:
-            SigmaCollectionParser(indicator_value)
-            result = True
+            validate(value)
+            results.append(True)
         except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
+            results.append(False)
+    return results
 
-    if pattern_type == "snort":
-        try:
-            Parser(indicator_value)
-            result = True
-        except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
 
-    if pattern_type == "suricata":
-        try:
-            parse_rules(indicator_value)
-            result = True
-        except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
+def validate_stix(value):
+    if len(validate_stix_pattern(value)) > 0:
+        raise ValueError("Invalid STIX pattern")
 
-    if pattern_type == "eql":
-        try:
-            with eql.parser.elasticsearch_syntax, eql.parser.ignore_missing_functions:
-                eql.parse_query(indicator_value)
-            result = True
-        except:  # pylint: disable=bare-except
-            result = False
-        return {"status": "success", "data": result}
 
-    return {"status": "unknown", "data": None}
+def check_stix(values):
+    return validate_all(values, validate_stix)
+
+
+def yara_parser():
+    parser = getattr(YARA_PARSERS, "parser", None)
+    if parser is None:
+        import plyara
+
+        with YARA_PARSER_LOCK:
+            parser = plyara.Plyara()
+        YARA_PARSERS.parser = parser
+    return parser
+
+
+def validate_yara(value):
+    parser = yara_parser()
+    try:
+        parser.parse_string(value)
+    except:  # pylint: disable=bare-except
+        # Replaced after a failure, as its state is only partially reset by clear()
+        YARA_PARSERS.parser = None
+        raise
+    parser.clear()
+
+
+def check_yara(values):
+    return validate_all(values, validate_yara)
+
+
+def check_sigma(values):
+    from sigma.parser.collection import SigmaCollectionParser
+
+    return validate_all(values, SigmaCollectionParser)
+
+
+def check_snort(values):
+    from snort.snort_parser import Parser
+
+    return validate_all(values, Parser)
+
+
+def check_suricata(values):
+    from parsuricata import parse_rules
+
+    return validate_all(values, parse_rules)
+
+
+def check_eql(values):
+    import eql
+
+    with eql.parser.elasticsearch_syntax, eql.parser.ignore_missing_functions:
+        return validate_all(values, eql.parse_query)
+
+
+# Validator of each pattern type
+VALIDATORS = {
+    "stix": check_stix,
+    "yara": check_yara,
+    "sigma": check_sigma,
+    "snort": check_snort,
+    "suricata": check_suricata,
+    "eql": check_eql,
+}
+
+
+def check_values(pattern_type, values):
+    """Validity of the values, the ones checked recently read from the cache."""
+    cache = VALIDATION_CACHE
+    keys = [
+        (
+            cache.key(pattern_type, value)
+            if cache.enabled and isinstance(value, str)
+            else None
+        )
+        for value in values
+    ]
+    results = [None if key is None else cache.get(key) for key in keys]
+    missing = [index for index, result in enumerate(results) if result is None]
+    if len(missing) > 0:
+        checks = VALIDATORS[pattern_type]([values[index] for index in missing])
+        for index, check in zip(missing, checks):
+            results[index] = check
+            if keys[index] is not None:
+                cache.put(keys[index], check)
+    return results
+
+
+def configure_validation_cache(max_size, ttl):
+    VALIDATION_CACHE.configure(max_size, ttl)
+    return {"status": "success", "data": VALIDATION_CACHE.statistics()}
+
+
+def validation_cache_statistics():
+    return {"status": "success", "data": VALIDATION_CACHE.statistics()}
+
+
+def check_indicator(pattern_type, indicator_value):
+    if pattern_type not in VALIDATORS:
+        return {"status": "unknown", "data": None}
+    return {
+        "status": "success",
+        "data": check_values(pattern_type, [indicator_value])[0],
+    }
+
+
+def check_indicators_batch(items):
+    """Check a list of (pattern_type, indicator_value) pairs.
+
+    Items are grouped by pattern type to reuse one parser per type, results are
+    returned in the order of the items, each one as check_indicator would.
+    """
+    results = [None] * len(items)
+    groups = {}
+    for index, item in enumerate(items):
+        try:
+            pattern_type, indicator_value = item
+            group = groups.setdefault(pattern_type, [])
+        except (TypeError, ValueError):
+            results[index] = {"status": "error", "message": "Invalid item"}
+            continue
+        group.append((index, indicator_value))
+    for pattern_type, group in groups.items():
+        if pattern_type not in VALIDATORS:
+            for index, _ in group:
+                results[index] = {"status": "unknown", "data": None}
+            continue
+        checks = check_values(
+            pattern_type, [indicator_value for _, indicator_value in group]
+        )
+        for (index, _), check in zip(group, checks):
+            results[index] = {"status": "success", "data": check}
+    return {"status": "success", "data": results}
 
 
 if __name__ == "__main__":
@@ -0,0 +1,63 @@
+"""Resident runtime serving the scripts of this directory over stdin/stdout.
+
+The modules are imported once for the life of the process. Requests and
+responses are JSON documents, one per line, matched by the id of the request:
+
+    {"id": 1, "fn": "stix2_create_pattern", "args": ["Text", "test"]}
+    {"id": 1, "status": "success", "data": "[text:value = 'test']"}
+
+Requests are served one after another, in their order. The process stops when
+its stdin is closed.
+"""
+
+import json
+import sys
+
+from check_indicator import (
+    check_indicator,
+    check_indicators_batch,
+    configure_validation_cache,
+    validation_cache_statistics,
+)
+from stix2_create_pattern import stix2_create_pattern
+from utils.runtime_utils import write_frame
+
+
+def health():
+    return {"status": "success", "data": "ok"}
+
+
+FUNCTIONS = {
+    "check_indicator": check_indicator,
+    "check_indicators_batch": check_indicators_batch,
+    "stix2_create_pattern": stix2_create_pattern,
+    "configure_validation_cache": configure_validation_cache,
+    "validation_cache_statistics": validation_cache_statistics,
+    "health": health,
+}
+
+
+def serve(requests, output):
+    for line in requests:
+        if not line.strip():
+            continue
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get("id")
+            function = FUNCTIONS.get(request.get("fn"))
+            if function is None:
+                result = {"status": "error", "message": "Unknown function"}
+            else:
+                result = function(*request.get("args", []))
+        except Exception as e:  # pylint: disable=broad-except
+            result = {"status": "error", "message": str(e)}
+        write_frame(output, result, request_id)
+
+
+if __name__ == "__main__":
+    # Responses only on the real stdout, anything printed by the libraries goes
+    # to stderr
+    responses = sys.stdout
+    sys.stdout = sys.stderr
+    serve(sys.stdin, responses)
@@ -6,9 +6,7 @@ from stix2 import (
     ObservationExpression,
     OrBooleanExpression,
 )
-from stix2patterns.validator import run_validator
-
-from utils.runtime_utils import return_data
+from utils.runtime_utils import return_data, validate_stix_pattern
 
 PATTERN_MAPPING = {
     "Autonomous-System": ["number"],
@@ -81,7 +79,7 @@ def stix2_create_pattern(observable_type, observable_value):
         if ece is not None:
             pattern = ObservationExpression(ece)
     if pattern is not None:
-        errors = run_validator(str(pattern))
+        errors = validate_stix_pattern(str(pattern))
         if len(errors) > 0:
             return {
                 "status": "error",
@@ -1,15 +1,35 @@
 import json
 import sys
+import threading
 
-__all__ = ("return_data",)
+__all__ = ("return_data", "validate_stix_pattern", "write_frame")
 
+# The ANTLR runtime of stix2patterns shares its DFA caches between parsers
+STIX_VALIDATOR_LOCK = threading.Lock()
 
-def return_data(data):
+
+def write_frame(stream, data, request_id=None):
+    """Write data as one JSON line, with the id of its request if any."""
+    if request_id is not None:
+        data = {"id": request_id, **data}
     try:
-        print_data = json.dumps(data)
-        print(print_data)
+        frame = json.dumps(data)
     except Exception as e:
-        print(json.dumps({"status": "error", "message": str(e)}))
+        frame = json.dumps({"id": request_id, "status": "error", "message": str(e)})
+    stream.write(frame + "\n")
+    stream.flush()
+
+
+def validate_stix_pattern(pattern):
+    """Errors of the STIX pattern, patterns being validated one at a time."""
+    from stix2patterns.validator import (  # pylint: disable=import-outside-toplevel
+        run_validator,
+    )
 
-    sys.stdout.flush()
+    with STIX_VALIDATOR_LOCK:
+        return run_validator(pattern)
+
+
+def return_data(data):
+    write_frame(sys.stdout, data)
     sys.exit(0)
@@ -0,0 +1,73 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+__all__ = ("ValidationCache",)
+
+
+class ValidationCache:
+    """Recent results of the syntax checks, disabled while max_size is 0."""
+
+    def __init__(self, max_size=0, ttl=0):
+        self.lock = threading.Lock()
+        # Key -> (result, expiration time), least recently used first
+        self.entries = OrderedDict()
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def enabled(self):
+        return self.max_size > 0
+
+    def configure(self, max_size, ttl):
+        with self.lock:
+            self.max_size = max_size
+            self.ttl = ttl
+            self.entries.clear()
+
+    @staticmethod
+    def key(pattern_type, value):
+        # Trailing whitespace never changes the validity of a pattern
+        digest = hashlib.sha256(value.rstrip().encode("utf-8")).hexdigest()
+        return pattern_type, digest
+
+    def get(self, key):
+        """Result cached for the key, None if unknown or expired."""
+        with self.lock:
+            if self.max_size <= 0:
+                return None
+            entry = self.entries.get(key)
+            if entry is not None and entry[1] <= time.monotonic():
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, result):
+        with self.lock:
+            if self.max_size <= 0:
+                return
+            self.entries[key] = (result, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def statistics(self):
+        with self.lock:
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
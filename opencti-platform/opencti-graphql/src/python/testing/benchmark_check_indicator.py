@@ -0,0 +1,121 @@
+"""Throughput of check_indicator, one pattern per call or in batches.
+
+Both execution modes of the platform bridge are measured: in process (native
+mode, one call per pattern against one check_indicators_batch call) and with
+Python child processes (one process per pattern, then one request per pattern
+against one check_indicators_batch request to the resident runtime_server.py).
+
+    python src/python/testing/benchmark_check_indicator.py --items 2000
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+RUNTIME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../runtime")
+sys.path.insert(0, RUNTIME_PATH)
+
+# pylint: disable=wrong-import-position
+from check_indicator import check_indicator, check_indicators_batch  # noqa: E402
+
+PATTERNS = [
+    ("stix", "[ipv4-addr:value = '10.0.0.%d']"),
+    ("stix", "[domain-name:value = 'example-%d.com'] OR"),
+    ("yara", 'rule rule_%d { strings: $a = "test" condition: $a }'),
+    (
+        "sigma",
+        "title: Rule %d\nlogsource:\n  product: windows\n"
+        "detection:\n  selection:\n    Image: test.exe\n  condition: selection",
+    ),
+    ("snort", 'alert tcp any any -> any 80 (msg:"Rule"; sid:%d;)'),
+    ("suricata", 'alert tcp any any -> any 80 (msg:"Rule"; sid:%d;)'),
+    ("eql", 'process where process_name == "test_%d.exe"'),
+]
+
+
+def generate_items(count):
+    return [
+        [PATTERNS[index % len(PATTERNS)][0], PATTERNS[index % len(PATTERNS)][1] % index]
+        for index in range(count)
+    ]
+
+
+def run_child(args):
+    process = subprocess.run(
+        [sys.executable, "check_indicator.py"] + args,
+        cwd=RUNTIME_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(process.stdout)
+
+
+def run_server(requests):
+    process = subprocess.Popen(
+        [sys.executable, "runtime_server.py"],
+        cwd=RUNTIME_PATH,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    # Imports done before the first answer
+    process.stdin.write(json.dumps({"id": 0, "fn": "health"}) + "\n")
+    process.stdin.flush()
+    process.stdout.readline()
+    start = time.perf_counter()
+    results = []
+    for index, (fn, args) in enumerate(requests):
+        request = {"id": index + 1, "fn": fn, "args": args}
+        process.stdin.write(json.dumps(request) + "\n")
+        process.stdin.flush()
+        results.append(json.loads(process.stdout.readline()))
+    elapsed = time.perf_counter() - start
+    process.stdin.close()
+    process.wait()
+    return results, elapsed
+
+
+def report(name, count, elapsed):
+    print(
+        "%-24s %8d items %9.3f s %10.0f items/s"
+        % (name, count, elapsed, count / elapsed)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--items", type=int, default=2000)
+    parser.add_argument("--child-items", type=int, default=50)
+    args = parser.parse_args()
+
+    items = generate_items(args.items)
+    start = time.perf_counter()
+    single = [check_indicator(pattern_type, value) for pattern_type, value in items]
+    report("native single", len(items), time.perf_counter() - start)
+    start = time.perf_counter()
+    batch = check_indicators_batch(items)["data"]
+    report("native batch", len(items), time.perf_counter() - start)
+    assert single == batch, "Batch results differ from single calls"
+
+    # One interpreter started per pattern, so fewer patterns
+    child_items = items[: args.child_items]
+    start = time.perf_counter()
+    for pattern_type, value in child_items:
+        run_child([pattern_type, value])
+    report("child single", len(child_items), time.perf_counter() - start)
+    results, elapsed = run_server([("check_indicator", item) for item in items])
+    report("runtime server single", len(items), elapsed)
+    assert [
+        {"status": result["status"], "data": result["data"]} for result in results
+    ] == single, "Runtime server results differ from native calls"
+    results, elapsed = run_server([("check_indicators_batch", [items])])
+    report("runtime server batch", len(items), elapsed)
+    assert results[0]["data"] == single, "Runtime server batch results differ"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Cold start of the runtime scripts, as paid by the bridge and the child mode.
+
+Every scenario runs in a fresh interpreter started with -X importtime: the
+import of the script, then one check of the given pattern types. The report
+gives the time spent in imports, the wall time of the scenario and the peak
+memory of the interpreter, with the slowest imported packages.
+
+    python src/python/testing/benchmark_import_time.py --top 5
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+RUNTIME_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "../runtime")
+
+SAMPLES = {
+    "stix": "[ipv4-addr:value = '10.0.0.1']",
+    "yara": 'rule test { strings: $a = "test" condition: $a }',
+    "sigma": "title: Rule\nlogsource:\n  product: windows\n"
+    "detection:\n  selection:\n    Image: test.exe\n  condition: selection",
+    "snort": 'alert tcp any any -> any 80 (msg:"Rule"; sid:1;)',
+    "suricata": 'alert tcp any any -> any 80 (msg:"Rule"; sid:1;)',
+    "eql": 'process where process_name == "test.exe"',
+}
+
+SCENARIO = """
+import json, resource, time
+start = time.perf_counter()
+import %s
+import check_indicator
+for pattern_type, value in %r:
+    assert check_indicator.check_indicator(pattern_type, value)["data"] is True
+print(json.dumps({
+    "wall_ms": (time.perf_counter() - start) * 1000,
+    "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def parse_importtime(stderr):
+    """Self and cumulative time (us), and nesting depth of the imported modules."""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_time, cumulative, name = line.split(":", 1)[1].split("|")
+        if not self_time.strip().isdigit():
+            continue
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(self_time), int(cumulative), depth)
+    return modules
+
+
+def run_scenario(script, pattern_types):
+    items = [(pattern_type, SAMPLES[pattern_type]) for pattern_type in pattern_types]
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", SCENARIO % (script, items)],
+        cwd=RUNTIME_PATH,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    result = json.loads(process.stdout)
+    modules = parse_importtime(process.stderr)
+    result["import_ms"] = sum(self_time for self_time, _, _ in modules.values()) / 1000
+    # Modules imported by the scenario itself, slowest first
+    imported = [
+        (name, cumulative)
+        for name, (_, cumulative, depth) in modules.items()
+        if depth == 0
+    ]
+    result["slowest"] = sorted(imported, key=lambda module: -module[1])
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n", maxsplit=1)[0])
+    parser.add_argument("--script", default="check_indicator")
+    parser.add_argument("--top", type=int, default=3)
+    args = parser.parse_args()
+
+    scenarios = [("import", [])]
+    scenarios += [(pattern_type, [pattern_type]) for pattern_type in SAMPLES]
+    scenarios.append(("all", list(SAMPLES)))
+    for name, pattern_types in scenarios:
+        result = run_scenario(args.script, pattern_types)
+        slowest = ", ".join(
+            "%s %.0f ms" % (module, cumulative / 1000)
+            for module, cumulative in result["slowest"][: args.top]
+        )
+        print(
+            "%-10s imports %7.1f ms, wall %7.1f ms, %6.1f MB  (%s)"
+            % (
+                name,
+                result["import_ms"],
+                result["wall_ms"],
+                result["max_rss_mb"],
+                slowest,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,12 @@
 import { expect, it } from 'vitest';
-import { checkIndicatorSyntax, checkPythonAvailability, createStixPattern, execChildPython } from '../../../src/python/pythonBridge';
+import {
+  checkIndicatorSyntax,
+  checkIndicatorsSyntax,
+  checkPythonAvailability,
+  createStixPattern,
+  execChildPython,
+  getValidationCacheStatistics
+} from '../../../src/python/pythonBridge';
 import { ADMIN_USER, testContext } from '../../utils/testQuery';
 
 it('Check if python is well configured', async () => {
@@ -40,3 +47,39 @@ it('Check stix indicator bad pattern', async () => {
   const check = await checkIndicatorSyntax(testContext, ADMIN_USER, 'stix', '5.206.105.217');
   expect(check).toEqual(false);
 });
+
+it('Check indicators syntax in batch', async () => {
+  const check = await checkIndicatorsSyntax(testContext, ADMIN_USER, [
+    ['stix', '[ipv4-addr:value = \'195.206.105.217\']'],
+    ['yara', 'rule test { strings: $a = "test" condition: $a }'],
+    ['stix', '5.206.105.217'],
+    ['yara', 'rule test { strings $a = "test" condition: $a }'],
+    ['unknown', 'value'],
+    ['yara', 'rule other { condition: true }'],
+  ]);
+  expect(check).toEqual([true, true, false, false, null, true]);
+  expect(await checkIndicatorsSyntax(testContext, ADMIN_USER, [])).toEqual([]);
+});
+
+it('Check indicators syntax from the validation cache', async () => {
+  const pattern = 'rule cached { strings: $a = "cached" condition: $a }';
+  const before = await getValidationCacheStatistics(testContext, ADMIN_USER);
+  expect(await checkIndicatorSyntax(testContext, ADMIN_USER, 'yara', pattern)).toEqual(true);
+  expect(await checkIndicatorSyntax(testContext, ADMIN_USER, 'yara', `${pattern}\n`)).toEqual(true);
+  expect(await checkIndicatorsSyntax(testContext, ADMIN_USER, [['yara', pattern], ['yara', 'rule cached { strings $a = "cached" condition: $a }']])).toEqual([true, false]);
+  const after = await getValidationCacheStatistics(testContext, ADMIN_USER);
+  expect(after.hits - before.hits).toEqual(2);
+  expect(after.misses - before.misses).toEqual(2);
+  expect(after.hit_rate).toBeGreaterThan(0);
+});
+
+it('Check indicator syntax rejected when the python bridge is full', async () => {
+  // Checks over the size of the native pool and of its queue are not run
+  const checks = await Promise.allSettled(Array.from({ length: 1100 }, (_, index) => {
+    return checkIndicatorSyntax(testContext, ADMIN_USER, 'stix', `[ipv4-addr:value = '10.1.${Math.floor(index / 256)}.${index % 256}']`);
+  }));
+  const rejected = checks.filter(({ status }) => status === 'rejected');
+  expect(rejected.length).toBeGreaterThan(0);
+  expect(rejected[0].reason.name).toEqual('FUNCTIONAL_ERROR');
+  expect(checks.filter(({ status, value }) => status === 'fulfilled' && value !== true)).toEqual([]);
+});
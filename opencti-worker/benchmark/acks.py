@@ -0,0 +1,187 @@
+"""Throughput of message acknowledgment, one by one or in batches.
+
+A broker stand-in runs in a thread at the other end of a socket pair: every
+ack or reject is a frame written on the socket, and the stand-in applies the
+AMQP rules on delivery tags (a tag acked twice or unknown fails the run).
+Messages are delivered within a prefetch window and complete out of order on a
+pool of processing threads, some are rejected and some are parked for a while
+before completing, as with retries.
+
+    python benchmark/acks.py --messages 50000 --batch-sizes 0,10,100
+"""
+
+import argparse
+import os
+import queue
+import random
+import socket
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, List, Set
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from transport import AckBatcher  # noqa: E402  # pylint: disable=wrong-import-position
+
+FRAME = struct.Struct("!BQ")
+ACK, ACK_MULTIPLE, NACK = 1, 2, 3
+
+
+class BrokerStandIn(threading.Thread):
+    def __init__(self, sock: socket.socket, messages: int) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.sock = sock
+        self.messages = messages
+        self.lock = threading.Lock()
+        self.unacked: Set[int] = set()
+        self.resolved = 0
+        self.frames = 0
+        self.errors: List[str] = []
+
+    def deliver(self, delivery_tag: int) -> None:
+        with self.lock:
+            self.unacked.add(delivery_tag)
+
+    def run(self) -> None:
+        buffer = b""
+        while self.resolved < self.messages:
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return
+            buffer += chunk
+            while len(buffer) >= FRAME.size:
+                method, tag = FRAME.unpack_from(buffer)
+                buffer = buffer[FRAME.size :]
+                self.frames += 1
+                self.apply(method, tag)
+
+    def apply(self, method: int, tag: int) -> None:
+        with self.lock:
+            if method == ACK_MULTIPLE:
+                acked = {unacked for unacked in self.unacked if unacked <= tag}
+            elif tag in self.unacked:
+                acked = {tag}
+            else:
+                self.errors.append("unknown delivery tag %d" % tag)
+                return
+            self.unacked -= acked
+            self.resolved += len(acked)
+
+
+class StandInChannel:
+    is_open = True
+
+    def __init__(self, sock: socket.socket) -> None:
+        self.sock = sock
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self.sock.sendall(FRAME.pack(ACK_MULTIPLE if multiple else ACK, delivery_tag))
+
+    def basic_nack(self, delivery_tag: int) -> None:
+        self.sock.sendall(FRAME.pack(NACK, delivery_tag))
+
+
+class Connection:
+    """Thread running the channel callbacks, like the pika connections."""
+
+    def __init__(self) -> None:
+        self.callbacks: "queue.Queue[Callable[[], Any]]" = queue.Queue()
+        self.timers: List[Any] = []
+
+    def add_callback_threadsafe(self, callback: Callable[[], Any]) -> None:
+        self.callbacks.put(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> None:
+        self.timers.append((time.monotonic() + delay, callback))
+
+    def process_data_events(self, time_limit: float) -> None:
+        try:
+            self.callbacks.get(timeout=time_limit)()
+        except queue.Empty:
+            pass
+        now = time.monotonic()
+        for timer in [timer for timer in self.timers if timer[0] <= now]:
+            self.timers.remove(timer)
+            timer[1]()
+
+
+def run(messages: int, batch_size: int, threads: int, park_ratio: float) -> None:
+    client, server = socket.socketpair()
+    broker = BrokerStandIn(server, messages)
+    broker.start()
+    channel = StandInChannel(client)
+    connection = Connection()
+    batcher = (
+        AckBatcher(channel, batch_size, 0.05, connection.call_later)
+        if batch_size > 1
+        else None
+    )
+    pool = ThreadPoolExecutor(max_workers=threads)
+    done = [0]
+
+    def ack(tag: int) -> None:
+        done[0] += 1
+        if batcher is not None:
+            batcher.ack([tag])
+        else:
+            channel.basic_ack(tag)
+
+    def nack(tag: int) -> None:
+        done[0] += 1
+        if batcher is not None:
+            batcher.nack([tag])
+        else:
+            channel.basic_nack(tag)
+
+    def process(tag: int) -> None:
+        draw = random.random()
+        if draw < park_ratio:
+            time.sleep(0.01)
+        callback = nack if draw > 0.999 else ack
+        connection.add_callback_threadsafe(lambda: callback(tag))
+
+    # Room for the acks waiting for their batch, as the worker prefetch
+    prefetch = threads + (batch_size if batch_size > 1 else 0)
+    next_tag = 1
+    start = time.monotonic()
+    while done[0] < messages:
+        while next_tag <= messages and next_tag - 1 - broker.resolved < prefetch:
+            broker.deliver(next_tag)
+            if batcher is not None:
+                batcher.delivered(next_tag)
+            pool.submit(process, next_tag)
+            next_tag += 1
+        connection.process_data_events(0.001)
+    if batcher is not None:
+        batcher.flush()
+    broker.join(10)
+    elapsed = time.monotonic() - start
+    pool.shutdown()
+    print(
+        "batch %5d: %9.0f msg/s, %7d frames, %d unacked, %d errors"
+        % (
+            batch_size,
+            messages / elapsed,
+            broker.frames,
+            len(broker.unacked),
+            len(broker.errors),
+        )
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--batch-sizes", default="0,10,50,200")
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--park-ratio", type=float, default=0.001)
+    args = parser.parse_args()
+    for batch_size in args.batch_sizes.split(","):
+        run(args.messages, int(batch_size), args.threads, args.park_ratio)
+
+
+if __name__ == "__main__":
+    main()
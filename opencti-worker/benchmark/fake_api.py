@@ -0,0 +1,123 @@
+"""Stand-in for OpenCTIApiClient, with a configurable latency and error profile.
+
+Every call of the platform sleeps for the latency of the profile (plus a
+latency per imported object), then fails with the error rates of the profile,
+raising the errors the way pycti does so the worker takes its usual paths (the
+expectations of works never fail, pycti only logs their errors).
+"""
+
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from pycti.utils.opencti_logger import logger
+from requests.exceptions import Timeout
+
+# Messages of the errors raised by the platform, as found by the worker
+ERRORS = {
+    "lock": "LOCK_ERROR",
+    "missing_reference": "MISSING_REFERENCE_ERROR",
+    "bad_gateway": "502 Server Error: Bad Gateway",
+    "technical": "FUNCTIONAL_ERROR",
+}
+
+
+@dataclass
+class ApiProfile:
+    # Seconds per call and per imported object, jitter as a standard deviation
+    latency: float = 0.005
+    jitter: float = 0.001
+    object_latency: float = 0.0
+    # Probability of each error class ("timeout" and the keys of ERRORS)
+    error_rates: Dict[str, float] = field(default_factory=dict)
+
+    @staticmethod
+    def parse_error_rates(value: str) -> Dict[str, float]:
+        """Parse "lock=0.01,timeout=0.001"."""
+        rates = {}
+        for item in filter(None, value.split(",")):
+            name, rate = item.split("=")
+            if name != "timeout" and name not in ERRORS:
+                raise ValueError("Unknown error class " + name)
+            rates[name] = float(rate)
+        return rates
+
+
+class FakeStix2:
+    def __init__(self, api: "FakeApiClient") -> None:
+        self.api = api
+
+    def import_bundle(
+        self,
+        stix_bundle: Dict[str, Any],
+        update: bool = False,
+        types: Optional[List[str]] = None,
+        work_id: Any = None,
+    ) -> List[Any]:
+        objects = stix_bundle.get("objects", [])
+        self.api.call("import_bundle", len(objects))
+        return objects
+
+
+class FakeStix:
+    def __init__(self, api: "FakeApiClient") -> None:
+        self.api = api
+
+    def delete(self, **_kwargs: Any) -> None:
+        self.api.call("delete")
+
+    def merge(self, **_kwargs: Any) -> None:
+        self.api.call("merge")
+
+
+class FakeWork:
+    def __init__(self, api: "FakeApiClient") -> None:
+        self.api = api
+
+    # Errors of the expectations are only logged by pycti
+    def report_expectation(self, _work_id: str, _error: Any) -> None:
+        self.api.call("report_expectation", failures=False)
+
+    def add_expectations(self, _work_id: str, _expectations: int) -> None:
+        self.api.call("add_expectations", failures=False)
+
+
+class FakeApiClient:
+    def __init__(self, profile: ApiProfile, log_level: str = "error") -> None:
+        self.profile = profile
+        self.logger_class = logger(log_level.upper(), False)
+        self.session: Any = None
+        self.request_headers: Dict[str, str] = {}
+        self.stix2 = FakeStix2(self)
+        self.stix = FakeStix(self)
+        self.work = FakeWork(self)
+
+    def call(self, _name: str, objects: int = 0, failures: bool = True) -> None:
+        profile = self.profile
+        latency = random.gauss(profile.latency, profile.jitter)
+        time.sleep(max(0.0, latency + objects * profile.object_latency))
+        draw = random.random() if failures else 1.0
+        error = None
+        for error_class, rate in profile.error_rates.items():
+            if draw < rate:
+                error = error_class
+                break
+            draw -= rate
+        if error == "timeout":
+            raise Timeout("Read timed out (fake platform)")
+        if error is not None:
+            raise ValueError({"name": ERRORS[error], "message": "Fake platform"})
+
+    def set_applicant_id_header(self, applicant_id: Optional[str]) -> None:
+        self.request_headers["opencti-applicant-id"] = applicant_id or ""
+
+    def set_synchronized_upsert_header(self, synchronized: bool) -> None:
+        self.request_headers["synchronized-upsert"] = str(synchronized).lower()
+
+    def get_request_headers(self) -> Dict[str, str]:
+        return self.request_headers
+
+    def query(self, _query: str, _variables: Any = None) -> Dict[str, Any]:
+        self.call("query")
+        return {"data": {}}
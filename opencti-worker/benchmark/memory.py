@@ -0,0 +1,178 @@
+"""Peak memory of decoding a bundle, streamed or with a plain json.loads.
+
+For every bundle size, a fresh process generates a synthetic bundle of about
+that size (indicators, relationships and a report referencing them), keeps
+only its base64 content, as found in a message, then decodes it with one of
+the methods:
+
+- stream: decode_bundle, the base64 content decoded and parsed chunk by chunk
+- json.loads: the whole content decoded to bytes, then to a string, then
+  parsed, as before the incremental decoding
+
+The report gives the peak memory of the decoding over the memory held before
+it (the content), the memory still held once decoded (the objects) and the
+transient part of the peak (peak - held), which is what the worker pays on top
+of the objects for each bundle in flight. Peaks are read from VmHWM, reset
+before decoding, so the benchmark needs Linux.
+
+    python benchmark/memory.py --sizes 50,200,500 --methods stream,json.loads
+"""
+
+import argparse
+import base64
+import gc
+import json
+import multiprocessing
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterator, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from bundles import decode_bundle  # noqa: E402  # pylint: disable=wrong-import-position
+
+MB = 1024 * 1024
+
+
+def generate_objects(size: int, seed: int) -> Iterator[str]:
+    """JSON of the objects of a bundle, about size bytes in total."""
+    rng = random.Random(seed)
+    written = 0
+    index = 0
+    ids: List[str] = []
+    while written < size:
+        indicator_id = "indicator--%08d-0000-4000-8000-%012d" % (seed, index)
+        indicator = {
+            "type": "indicator",
+            "spec_version": "2.1",
+            "id": indicator_id,
+            "created": "2024-01-01T00:00:00.000Z",
+            "modified": "2024-01-01T00:00:00.000Z",
+            "name": "Indicator %d" % index,
+            "description": "%050x" % rng.getrandbits(200) * 4,
+            "pattern": "[ipv4-addr:value = '10.%d.%d.%d']"
+            % (index // 65536 % 256, index // 256 % 256, index % 256),
+            "pattern_type": "stix",
+            "valid_from": "2024-01-01T00:00:00.000Z",
+            "labels": ["malicious-activity"],
+            "confidence": rng.randint(0, 100),
+            "x_opencti_score": rng.randint(0, 100),
+            "object_marking_refs": [
+                "marking-definition--613f2e26-407d-48c7-9eca-b8e91df99dc9"
+            ],
+        }
+        relationship = {
+            "type": "relationship",
+            "spec_version": "2.1",
+            "id": "relationship--%08d-0000-4000-8000-%012d" % (seed, index),
+            "relationship_type": "indicates",
+            "source_ref": indicator_id,
+            "target_ref": "malware--%08d-0000-4000-8000-%012d" % (seed, index % 100),
+        }
+        for stix_object in (indicator, relationship):
+            text = json.dumps(stix_object)
+            written += len(text) + 1
+            yield text
+        ids.append(indicator_id)
+        index += 1
+    yield json.dumps(
+        {
+            "type": "report",
+            "spec_version": "2.1",
+            "id": "report--%08d-0000-4000-8000-000000000000" % seed,
+            "name": "Report",
+            "object_refs": ids,
+        }
+    )
+
+
+def bundle_content(size: int, seed: int) -> str:
+    text = '{"type": "bundle", "id": "bundle--%d", "objects": [%s]}' % (
+        seed,
+        ",".join(generate_objects(size, seed)),
+    )
+    return base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+
+def memory_status() -> Dict[str, int]:
+    status = {}
+    with open("/proc/self/status", encoding="utf-8") as f:
+        for line in f:
+            name, _, value = line.partition(":")
+            if name in ("VmRSS", "VmHWM"):
+                status[name] = int(value.split()[0]) * 1024
+    return status
+
+
+def reset_peak() -> None:
+    # Resets VmHWM to the current resident set size
+    with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+        f.write("5")
+
+
+def decode(method: str, content: str) -> Dict[str, Any]:
+    if method == "stream":
+        return decode_bundle(content)
+    return json.loads(base64.b64decode(content).decode("utf-8"))
+
+
+def run(method: str, size_mb: int, seed: int) -> Dict[str, Any]:
+    content = bundle_content(size_mb * MB, seed)
+    gc.collect()
+    reset_peak()
+    before = memory_status()["VmRSS"]
+    start = time.perf_counter()
+    bundle = decode(method, content)
+    elapsed = time.perf_counter() - start
+    status = memory_status()
+    return {
+        "method": method,
+        "size_mb": size_mb,
+        "objects": len(bundle["objects"]),
+        "content_mb": len(content) / MB,
+        "decode_s": elapsed,
+        "peak_mb": (status["VmHWM"] - before) / MB,
+        "held_mb": (status["VmRSS"] - before) / MB,
+        "transient_mb": (status["VmHWM"] - status["VmRSS"]) / MB,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--sizes", default="50,200,500", help="bundle sizes in MB")
+    parser.add_argument("--methods", default="stream,json.loads")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="one JSON line per run")
+    args = parser.parse_args()
+    for size in args.sizes.split(","):
+        for method in args.methods.split(","):
+            if method not in ("stream", "json.loads"):
+                parser.error("unknown method " + method)
+            # One process per run, for its own peak memory
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = executor.submit(run, method, int(size), args.seed).result()
+            if args.json:
+                print(json.dumps(result))
+                continue
+            print(
+                "%4d MB %-10s %8d objects, %6.1f s, peak %7.1f MB, "
+                "held %7.1f MB, transient %7.1f MB"
+                % (
+                    result["size_mb"],
+                    result["method"],
+                    result["objects"],
+                    result["decode_s"],
+                    result["peak_mb"],
+                    result["held_mb"],
+                    result["transient_mb"],
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
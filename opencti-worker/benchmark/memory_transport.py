@@ -0,0 +1,171 @@
+"""In-process broker and transport, to run the worker consumers without RabbitMQ.
+
+The transport follows the AMQP rules the worker relies on: deliveries within
+the prefetch window, acks of unknown tags closing the channel, nacks and
+closing the transport giving the messages back to the queue.
+"""
+
+import heapq
+import itertools
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from queue import Empty, SimpleQueue
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from transport import Transport  # noqa: E402  # pylint: disable=wrong-import-position
+
+
+@dataclass
+class Message:
+    body: bytes
+    priority: Optional[int] = None
+    delivered: float = 0
+    deliveries: int = 0
+
+
+class MemoryBroker:
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.queues: Dict[str, Deque[Message]] = {}
+        # Time between the delivery and the ack of the acked messages
+        self.latencies: List[float] = []
+        self.acked = 0
+        self.requeued = 0
+        self.errors: List[str] = []
+
+    def publish(
+        self, queue_name: str, body: bytes, priority: Optional[int] = None
+    ) -> None:
+        with self.lock:
+            self.queues.setdefault(queue_name, deque()).append(Message(body, priority))
+
+    def get(self, queue_name: str) -> Optional[Message]:
+        with self.lock:
+            messages = self.queues.get(queue_name)
+            if not messages:
+                return None
+            message = messages.popleft()
+        message.delivered = time.monotonic()
+        message.deliveries += 1
+        return message
+
+    def depth(self, queue_name: str) -> int:
+        with self.lock:
+            return len(self.queues.get(queue_name, ()))
+
+    def ack(self, messages: List[Message]) -> None:
+        now = time.monotonic()
+        with self.lock:
+            self.acked += len(messages)
+            self.latencies.extend(now - message.delivered for message in messages)
+
+    def requeue(self, queue_name: str, messages: List[Message]) -> None:
+        with self.lock:
+            self.requeued += len(messages)
+            self.queues.setdefault(queue_name, deque()).extendleft(reversed(messages))
+
+
+class MemoryTransport(Transport):
+    def __init__(self, broker: MemoryBroker) -> None:
+        self.broker = broker
+        self.queue_name = ""
+        self.open = True
+        self.consuming = False
+        self.prefetch = 0
+        self.delivery_tags = itertools.count(1)
+        self.unacked: "OrderedDict[int, Message]" = OrderedDict()
+        self.callbacks: "SimpleQueue[Callable[[], Any]]" = SimpleQueue()
+        self.timers: List[Tuple[float, int, Callable[[], Any]]] = []
+        self.timers_sequence = itertools.count()
+
+    @property
+    def is_open(self) -> bool:
+        return self.open
+
+    def consume(
+        self, queue: str, on_message: Callable[[int, Optional[int], bytes], None]
+    ) -> None:
+        self.queue_name = queue
+        self.consuming = True
+        while self.consuming and self.open:
+            delivered = False
+            while self.open and (
+                self.prefetch == 0 or len(self.unacked) < self.prefetch
+            ):
+                message = self.broker.get(queue)
+                if message is None:
+                    break
+                delivery_tag = next(self.delivery_tags)
+                self.unacked[delivery_tag] = message
+                on_message(delivery_tag, message.priority, message.body)
+                delivered = True
+            self.process_events(0 if delivered else 0.005)
+
+    def stop_consuming(self) -> None:
+        self.consuming = False
+
+    def basic_qos(self, prefetch_count: int) -> None:
+        self.prefetch = prefetch_count
+
+    def resolve(self, delivery_tag: int, multiple: bool) -> List[Message]:
+        if not self.open:
+            raise ConnectionError("Channel is closed")
+        if delivery_tag not in self.unacked:
+            # PRECONDITION_FAILED closes the channel
+            self.broker.errors.append("unknown delivery tag %d" % delivery_tag)
+            self.close()
+            return []
+        tags = [tag for tag in self.unacked if tag <= delivery_tag]
+        return [self.unacked.pop(tag) for tag in (tags if multiple else [delivery_tag])]
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self.broker.ack(self.resolve(delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag: int) -> None:
+        self.broker.requeue(self.queue_name, self.resolve(delivery_tag, False))
+
+    def add_callback_threadsafe(self, callback: Callable[[], Any]) -> None:
+        self.callbacks.put(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> Any:
+        heapq.heappush(
+            self.timers,
+            (time.monotonic() + delay, next(self.timers_sequence), callback),
+        )
+
+    def process_events(self, timeout: float) -> None:
+        if self.timers:
+            timeout = max(0, min(timeout, self.timers[0][0] - time.monotonic()))
+        try:
+            callback = self.callbacks.get(timeout=timeout) if timeout > 0 else None
+            while True:
+                if callback is not None:
+                    callback()
+                callback = self.callbacks.get_nowait()
+        except Empty:
+            pass
+        now = time.monotonic()
+        while self.timers and self.timers[0][0] <= now:
+            heapq.heappop(self.timers)[2]()
+
+    def sleep(self, duration: float) -> None:
+        deadline = time.monotonic() + duration
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            self.process_events(remaining)
+
+    def close(self) -> None:
+        if not self.open:
+            return
+        self.open = False
+        self.consuming = False
+        self.broker.requeue(self.queue_name, list(self.unacked.values()))
+        self.unacked.clear()
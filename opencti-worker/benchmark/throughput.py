@@ -0,0 +1,219 @@
+"""Throughput of a queue consumer, without RabbitMQ nor platform.
+
+The worker Consumer runs on the in-process broker and transport, its API
+clients are fakes answering with a configurable latency and error profile. For
+every concurrency setting, a fresh process consumes the same generated queue
+(same seed) and reports messages/sec, p50/p99 of the processing latency (from
+the delivery to the ack of a message) and its peak memory.
+
+    python benchmark/throughput.py --messages 2000 --concurrency 1,4,16 \\
+        --latency 0.01 --error-rates lock=0.01,timeout=0.001
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from caches import DedupCache  # noqa: E402
+from fake_api import ApiProfile, FakeApiClient  # noqa: E402
+from memory_transport import MemoryBroker, MemoryTransport  # noqa: E402
+from transport import Transport  # noqa: E402
+from worker import Consumer  # noqa: E402
+
+QUEUE = "push_benchmark"
+CONNECTOR = {
+    "id": "benchmark",
+    "name": "Benchmark",
+    "config": {
+        "push": QUEUE,
+        "connection": {
+            "host": "memory",
+            "port": 0,
+            "vhost": "/",
+            "user": "",
+            "pass": "",
+            "use_ssl": False,
+        },
+    },
+}
+# Retries are part of the load, not of the waiting time
+RETRY_POLICIES = {
+    name: {"delay": 0.05, "jitter": 0.05}
+    for name in ("timeout", "lock", "missing_reference", "bad_gateway")
+}
+
+
+@dataclass
+class Settings:
+    messages: int
+    concurrency: int
+    objects: int
+    works: int
+    seed: int
+    ordering: str
+    ack_batch_size: int
+    duplicate_ratio: float = 0.0
+    dedup_cache_size: int = 0
+    profile: ApiProfile = field(default_factory=ApiProfile)
+
+
+@dataclass(unsafe_hash=True)
+class BenchmarkConsumer(Consumer):  # pylint: disable=too-many-ancestors
+    broker: Any = field(default=None, hash=False, compare=False)
+    profile: Any = field(default=None, hash=False, compare=False)
+
+    def create_api(self) -> Any:
+        return FakeApiClient(self.profile, self.log_level)
+
+    def create_transport(self) -> Transport:
+        return MemoryTransport(self.broker)
+
+
+def bundle_message(index: int, settings: Settings) -> bytes:
+    if index > 0 and random.random() < settings.duplicate_ratio:
+        # Same objects as an earlier message, as sent again by feeds
+        index = random.randrange(index)
+    objects = [
+        {
+            "type": "indicator",
+            "spec_version": "2.1",
+            "id": "indicator--%08d-0000-4000-8000-%012d" % (index, number),
+            "name": "Indicator %d.%d" % (index, number),
+            "pattern": "[ipv4-addr:value = '10.%d.%d.%d']"
+            % (number % 256, index // 256 % 256, index % 256),
+            "pattern_type": "stix",
+        }
+        for number in range(settings.objects)
+    ]
+    bundle = {"type": "bundle", "id": "bundle--%d" % index, "objects": objects}
+    content = base64.b64encode(json.dumps(bundle).encode("utf-8")).decode("utf-8")
+    message = {
+        "type": "bundle",
+        "applicant_id": "benchmark",
+        "work_id": "work_%d" % random.randrange(settings.works),
+        "content": content,
+        "update": True,
+    }
+    return json.dumps(message).encode("utf-8")
+
+
+def percentile(values: List[float], ratio: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+
+def run(settings: Settings) -> Dict[str, Any]:
+    random.seed(settings.seed)
+    broker = MemoryBroker()
+    for index in range(settings.messages):
+        broker.publish(QUEUE, bundle_message(index, settings))
+    config = {"worker": {"retry_policies": RETRY_POLICIES}}
+    consumer = BenchmarkConsumer(
+        CONNECTOR,
+        config,
+        "http://benchmark",
+        "benchmark",
+        "critical",
+        execution_pool_size=settings.concurrency,
+        ordering=settings.ordering,
+        ack_batch_size=settings.ack_batch_size,
+        dedup_cache=(
+            DedupCache(settings.dedup_cache_size, 3600)
+            if settings.dedup_cache_size > 0
+            else None
+        ),
+        broker=broker,
+        profile=settings.profile,
+    )
+    start = time.monotonic()
+    consumer.start()
+    while broker.acked < settings.messages and consumer.is_alive():
+        time.sleep(0.01)
+    elapsed = time.monotonic() - start
+    consumer.drain()
+    consumer.join()
+    consumer.retry_scheduler.stop()
+    return {
+        "concurrency": settings.concurrency,
+        "msg_per_s": broker.acked / elapsed,
+        "p50_ms": percentile(broker.latencies, 0.5) * 1000,
+        "p99_ms": percentile(broker.latencies, 0.99) * 1000,
+        # Kilobytes on Linux
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "requeued": broker.requeued,
+        "errors": len(broker.errors),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--concurrency", default="1,4,16,32")
+    parser.add_argument("--objects", type=int, default=10)
+    parser.add_argument("--works", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--ordering", default="work", choices=["work", "entities"])
+    parser.add_argument("--ack-batch-size", type=int, default=0)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.0)
+    parser.add_argument("--dedup-cache-size", type=int, default=0)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--jitter", type=float, default=0.001)
+    parser.add_argument("--object-latency", type=float, default=0.0)
+    parser.add_argument("--error-rates", default="")
+    parser.add_argument("--json", action="store_true", help="one JSON line per run")
+    args = parser.parse_args()
+    profile = ApiProfile(
+        args.latency,
+        args.jitter,
+        args.object_latency,
+        ApiProfile.parse_error_rates(args.error_rates),
+    )
+    for concurrency in args.concurrency.split(","):
+        settings = Settings(
+            args.messages,
+            int(concurrency),
+            args.objects,
+            args.works,
+            args.seed,
+            args.ordering,
+            args.ack_batch_size,
+            args.duplicate_ratio,
+            args.dedup_cache_size,
+            profile,
+        )
+        # One process per run, for its own peak memory
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            result = executor.submit(run, settings).result()
+        if args.json:
+            print(json.dumps({**asdict(settings), **result}))
+            continue
+        print(
+            "concurrency %3d: %8.1f msg/s, p50 %7.1f ms, p99 %7.1f ms, "
+            "%6.1f MB, %d requeued, %d errors"
+            % (
+                result["concurrency"],
+                result["msg_per_s"],
+                result["p50_ms"],
+                result["p99_ms"],
+                result["max_rss_mb"],
+                result["requeued"],
+                result["errors"],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
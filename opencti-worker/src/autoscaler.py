@@ -0,0 +1,209 @@
+# coding: utf-8
+
+
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+import pika
+from opentelemetry import metrics
+from opentelemetry.metrics import Observation
+from transport import build_pika_parameters
+
+meter = metrics.get_meter(__name__)
+
+
+# Priority classes of the queues, interactive work is processed first and bulk
+# ingestion uses the spare capacity
+PRIORITY_CLASSES = {"bulk": 0, "default": 1, "interactive": 2}
+CONNECTOR_TYPES_PRIORITY_CLASSES = {
+    "EXTERNAL_IMPORT": "bulk",
+    "INTERNAL_ENRICHMENT": "interactive",
+    "INTERNAL_IMPORT_FILE": "interactive",
+}
+
+
+def broker_key(connector: Dict[str, Any]) -> Tuple[Any, ...]:
+    settings = connector["config"]["connection"]
+    return tuple(
+        settings[name] for name in ("host", "port", "vhost", "user", "use_ssl")
+    )
+
+
+def allocate_slots(
+    demands: Dict[str, int],
+    budget: int,
+    priorities: Optional[Dict[str, int]] = None,
+) -> Dict[str, int]:
+    # Max-min fair share of the budget: every queue gets one slot, then queues
+    # asking for less than an equal share of the rest are fully served and what
+    # they leave is shared again between the bigger ones. Queues of a priority
+    # class are served before the ones of the lower classes.
+    priorities = priorities or {}
+    allocation = {queue: 1 for queue in demands}
+    remaining = budget - len(demands)
+    for tier in sorted({priorities.get(queue, 0) for queue in demands}, reverse=True):
+        pending = sorted(
+            (
+                queue
+                for queue, demand in demands.items()
+                if demand > 1 and priorities.get(queue, 0) == tier
+            ),
+            key=lambda queue: demands[queue],
+        )
+        while len(pending) > 0 and remaining > 0:
+            share = remaining // len(pending)
+            queue = pending[0]
+            if demands[queue] - 1 <= share:
+                allocation[queue] = demands[queue]
+                remaining -= demands[queue] - 1
+                pending.pop(0)
+                continue
+            for queue in pending:
+                allocation[queue] += share
+            # Leftover of the division goes to the biggest demands
+            for queue in pending[len(pending) - remaining % len(pending) :]:
+                allocation[queue] += 1
+            remaining = 0
+    return allocation
+
+
+class Autoscaler(threading.Thread):
+    """Share a global concurrency budget between the consumed queues.
+
+    Queue depths are read with passive declares, processing rates from the
+    messages acknowledged by each consumer. Each queue asks for enough slots to
+    drain its backlog within the latency target, idle queues keep one slot, and
+    the budget is shared with max-min fairness, priority class by priority class.
+    Slots are applied as the prefetch of the consumer channel, bounding the
+    messages processed in parallel.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        worker_logger: Any,
+        config: Dict[str, Any],
+        budget: int,
+        max_queue_slots: int,
+        interval: int = 15,
+        latency_target: int = 300,
+    ) -> None:
+        threading.Thread.__init__(self, daemon=True)
+        self.worker_logger = worker_logger
+        self.config = config
+        self.budget = budget
+        self.max_queue_slots = max_queue_slots
+        self.interval = interval
+        self.latency_target = latency_target
+        self.exit_event = threading.Event()
+        # Consumers of the worker engine, keyed by queue name
+        self.consumers: Dict[str, Any] = {}
+        self.channels: Dict[Tuple[Any, ...], Any] = {}
+        self.samples: Dict[str, Tuple[float, int]] = {}
+        self.depths: Dict[str, int] = {}
+        meter.create_observable_gauge(
+            name="opencti_worker_queue_depth",
+            callbacks=[self.observe_depths],
+            description="number of messages ready in the queue",
+        )
+        meter.create_observable_gauge(
+            name="opencti_worker_queue_concurrency",
+            callbacks=[self.observe_concurrency],
+            description="number of messages of the queue processed in parallel",
+        )
+
+    def queue_depth(self, consumer: Any) -> Optional[int]:
+        key = broker_key(consumer.connector)
+        try:
+            channel = self.channels.get(key)
+            if channel is None or not channel.is_open:
+                connection = pika.BlockingConnection(
+                    build_pika_parameters(consumer.connector, self.config)
+                )
+                channel = connection.channel()
+                self.channels[key] = channel
+            frame = channel.queue_declare(consumer.queue_name, passive=True)
+            return int(frame.method.message_count)
+        except Exception as e:  # pylint: disable=broad-except
+            # Queue deleted or broker unreachable, try again next round
+            self.worker_logger.warning(
+                "Unable to read the queue depth",
+                {"queue": consumer.queue_name, "reason": str(e)},
+            )
+            channel = self.channels.pop(key, None)
+            if channel is not None and channel.connection.is_open:
+                channel.connection.close()
+            return None
+
+    def demand(self, consumer: Any, depth: Optional[int], now: float) -> int:
+        previous = self.samples.get(consumer.queue_name)
+        self.samples[consumer.queue_name] = (now, consumer.processed)
+        if depth is None:
+            demand = consumer.concurrency
+        elif depth == 0:
+            # Nothing waiting, keep the slots in use
+            demand = consumer.in_flight
+        elif previous is None or consumer.processed == previous[1]:
+            # No throughput known yet, probe with more slots
+            demand = consumer.concurrency * 2
+        else:
+            rate = (consumer.processed - previous[1]) / max(now - previous[0], 1)
+            slot_rate = rate / max(consumer.concurrency, 1)
+            demand = int(depth / (slot_rate * self.latency_target)) + 1
+        return int(max(1, min(demand, self.max_queue_slots)))
+
+    def scale(self) -> Dict[str, int]:
+        now = time.monotonic()
+        consumers = {
+            queue: consumer
+            for queue, consumer in list(self.consumers.items())
+            if consumer.is_alive()
+        }
+        demands: Dict[str, int] = {}
+        for queue, consumer in consumers.items():
+            depth = self.queue_depth(consumer)
+            if depth is not None:
+                self.depths[queue] = depth
+            demands[queue] = self.demand(consumer, depth, now)
+        priorities = {
+            queue: PRIORITY_CLASSES.get(consumer.priority_class, 1)
+            for queue, consumer in consumers.items()
+        }
+        allocation = allocate_slots(demands, self.budget, priorities)
+        for queue, slots in allocation.items():
+            consumer = consumers[queue]
+            if slots != consumer.concurrency:
+                self.worker_logger.info(
+                    "Queue concurrency updated",
+                    {
+                        "queue": queue,
+                        "depth": self.depths.get(queue),
+                        "from": consumer.concurrency,
+                        "to": slots,
+                    },
+                )
+                consumer.set_concurrency(slots)
+        for queue in list(self.depths):
+            if queue not in consumers:
+                self.depths.pop(queue)
+                self.samples.pop(queue, None)
+        return allocation
+
+    def observe_depths(self, _options: Any) -> Iterable[Observation]:
+        for queue, depth in list(self.depths.items()):
+            yield Observation(depth, {"queue": queue})
+
+    def observe_concurrency(self, _options: Any) -> Iterable[Observation]:
+        for queue, consumer in list(self.consumers.items()):
+            yield Observation(consumer.concurrency, {"queue": queue})
+
+    def run(self) -> None:
+        self.worker_logger.info("Starting Autoscaler thread")
+        while not self.exit_event.wait(self.interval):
+            try:
+                self.scale()
+            except Exception as e:  # pylint: disable=broad-except
+                self.worker_logger.error(type(e).__name__, {"reason": str(e)})
+
+    def stop(self) -> None:
+        self.exit_event.set()
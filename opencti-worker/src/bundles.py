@@ -0,0 +1,285 @@
+# coding: utf-8
+
+
+import base64
+import binascii
+import codecs
+import hashlib
+import json
+import re
+import sys
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+# References linking the objects of a bundle, stix ids in these fields are
+# upserted or resolved by the platform when the bundle is imported
+ENTITIES_REFS = ("object_refs", "source_ref", "target_ref", "sighting_of_ref")
+SHARED_ENTITIES_TYPES = ("marking-definition",)
+
+
+def bundle_entities_ids(objects: List[Dict[str, Any]]) -> Set[str]:
+    """Stix ids a bundle writes to or depends on.
+
+    Markings and authors (created_by_ref) are shared by nearly every bundle of a
+    connector and would order all its bundles one after another, they are left out.
+    """
+    authors = set(o["created_by_ref"] for o in objects if "created_by_ref" in o)
+    ids = set()
+    for stix_object in objects:
+        if stix_object.get("type") in SHARED_ENTITIES_TYPES:
+            continue
+        if "id" in stix_object and stix_object["id"] not in authors:
+            ids.add(stix_object["id"])
+        for ref in ENTITIES_REFS:
+            value = stix_object.get(ref)
+            if isinstance(value, str):
+                ids.add(value)
+            elif isinstance(value, list):
+                ids.update(v for v in value if isinstance(v, str))
+    return ids
+
+
+# Decoded text kept in memory while parsing a bundle, in base64 characters
+BASE64_CHUNK_SIZE: int = 4 * 1024 * 1024
+JSON_WHITESPACES = " \t\n\r"
+JSON_DELIMITERS = JSON_WHITESPACES + ",:]}"
+
+
+def iter_base64_text(content: str, chunk_size: int) -> Iterator[str]:
+    """Text of a base64 encoded utf-8 content, decoded chunk by chunk."""
+    if "\n" in content:
+        # Wrapped base64 cannot be cut on 4 characters boundaries
+        content = content.replace("\n", "")
+    chunk_size -= chunk_size % 4
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for start in range(0, len(content), chunk_size):
+        yield decoder.decode(binascii.a2b_base64(content[start : start + chunk_size]))
+    yield decoder.decode(b"", final=True)
+
+
+def intern_keys(pairs: List[Tuple[str, Any]]) -> Dict[str, Any]:
+    return {sys.intern(key): value for key, value in pairs}
+
+
+class JsonStreamReader:
+    """Reads JSON values one by one from text arriving in chunks."""
+
+    def __init__(self, chunks: Iterator[str]) -> None:
+        self.chunks = chunks
+        # Values are decoded one by one, keys must be shared across objects
+        self.decoder = json.JSONDecoder(object_pairs_hook=intern_keys)
+        self.buffer = ""
+        self.position = 0
+        self.eof = False
+
+    def fill(self) -> bool:
+        for chunk in self.chunks:
+            if len(chunk) > 0:
+                self.buffer = self.buffer[self.position :] + chunk
+                self.position = 0
+                return True
+        self.eof = True
+        return False
+
+    def skip_whitespaces(self) -> None:
+        while True:
+            while (
+                self.position < len(self.buffer)
+                and self.buffer[self.position] in JSON_WHITESPACES
+            ):
+                self.position += 1
+            if self.position < len(self.buffer) or not self.fill():
+                return
+
+    def consume(self, char: str) -> bool:
+        self.skip_whitespaces()
+        if self.buffer.startswith(char, self.position):
+            self.position += 1
+            return True
+        return False
+
+    def expect(self, char: str) -> None:
+        if not self.consume(char):
+            raise ValueError("Invalid JSON, expecting " + char)
+
+    def value(self) -> Any:
+        self.skip_whitespaces()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.position)
+                # A number cut by the chunk ("12" of "12.5") must be completed
+                if self.eof or (
+                    end < len(self.buffer) and self.buffer[end] in JSON_DELIMITERS
+                ):
+                    self.position = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+
+def decode_bundle(content: str, chunk_size: int = BASE64_CHUNK_SIZE) -> Dict[str, Any]:
+    """Bundle from its base64 content.
+
+    Objects are parsed one after another while the content is decoded, so the
+    whole decoded text (bytes, then string) is never held in memory.
+    """
+    reader = JsonStreamReader(iter_base64_text(content, chunk_size))
+    bundle: Dict[str, Any] = {}
+    reader.expect("{")
+    if reader.consume("}"):
+        return bundle
+    while True:
+        key = reader.value()
+        reader.expect(":")
+        if key == "objects" and reader.consume("["):
+            objects: List[Any] = []
+            if not reader.consume("]"):
+                while True:
+                    objects.append(reader.value())
+                    if reader.consume("]"):
+                        break
+                    reader.expect(",")
+            bundle[key] = objects
+        else:
+            bundle[key] = reader.value()
+        if reader.consume("}"):
+            return bundle
+        reader.expect(",")
+
+
+# Fields of the ids collected by scan_entities_ids, with a complete value: string,
+# list or any other value up to its delimiter
+IDS_FIELD_PATTERN = re.compile(
+    r'"(id|created_by_ref|%s)"\s*:\s*'
+    r'(?:"([^"\\]*(?:\\.[^"\\]*)*)"|(\[[^\]]*\])|[^\s"\[][^,}\]]*[,}\]])'
+    % "|".join(ENTITIES_REFS)
+)
+# Field of IDS_FIELD_PATTERN whose value is cut by the end of the text
+IDS_FIELD_NAME_PATTERN = re.compile(
+    r'"(id|created_by_ref|%s)"\s*(:|$)' % "|".join(ENTITIES_REFS)
+)
+STRING_PATTERN = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"')
+
+
+def json_string(value: str) -> str:
+    return json.loads('"' + value + '"') if "\\" in value else value
+
+
+def scan_entities_ids(content: str, chunk_size: int = BASE64_CHUNK_SIZE) -> Set[str]:
+    """Ids of bundle_entities_ids, read from the base64 content of the bundle.
+
+    Only the fields holding ids are matched in the decoded text, chunk by chunk,
+    without parsing the objects. Ids of nested objects are included as well,
+    which can only order the bundle after more others.
+    """
+    authors: Set[str] = set()
+    objects_ids: Set[str] = set()
+    ids: Set[str] = set()
+    text = ""
+    for chunk in iter_base64_text(content, chunk_size):
+        text += chunk
+        end = 0
+        for match in IDS_FIELD_PATTERN.finditer(text):
+            end = match.end()
+            field, value, values = match.groups()
+            if value is not None:
+                value = json_string(value)
+                if field == "id":
+                    objects_ids.add(value)
+                elif field == "created_by_ref":
+                    authors.add(value)
+                else:
+                    ids.add(value)
+            elif values is not None and field != "id" and field != "created_by_ref":
+                ids.update(json_string(v) for v in STRING_PATTERN.findall(values))
+        # Keep a field cut by the chunk, with its value
+        pending = IDS_FIELD_NAME_PATTERN.search(text, end)
+        text = text[pending.start() if pending else max(end, len(text) - 32) :]
+    # Ids of the bundle itself and of the shared objects are left out
+    ignored = tuple(t + "--" for t in ("bundle",) + SHARED_ENTITIES_TYPES)
+    ids.update(i for i in objects_ids - authors if not i.startswith(ignored))
+    return ids
+
+
+def decode_event(content: str) -> Dict[str, Any]:
+    # json accepts utf-8 bytes, no need of a decoded string copy
+    return json.loads(binascii.a2b_base64(content))
+
+
+def message_source(data: Dict[str, Any]) -> str:
+    # Content reported with errors, only decoded again when small enough
+    if "content" not in data:
+        return "Unparseable"
+    if len(data["content"]) >= 50000 * 4 // 3:
+        return "Bundle too large"
+    try:
+        return base64.b64decode(data["content"]).decode("utf-8")
+    except ValueError:
+        return "Unparseable"
+
+
+@dataclass
+class CoalescedEvent:
+    connection: Any
+    channel: Any
+    delivery_tag: int
+    data: Dict[str, Any]
+    event: Dict[str, Any]
+
+
+def coalescable_event(data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    # Create and update events hold the whole state of the entity
+    if "type" not in data or data["type"] != "event":
+        return None
+    event = decode_event(data["content"])
+    if event["type"] in ("create", "update"):
+        return event
+    return None
+
+
+# Import order of the objects of a split bundle, so each batch mostly references
+# objects of the previous batches. Containers reference everything, they go last.
+SPLIT_TYPES_ORDER = {
+    "marking-definition": 0,
+    "identity": 1,
+    "relationship": 3,
+    "sighting": 4,
+    "report": 5,
+    "grouping": 5,
+    "note": 5,
+    "opinion": 5,
+    "observed-data": 5,
+    "case-incident": 5,
+    "case-rfi": 5,
+    "case-rft": 5,
+}
+
+
+def split_bundle(
+    objects: List[Dict[str, Any]], max_size: int
+) -> List[List[Dict[str, Any]]]:
+    """Objects in dependency order, cut in batches of about max_size bytes."""
+    ordered = sorted(objects, key=lambda o: SPLIT_TYPES_ORDER.get(o.get("type"), 2))
+    batches: List[List[Dict[str, Any]]] = []
+    batch: List[Dict[str, Any]] = []
+    batch_size = 0
+    for stix_object in ordered:
+        object_size = len(json.dumps(stix_object))
+        if len(batch) > 0 and batch_size + object_size > max_size:
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(stix_object)
+        batch_size += object_size
+    if len(batch) > 0:
+        batches.append(batch)
+    return batches
+
+
+def object_hash(stix_object: Dict[str, Any]) -> str:
+    canonical = json.dumps(
+        stix_object, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
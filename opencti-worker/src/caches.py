@@ -0,0 +1,246 @@
+# coding: utf-8
+
+
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from opentelemetry import metrics
+
+meter = metrics.get_meter(__name__)
+dedup_objects_counter = meter.create_counter(
+    name="opencti_worker_dedup_objects",
+    description="objects checked against the deduplication cache (hit, miss, evicted)",
+)
+version_index_objects_counter = meter.create_counter(
+    name="opencti_worker_version_index_objects",
+    description="objects compared with the version index (changed, unchanged)"
+    " or removed from it (expired, evicted)",
+)
+
+
+class DedupCache:
+    """Canonical hashes of the objects imported recently, to skip them when sent again.
+
+    The cache is bounded (least recently used hashes evicted first) and entries
+    expire ttl seconds after their import, so objects are still imported again
+    from time to time. Entries can be kept in a SQLite file to survive restarts,
+    only the max_size most recent ones being loaded. Every method is thread safe.
+    """
+
+    def __init__(self, max_size: int, ttl: float, path: str = "") -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # Hash -> (STIX id, expiration time), least recently used first
+        self.entries: "OrderedDict[str, Tuple[str, float]]" = OrderedDict()
+        self.hashes_by_id: Dict[str, Set[str]] = {}
+        self.db: Optional[sqlite3.Connection] = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            with self.db:
+                self.db.execute(
+                    "CREATE TABLE IF NOT EXISTS imported"
+                    " (hash TEXT PRIMARY KEY, stix_id TEXT, expires REAL)"
+                )
+                self.db.execute(
+                    "CREATE INDEX IF NOT EXISTS imported_stix_id ON imported (stix_id)"
+                )
+                self.db.execute(
+                    "DELETE FROM imported WHERE expires <= ?", (time.time(),)
+                )
+            rows = self.db.execute(
+                "SELECT hash, stix_id, expires FROM imported"
+                " ORDER BY expires DESC LIMIT ?",
+                (max_size,),
+            ).fetchall()
+            for key, stix_id, expires in reversed(rows):
+                self.store(key, stix_id, expires)
+
+    def store(self, key: str, stix_id: str, expires: float) -> None:
+        self.entries[key] = (stix_id, expires)
+        self.entries.move_to_end(key)
+        self.hashes_by_id.setdefault(stix_id, set()).add(key)
+        while len(self.entries) > self.max_size:
+            evicted_key, (evicted_id, _) = self.entries.popitem(last=False)
+            self.forget(evicted_key, evicted_id)
+            dedup_objects_counter.add(1, {"result": "evicted"})
+
+    def forget(self, key: str, stix_id: str) -> None:
+        keys = self.hashes_by_id.get(stix_id)
+        if keys is not None:
+            keys.discard(key)
+            if len(keys) == 0:
+                del self.hashes_by_id[stix_id]
+
+    def trim(
+        self, objects: List[Dict[str, Any]], keys: List[str]
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Objects not imported recently, with their hashes (see object_hash)."""
+        kept: List[Dict[str, Any]] = []
+        kept_keys: List[str] = []
+        now = time.time()
+        with self.lock:
+            for stix_object, key in zip(objects, keys):
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] > now:
+                    self.entries.move_to_end(key)
+                    continue
+                kept.append(stix_object)
+                kept_keys.append(key)
+        dedup_objects_counter.add(len(objects) - len(kept), {"result": "hit"})
+        dedup_objects_counter.add(len(kept), {"result": "miss"})
+        return kept, kept_keys
+
+    def add(self, objects: List[Dict[str, Any]], hashes: Dict[str, str]) -> None:
+        """Record the objects once imported, with their hashes by STIX id."""
+        expires = time.time() + self.ttl
+        rows = []
+        with self.lock:
+            for stix_object in objects:
+                stix_id = stix_object.get("id", "")
+                if stix_id in hashes:
+                    self.store(hashes[stix_id], stix_id, expires)
+                    rows.append((hashes[stix_id], stix_id, expires))
+            if self.db is not None and len(rows) > 0:
+                with self.db:
+                    self.db.executemany(
+                        "INSERT OR REPLACE INTO imported VALUES (?, ?, ?)", rows
+                    )
+
+    def invalidate(self, stix_ids: List[str]) -> None:
+        """Forget the objects deleted or merged, they must be imported again."""
+        with self.lock:
+            for stix_id in stix_ids:
+                for key in self.hashes_by_id.pop(stix_id, set()):
+                    self.entries.pop(key, None)
+            if self.db is not None:
+                with self.db:
+                    self.db.executemany(
+                        "DELETE FROM imported WHERE stix_id = ?",
+                        [(stix_id,) for stix_id in stix_ids],
+                    )
+
+    def close(self) -> None:
+        with self.lock:
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+
+
+class VersionIndex:
+    """Last version (modified, canonical hash) of the objects upserted, by STIX id.
+
+    Objects sent again unchanged are dropped before their import. The index is
+    a SQLite file in WAL mode, memory mapped, so the worker processes of a node
+    share it (one connection per process, used by one thread at a time).
+    Versions expire ttl seconds after their upsert and the index is pruned to
+    its max_size most recent versions every prune_interval seconds.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        mmap_size: int,
+        max_size: int,
+        ttl: float,
+        prune_interval: float = 60,
+    ) -> None:
+        self.max_size = max_size
+        self.ttl = ttl
+        self.prune_interval = prune_interval
+        self.next_prune = time.monotonic() + prune_interval
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("PRAGMA mmap_size=%d" % mmap_size)
+        with self.db:
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS versions"
+                " (stix_id TEXT PRIMARY KEY, modified TEXT, hash TEXT, expires REAL)"
+                " WITHOUT ROWID"
+            )
+            self.db.execute(
+                "CREATE INDEX IF NOT EXISTS versions_expires ON versions (expires)"
+            )
+        self.prune()
+
+    def changed(
+        self, objects: List[Dict[str, Any]], keys: List[str]
+    ) -> Tuple[List[Dict[str, Any]], List[str]]:
+        """Objects new or changed since their last upsert, with their hashes."""
+        ids = [stix_object.get("id", "") for stix_object in objects]
+        known: Dict[str, Tuple[str, str]] = {}
+        now = time.time()
+        with self.lock:
+            # Within the default limit of variables of a statement
+            for start in range(0, len(ids), 500):
+                chunk = ids[start : start + 500]
+                rows = self.db.execute(
+                    "SELECT stix_id, modified, hash FROM versions"
+                    " WHERE stix_id IN (%s) AND expires > ?"
+                    % ",".join("?" * len(chunk)),
+                    [*chunk, now],
+                )
+                known.update((row[0], (row[1], row[2])) for row in rows)
+        kept: List[Dict[str, Any]] = []
+        kept_keys: List[str] = []
+        for stix_object, stix_id, key in zip(objects, ids, keys):
+            if known.get(stix_id) == (stix_object.get("modified", ""), key):
+                continue
+            kept.append(stix_object)
+            kept_keys.append(key)
+        version_index_objects_counter.add(
+            len(objects) - len(kept), {"result": "unchanged"}
+        )
+        version_index_objects_counter.add(len(kept), {"result": "changed"})
+        return kept, kept_keys
+
+    def record(self, objects: List[Dict[str, Any]], hashes: Dict[str, str]) -> None:
+        expires = time.time() + self.ttl
+        rows = [
+            (
+                stix_object["id"],
+                stix_object.get("modified", ""),
+                hashes[stix_object["id"]],
+                expires,
+            )
+            for stix_object in objects
+            if stix_object.get("id") in hashes
+        ]
+        with self.lock, self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO versions VALUES (?, ?, ?, ?)", rows
+            )
+        if time.monotonic() >= self.next_prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """Remove the expired versions and the oldest ones over max_size."""
+        with self.lock, self.db:
+            self.next_prune = time.monotonic() + self.prune_interval
+            expired = self.db.execute(
+                "DELETE FROM versions WHERE expires <= ?", (time.time(),)
+            ).rowcount
+            evicted = self.db.execute(
+                "DELETE FROM versions WHERE stix_id IN (SELECT stix_id FROM versions"
+                " ORDER BY expires LIMIT max(0, (SELECT COUNT(*) FROM versions) - ?))",
+                (self.max_size,),
+            ).rowcount
+        version_index_objects_counter.add(expired, {"result": "expired"})
+        version_index_objects_counter.add(evicted, {"result": "evicted"})
+
+    def remove(self, stix_ids: List[str]) -> None:
+        with self.lock, self.db:
+            self.db.executemany(
+                "DELETE FROM versions WHERE stix_id = ?",
+                [(stix_id,) for stix_id in stix_ids],
+            )
+
+    def close(self) -> None:
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,150 @@
+# coding: utf-8
+
+
+import functools
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+
+@dataclass
+class OrderedTask:
+    keys: List[str]
+    callable: Callable[[], Any]
+    priority: int = 0
+    started: bool = False
+
+
+class OrderedExecutor:
+    """Bounded thread pool running tasks sharing an ordering key one after another.
+
+    Each task comes with a set of ordering keys. Tasks sharing a key are executed
+    in submission order, never concurrently. Tasks with disjoint keys (or without
+    keys) run in parallel up to the pool size. A task returning PARKED keeps its
+    keys until a task given to resume() with the same keys completes, so it can
+    be retried later without holding a pool thread nor letting the next tasks of
+    its keys overtake it. Runnable tasks wait for a free thread by priority, then
+    in submission order.
+    """
+
+    PARKED = object()
+
+    def __init__(self, max_workers: int, name: str) -> None:
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        # Keys are computed in arrival order, outside of the consumer thread
+        self.dispatcher = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix=name + "-dispatch"
+        )
+        self.lock = threading.Condition()
+        self.waiting: Dict[str, Deque[OrderedTask]] = {}
+        # Runnable tasks waiting for a thread: (-priority, sequence, task)
+        self.ready: List[Tuple[int, int, OrderedTask]] = []
+        self.sequence = 0
+        self.running = 0
+        self.closed = False
+        self.local = threading.local()
+
+    def submit(
+        self, keys: List[str], fn: Callable[..., Any], *args: Any, priority: int = 0
+    ) -> None:
+        task = OrderedTask(sorted(set(keys)), functools.partial(fn, *args), priority)
+        with self.lock:
+            for key in task.keys:
+                self.waiting.setdefault(key, deque()).append(task)
+            runnable = self._acquire(task)
+        if runnable:
+            self._run(task)
+
+    def dispatch(
+        self,
+        keys_fn: Callable[[], List[str]],
+        fn: Callable[..., Any],
+        *args: Any,
+        priority: int = 0,
+    ) -> None:
+        def prepare() -> None:
+            try:
+                keys = keys_fn()
+            except Exception:  # pylint: disable=broad-except
+                keys = []
+            self.submit(keys, fn, *args, priority=priority)
+
+        self.dispatcher.submit(prepare)
+
+    def resume(
+        self, keys: List[str], fn: Callable[..., Any], *args: Any, priority: int = 0
+    ) -> None:
+        self._run(OrderedTask(keys, functools.partial(fn, *args), priority, True))
+
+    def current_keys(self) -> List[str]:
+        return getattr(self.local, "keys", [])
+
+    def _acquire(self, task: OrderedTask) -> bool:
+        # Runnable when first of the waiting line of all its keys
+        if task.started or any(self.waiting[key][0] is not task for key in task.keys):
+            return False
+        task.started = True
+        return True
+
+    def _execute(self, keys: List[str], task: Callable[[], Any]) -> Any:
+        self.local.keys = keys
+        try:
+            return task()
+        finally:
+            self.local.keys = []
+
+    def _run(self, task: OrderedTask) -> None:
+        with self.lock:
+            heapq.heappush(self.ready, (-task.priority, self.sequence, task))
+            self.sequence += 1
+        self._pump()
+
+    def _pump(self) -> None:
+        while True:
+            with self.lock:
+                if self.closed or self.running >= self.max_workers:
+                    return
+                if len(self.ready) == 0:
+                    return
+                task = heapq.heappop(self.ready)[2]
+                self.running += 1
+            future = self.pool.submit(self._execute, task.keys, task.callable)
+            future.add_done_callback(functools.partial(self._release, task.keys))
+
+    def _release(self, keys: List[str], future: Future) -> None:
+        with self.lock:
+            self.running -= 1
+        if future.exception() is None and future.result() is self.PARKED:
+            self._pump()
+            return
+        runnables = []
+        with self.lock:
+            for key in keys:
+                pending = self.waiting.get(key)
+                if pending is None:
+                    continue
+                pending.popleft()
+                if len(pending) == 0:
+                    self.waiting.pop(key)
+                elif self._acquire(pending[0]):
+                    runnables.append(pending[0])
+            self.lock.notify_all()
+        for task in runnables:
+            self._run(task)
+        self._pump()
+
+    def shutdown(self, wait: bool = True) -> None:
+        self.dispatcher.shutdown(wait=wait)
+        with self.lock:
+            if wait:
+                # Let the ordered lines drain before closing the pool
+                self.lock.wait_for(lambda: len(self.waiting) == 0)
+            else:
+                self.waiting.clear()
+                self.ready.clear()
+            self.closed = True
+        self.pool.shutdown(wait=wait)
@@ -0,0 +1,91 @@
+# coding: utf-8
+
+
+import heapq
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Tuple
+
+PROCESSING_COUNT: int = 4
+MAX_PROCESSING_COUNT: int = 60
+
+
+@dataclass
+class RetryPolicy:
+    """Backoff applied to an error class before processing a message again."""
+
+    delay: float
+    jitter: float = 0
+    factor: float = 1
+    max_delay: float = 3600
+    # Processing attempts of the message allowed, 0 for no limit
+    max_attempts: int = 0
+
+    def can_retry(self, attempt: int) -> bool:
+        return self.max_attempts == 0 or attempt < self.max_attempts
+
+    def next_delay(self, retry: int) -> float:
+        delay = min(self.delay * self.factor ** max(retry - 1, 0), self.max_delay)
+        return round(delay + random.uniform(0, self.jitter), 2)
+
+
+DEFAULT_RETRY_POLICIES: Dict[str, Dict[str, Any]] = {
+    # Platform is under heavy load: wait & retry almost indefinitely.
+    "timeout": {"delay": 70, "jitter": 20},
+    "lock": {"delay": 10, "jitter": 20, "max_attempts": MAX_PROCESSING_COUNT},
+    # Referenced entities may still be in another queue or bundle
+    "missing_reference": {"delay": 1, "jitter": 2, "max_attempts": PROCESSING_COUNT},
+    # Delay before giving the message back to the broker
+    "bad_gateway": {"delay": 60},
+}
+
+
+def load_retry_policies(config: Dict[str, Any]) -> Dict[str, RetryPolicy]:
+    overrides = config.get("worker", {}).get("retry_policies") or {}
+    return {
+        name: RetryPolicy(**{**default, **(overrides.get(name) or {})})
+        for name, default in DEFAULT_RETRY_POLICIES.items()
+    }
+
+
+class RetryScheduler(threading.Thread):
+    """Delay queue calling back parked messages once their delay is expired."""
+
+    def __init__(self, worker_logger: Any) -> None:
+        threading.Thread.__init__(self, daemon=True, name="worker-retry")
+        self.worker_logger = worker_logger
+        self.condition = threading.Condition()
+        self.delayed: List[Tuple[float, int, Callable[[], Any]]] = []
+        self.sequence = 0
+        self.exit_event = threading.Event()
+
+    def schedule(self, delay: float, callback: Callable[[], Any]) -> None:
+        with self.condition:
+            self.sequence += 1
+            heapq.heappush(
+                self.delayed, (time.monotonic() + delay, self.sequence, callback)
+            )
+            self.condition.notify()
+
+    def run(self) -> None:
+        while not self.exit_event.is_set():
+            with self.condition:
+                if len(self.delayed) == 0:
+                    self.condition.wait()
+                    continue
+                due = self.delayed[0][0] - time.monotonic()
+                if due > 0:
+                    self.condition.wait(due)
+                    continue
+                callback = heapq.heappop(self.delayed)[2]
+            try:
+                callback()
+            except Exception as e:  # pylint: disable=broad-except
+                self.worker_logger.error(type(e).__name__, {"reason": str(e)})
+
+    def stop(self) -> None:
+        self.exit_event.set()
+        with self.condition:
+            self.condition.notify()
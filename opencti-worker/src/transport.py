@@ -0,0 +1,213 @@
+# coding: utf-8
+
+
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set
+
+import pika
+from pycti.connector.opencti_connector_helper import create_mq_ssl_context
+
+
+class AckBatcher:
+    """Acknowledge the messages of a channel in batches.
+
+    Delivery tags of a channel are increasing, so the highest tag under which
+    every message is done is acked at once with multiple=True, every max_size
+    messages done. Rejects are sent right away, so a multiple ack never covers
+    a message still in flight. Messages done after a message still in flight
+    (parked for a retry for example) are acked one by one if they are still
+    waiting after max_delay seconds. Every method must run on the thread of the
+    channel connection.
+    """
+
+    def __init__(
+        self,
+        channel: Any,
+        max_size: int,
+        max_delay: float,
+        call_later: Callable[[float, Callable[[], Any]], Any],
+    ) -> None:
+        self.channel = channel
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.call_later = call_later
+        # Tags delivered and not acked or rejected yet, in delivery order
+        self.outstanding: Deque[int] = deque()
+        self.done: Set[int] = set()
+        self.done_since_flush = 0
+        self.flush_scheduled = False
+
+    def delivered(self, delivery_tag: int) -> None:
+        self.outstanding.append(delivery_tag)
+
+    def ack(self, delivery_tags: List[int]) -> None:
+        self.done.update(delivery_tags)
+        self.done_since_flush += len(delivery_tags)
+        if self.done_since_flush >= self.max_size:
+            self.ack_contiguous()
+            if len(self.done) >= self.max_size // 2:
+                # Stuck behind messages in flight, acked one by one so the
+                # prefetch window does not stall
+                self.flush()
+        if len(self.done) > 0 and not self.flush_scheduled:
+            self.flush_scheduled = True
+            self.call_later(self.max_delay, self.flush)
+
+    def nack(self, delivery_tags: List[int]) -> None:
+        for tag in delivery_tags:
+            self.channel.basic_nack(tag)
+            if tag in self.outstanding:
+                self.outstanding.remove(tag)
+
+    def ack_contiguous(self) -> None:
+        self.done_since_flush = 0
+        if not self.channel.is_open:
+            return
+        highest = None
+        while len(self.outstanding) > 0 and self.outstanding[0] in self.done:
+            highest = self.outstanding.popleft()
+            self.done.discard(highest)
+        if highest is not None:
+            self.channel.basic_ack(highest, multiple=True)
+
+    def flush(self) -> None:
+        self.flush_scheduled = False
+        self.ack_contiguous()
+        if not self.channel.is_open:
+            return
+        for tag in sorted(self.done):
+            self.channel.basic_ack(tag)
+            if tag in self.outstanding:
+                self.outstanding.remove(tag)
+        self.done.clear()
+
+
+def build_pika_parameters(
+    connector: Dict[str, Any], config: Dict[str, Any]
+) -> pika.ConnectionParameters:
+    connection = connector["config"]["connection"]
+    pika_credentials = pika.PlainCredentials(connection["user"], connection["pass"])
+    ssl_options = None
+    if connection["use_ssl"]:
+        ssl_options = pika.SSLOptions(create_mq_ssl_context(config), connection["host"])
+    return pika.ConnectionParameters(
+        connection["host"],
+        connection["port"],
+        connection["vhost"],
+        pika_credentials,
+        ssl_options=ssl_options,
+    )
+
+
+class Transport(ABC):
+    """Connection of a consumer to its queue.
+
+    The consumer thread runs consume() until stop_consuming() and is the only
+    one using the transport: other threads go through add_callback_threadsafe.
+    Methods are named after the pika channel ones, so the processing code acks
+    on a transport or on an asyncio channel alike.
+    """
+
+    @property
+    @abstractmethod
+    def is_open(self) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def consume(
+        self, queue: str, on_message: Callable[[int, Optional[int], bytes], None]
+    ) -> None:
+        """Deliver the messages (tag, priority, body) until stop_consuming."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop_consuming(self) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def basic_qos(self, prefetch_count: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def basic_nack(self, delivery_tag: int) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def add_callback_threadsafe(self, callback: Callable[[], Any]) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> Any:
+        raise NotImplementedError
+
+    @abstractmethod
+    def sleep(self, duration: float) -> None:
+        """Run the callbacks and timers for duration seconds."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def close(self) -> None:
+        """Close the transport, unacked messages go back to the queue."""
+        raise NotImplementedError
+
+
+class PikaTransport(Transport):
+    def __init__(
+        self, connector: Dict[str, Any], config: Dict[str, Any], worker_logger: Any
+    ) -> None:
+        self.connection = pika.BlockingConnection(
+            build_pika_parameters(connector, config)
+        )
+        self.channel = self.connection.channel()
+        try:
+            self.channel.confirm_delivery()
+        except Exception as err:  # pylint: disable=broad-except
+            worker_logger.warning(str(err))
+
+    @property
+    def is_open(self) -> bool:
+        return bool(self.channel.is_open)
+
+    def consume(
+        self, queue: str, on_message: Callable[[int, Optional[int], bytes], None]
+    ) -> None:
+        self.channel.basic_consume(
+            queue=queue,
+            on_message_callback=lambda _channel, method, properties, body: on_message(
+                method.delivery_tag,
+                properties.priority if properties is not None else None,
+                body,
+            ),
+        )
+        self.channel.start_consuming()
+
+    def stop_consuming(self) -> None:
+        if self.channel.is_open:
+            self.channel.stop_consuming()
+
+    def basic_qos(self, prefetch_count: int) -> None:
+        self.channel.basic_qos(prefetch_count=prefetch_count)
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self.channel.basic_ack(delivery_tag, multiple=multiple)
+
+    def basic_nack(self, delivery_tag: int) -> None:
+        self.channel.basic_nack(delivery_tag)
+
+    def add_callback_threadsafe(self, callback: Callable[[], Any]) -> None:
+        self.connection.add_callback_threadsafe(callback)
+
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> Any:
+        return self.connection.call_later(delay, callback)
+
+    def sleep(self, duration: float) -> None:
+        self.connection.process_data_events(time_limit=duration)
+
+    def close(self) -> None:
+        if self.connection.is_open:
+            self.connection.close()
@@ -1,38 +1,79 @@
 # coding: utf-8
 
 
+import asyncio
 import base64
-import ctypes
 import datetime
 import functools
+import hashlib
 import json
+import multiprocessing
 import os
 import random
+import signal
 import sys
 import threading
 import time
 import traceback
+import urllib.error
+import urllib.request
+import zlib
+from abc import ABC, abstractmethod
 from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from threading import Thread
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple, Union
 
-import pika
 import yaml
-from opentelemetry import metrics
+from autoscaler import (
+    CONNECTOR_TYPES_PRIORITY_CLASSES,
+    PRIORITY_CLASSES,
+    Autoscaler,
+    broker_key,
+)
+from bundles import (
+    CoalescedEvent,
+    bundle_entities_ids,
+    coalescable_event,
+    decode_bundle,
+    decode_event,
+    message_source,
+    object_hash,
+    scan_entities_ids,
+    split_bundle,
+)
+from caches import DedupCache, VersionIndex
+from executor import OrderedExecutor
+from opentelemetry import context as otel_context
+from opentelemetry import metrics, propagate, trace
+from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
 from opentelemetry.exporter.prometheus import PrometheusMetricReader
+from opentelemetry.metrics import Observation
 from opentelemetry.sdk.metrics import MeterProvider
+from opentelemetry.sdk.metrics.view import ExplicitBucketHistogramAggregation, View
 from opentelemetry.sdk.resources import SERVICE_NAME, Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SpanExporter,
+)
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace import SpanKind, Status, StatusCode
+from pika.adapters.asyncio_connection import AsyncioConnection
 from pika.adapters.blocking_connection import BlockingChannel
-from prometheus_client import start_http_server
+from prometheus_client import CollectorRegistry, start_http_server
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.parser import text_string_to_metric_families
 from pycti import OpenCTIApiClient
-from pycti.connector.opencti_connector_helper import (
-    create_mq_ssl_context,
-    get_config_variable,
-)
+from pycti.connector.opencti_connector_helper import get_config_variable
+from pycti.utils.opencti_logger import logger
+from requests import Session
+from requests.adapters import HTTPAdapter
 from requests.exceptions import RequestException, Timeout
-
-PROCESSING_COUNT: int = 4
-MAX_PROCESSING_COUNT: int = 60
+from retries import PROCESSING_COUNT, RetryScheduler, load_retry_policies
+from transport import AckBatcher, PikaTransport, Transport, build_pika_parameters
+from urllib3 import HTTPConnectionPool, HTTPSConnectionPool
 
 # Telemetry variables definition
 meter = metrics.get_meter(__name__)
@@ -73,19 +114,182 @@ bundles_processing_time_gauge = meter.create_histogram(
     name="opencti_bundles_processing_time_gauge",
     description="processing time of bundles",
 )
+processing_duration_histogram = meter.create_histogram(
+    name="opencti_worker_processing_duration_milliseconds",
+    unit="ms",
+    description="processing time of messages",
+)
+bundles_size_histogram = meter.create_histogram(
+    name="opencti_worker_bundle_size_bytes",
+    unit="By",
+    description="size of the processed bundles and events",
+)
+bundles_objects_histogram = meter.create_histogram(
+    name="opencti_worker_bundle_objects",
+    description="number of objects of the processed bundles",
+)
+drain_duration_histogram = meter.create_histogram(
+    name="opencti_worker_drain_duration_milliseconds",
+    unit="ms",
+    description="time to finish the messages in flight when stopping a consumer",
+)
+# Bounds of the histograms buckets, in milliseconds, bytes and objects
+DEFAULT_LATENCY_BUCKETS = "5,10,25,50,100,250,500,1000,2500,5000,10000,30000,60000"
+DEFAULT_SIZE_BUCKETS = "1024,8192,65536,262144,1048576,4194304,16777216,67108864"
+DEFAULT_OBJECTS_BUCKETS = "1,2,5,10,25,50,100,250,500,1000,2500,5000,10000"
+
+
+def parse_buckets(value: Union[str, List[float]]) -> List[float]:
+    # Buckets are given as a list in config.yml or a comma separated string
+    if isinstance(value, str):
+        value = [float(bound) for bound in value.split(",") if bound.strip() != ""]
+    return sorted(float(bound) for bound in value)
+
+
+def telemetry_views(
+    latency_buckets: List[float],
+    size_buckets: List[float],
+    objects_buckets: List[float],
+) -> List[View]:
+    return [
+        View(
+            instrument_name="opencti_worker_processing_duration_milliseconds",
+            aggregation=ExplicitBucketHistogramAggregation(latency_buckets),
+        ),
+        View(
+            instrument_name="opencti_worker_drain_duration_milliseconds",
+            aggregation=ExplicitBucketHistogramAggregation(latency_buckets),
+        ),
+        View(
+            instrument_name="opencti_worker_bundle_size_bytes",
+            aggregation=ExplicitBucketHistogramAggregation(size_buckets),
+        ),
+        View(
+            instrument_name="opencti_worker_bundle_objects",
+            aggregation=ExplicitBucketHistogramAggregation(objects_buckets),
+        ),
+    ]
+
+
+tracer = trace.get_tracer(__name__)
+
+
+class FileSpanExporter(ConsoleSpanExporter):
+    """One JSON document per span and per line, appended to a file."""
+
+    def __init__(self, file_path: str) -> None:
+        # Closed with the exporter, when the tracer provider shuts down
+        self.file = open(  # pylint: disable=consider-using-with
+            file_path, "a", encoding="utf-8"
+        )
+        super().__init__(
+            out=self.file,
+            formatter=lambda span: span.to_json(indent=None) + os.linesep,
+        )
+
+    def shutdown(self) -> None:
+        super().shutdown()
+        self.file.close()
+
+
+def create_span_exporter(
+    exporter: str, otlp_endpoint: str, file_path: str
+) -> SpanExporter:
+    if exporter == "file":
+        return FileSpanExporter(file_path)
+    return OTLPSpanExporter(endpoint=otlp_endpoint)
+
+
+def traced_callback(name: str, callback: Callable[[], Any]) -> Callable[[], Any]:
+    # Callbacks run on the connection thread, the span covers the wait for it
+    parent = otel_context.get_current()
+    start_time = time.time_ns()
+
+    def run() -> Any:
+        with tracer.start_as_current_span(name, context=parent, start_time=start_time):
+            return callback()
+
+    return run
+
+
+def start_health_server(
+    endpoint: Tuple[str, int],
+    health: Callable[[], Dict[str, Any]],
+    ready: Callable[[], Dict[str, Any]],
+) -> ThreadingHTTPServer:
+    """Serve /health (liveness) and /ready (readiness), 503 when not alive or ready."""
+
+    class HealthRequestHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            if self.path == "/health":
+                body = health()
+                code = 200 if body["alive"] else 503
+            elif self.path == "/ready":
+                body = ready()
+                code = 200 if body["ready"] else 503
+            else:
+                code, body = 404, {"error": "Not found"}
+            content = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+
+        def log_message(self, *args: Any) -> None:
+            pass
 
+    server = ThreadingHTTPServer(endpoint, HealthRequestHandler)
+    Thread(target=server.serve_forever, daemon=True).start()
+    return server
 
-class PingAlive(threading.Thread):
-    def __init__(self, worker_logger, api) -> None:
-        threading.Thread.__init__(self)
+
+class HealthMonitor(threading.Thread):
+    """Worker level health checks.
+
+    One ping of the platform for the whole process, delayed exponentially while
+    the platform does not answer, plus the liveness of every consumer. The state
+    is exported as metrics and, when enabled, on a local readiness endpoint.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        worker_logger: Any,
+        api: Any,
+        interval: int = 30,
+        max_interval: int = 300,
+        endpoint: Optional[Tuple[str, int]] = None,
+    ) -> None:
+        threading.Thread.__init__(self, daemon=True)
         self.worker_logger = worker_logger
         self.api = api
+        self.interval = interval
+        self.max_interval = max_interval
+        self.endpoint = endpoint
         self.exit_event = threading.Event()
+        self.in_error = False
+        self.failures = 0
+        self.last_ping: Optional[float] = None
+        # Consumers of the worker engine, keyed by queue name
+        self.consumers: Dict[str, Any] = {}
+        self.consumers_state: Dict[str, Dict[str, Any]] = {}
+        self.state_lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+        meter.create_observable_gauge(
+            name="opencti_worker_api_up",
+            callbacks=[self.observe_api],
+            description="1 if the platform API answered the last ping",
+        )
+        meter.create_observable_gauge(
+            name="opencti_worker_consumer_alive",
+            callbacks=[self.observe_consumers],
+            description="1 if the consumer of the queue is alive",
+        )
 
     def ping(self) -> None:
         while not self.exit_event.is_set():
             try:
-                self.worker_logger.debug("PingAlive running.")
+                self.worker_logger.debug("HealthMonitor running.")
                 self.api.query(
                     """
                     query {
@@ -95,25 +299,157 @@ class PingAlive(threading.Thread):
                     }
                   """
                 )
+                self.in_error = False
+                self.failures = 0
+                self.last_ping = time.time()
             except Exception as e:  # pylint: disable=broad-except
                 self.in_error = True
+                self.failures += 1
                 self.worker_logger.error(
                     "Error pinging the API",
                     {"reason": str(e), "headers": str(self.api.get_request_headers())},
                 )
-            self.exit_event.wait(30)
+            self.exit_event.wait(self.next_delay())
+
+    def next_delay(self) -> float:
+        if self.failures == 0:
+            return self.interval
+        # Platform is degraded, do not add more load: exponential backoff
+        delay = min(self.interval * 2 ** min(self.failures, 16), self.max_interval)
+        return round(random.uniform(delay / 2, delay), 2)
+
+    def check_consumers(self) -> Dict[str, Dict[str, Any]]:
+        with self.state_lock:
+            for queue, consumer in list(self.consumers.items()):
+                alive = consumer.is_alive()
+                state = self.consumers_state.get(queue)
+                if state is None or state["alive"] != alive:
+                    self.consumers_state[queue] = {"alive": alive, "since": time.time()}
+            for queue in list(self.consumers_state):
+                if queue not in self.consumers:
+                    self.consumers_state.pop(queue)
+            return {queue: dict(state) for queue, state in self.consumers_state.items()}
+
+    def is_ready(self) -> bool:
+        consumers = self.check_consumers()
+        return not self.in_error and all(s["alive"] for s in consumers.values())
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "ready": self.is_ready(),
+            "api": {
+                "up": not self.in_error,
+                "failures": self.failures,
+                "last_ping": self.last_ping,
+            },
+            "consumers": self.check_consumers(),
+        }
+
+    def observe_api(self, _options: Any) -> Iterable[Observation]:
+        yield Observation(0 if self.in_error else 1)
+
+    def observe_consumers(self, _options: Any) -> Iterable[Observation]:
+        for queue, state in self.check_consumers().items():
+            yield Observation(1 if state["alive"] else 0, {"queue": queue})
 
     def run(self) -> None:
-        self.worker_logger.info("Starting PingAlive thread")
+        self.worker_logger.info("Starting HealthMonitor thread")
+        if self.endpoint is not None:
+            self.server = start_health_server(
+                self.endpoint, lambda: {"alive": True}, self.status
+            )
         self.ping()
 
     def stop(self) -> None:
-        self.worker_logger.info("Preparing PingAlive for clean shutdown")
+        self.worker_logger.info("Preparing HealthMonitor for clean shutdown")
         self.exit_event.set()
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class IdleConnectionsMixin:
+    """Connection pool closing a keep-alive connection unused for longer than
+    idle_timeout seconds when it is taken out of the pool, instead of reusing a
+    socket the platform or a load balancer may have closed. The connection is
+    opened again by its next request.
+    """
+
+    def __init__(self, *args: Any, idle_timeout: int = 0, **kwargs: Any) -> None:
+        super().__init__(*args, **kwargs)
+        self.idle_timeout = idle_timeout
+
+    def _get_conn(self, timeout: Optional[float] = None) -> Any:
+        conn = super()._get_conn(timeout)
+        released = getattr(conn, "released_at", None)
+        if released is not None and 0 < self.idle_timeout < time.monotonic() - released:
+            conn.close()
+        return conn
+
+    def _put_conn(self, conn: Any) -> None:
+        if conn is not None:
+            conn.released_at = time.monotonic()
+        super()._put_conn(conn)
+
+
+class IdleHTTPConnectionPool(IdleConnectionsMixin, HTTPConnectionPool):
+    pass
+
+
+class IdleHTTPSConnectionPool(IdleConnectionsMixin, HTTPSConnectionPool):
+    pass
+
+
+class ApiAdapter(HTTPAdapter):
+    def __init__(self, idle_timeout: int, **kwargs: Any) -> None:
+        # Read by init_poolmanager, called by the constructor of HTTPAdapter
+        self.idle_timeout = idle_timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args: Any, **kwargs: Any) -> None:
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": functools.partial(
+                IdleHTTPConnectionPool, idle_timeout=self.idle_timeout
+            ),
+            "https": functools.partial(
+                IdleHTTPSConnectionPool, idle_timeout=self.idle_timeout
+            ),
+        }
+
+
+class ApiSession(Session):
+    """HTTP session shared by all the API clients of the worker.
+
+    Keep-alive connections are pooled per host, for up to pool_hosts hosts, and
+    bounded to max_per_host connections (threads wait for a free connection).
+    Connections idle for longer than idle_timeout seconds are opened again.
+    """
+
+    def __init__(self, pool_hosts: int, max_per_host: int, idle_timeout: int) -> None:
+        super().__init__()
+        adapter = ApiAdapter(
+            idle_timeout,
+            pool_connections=pool_hosts,
+            pool_maxsize=max_per_host,
+            pool_block=True,
+        )
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, *args: Any, **kwargs: Any) -> Any:
+        method = args[0] if len(args) > 0 else kwargs.get("method", "")
+        with tracer.start_as_current_span(
+            "worker.api_request",
+            kind=SpanKind.CLIENT,
+            attributes={"http.method": method},
+        ) as span:
+            response = super().request(*args, **kwargs)
+            span.set_attribute("http.status_code", response.status_code)
+            return response
 
 
 @dataclass(unsafe_hash=True)
-class Consumer(Thread):  # pylint: disable=too-many-instance-attributes
+class MessageProcessor(ABC):  # pylint: disable=too-many-instance-attributes
     connector: Dict[str, Any] = field(hash=False)
     config: Dict[str, Any] = field(hash=False)
     opencti_url: str
@@ -121,172 +457,712 @@ class Consumer(Thread):  # pylint: disable=too-many-instance-attributes
     log_level: str
     ssl_verify: Union[bool, str] = False
     json_logging: bool = False
+    execution_pool_size: int = 1
+    api: Any = field(default=None, hash=False, compare=False)
+    thread_local: Any = field(default=None, hash=False, compare=False)
+    api_session: Any = field(default=None, hash=False, compare=False)
+    retry_scheduler: Any = field(default=None, hash=False, compare=False)
+    retry_policies: Any = field(default=None, hash=False, compare=False)
+    ordering: str = "work"
+    bundle_split_size: int = 0
+    event_coalescing_window: int = 0
+    event_coalescing_max_size: int = 500
+    max_concurrency: int = 0
+    priority_class: str = "default"
+    connector_type: str = ""
+    drain_timeout: int = 60
+    fingerprint: str = ""
+    ack_batch_size: int = 0
+    ack_batch_delay: int = 100
+    max_parked: int = 100
+    dedup_cache: Any = field(default=None, hash=False, compare=False)
+    version_index: Any = field(default=None, hash=False, compare=False)
 
     def __post_init__(self) -> None:
-        super().__init__()
-        self.api = OpenCTIApiClient(
+        if self.api is None:
+            self.api = self.create_api()
+        self.worker_logger = self.api.logger_class("worker")
+        if self.retry_scheduler is None:
+            self.retry_scheduler = RetryScheduler(self.worker_logger)
+            self.retry_scheduler.start()
+        if self.retry_policies is None:
+            self.retry_policies = load_retry_policies(self.config)
+        # Headers are set for each import, so every processing thread
+        # must use its own client instead of the consumer one
+        if self.thread_local is None:
+            self.thread_local = threading.local()
+        self.queue_name = self.connector["config"]["push"]
+        # Create and update events waiting for the coalescing window
+        self.coalescing_lock = threading.RLock()
+        self.coalesced_events: List[CoalescedEvent] = []
+        self.coalescing_group: Any = None
+        self.coalescing_generation = 0
+        # Messages processed in parallel, resized by the autoscaler
+        self.concurrency = self.execution_pool_size
+        self.in_flight = 0
+        self.processed = 0
+        # Messages parked for a retry, still holding their prefetch slot
+        self.parked = 0
+        # Acks of the consumer channel, when acknowledged in batches
+        self.ack_batcher: Optional[AckBatcher] = None
+
+    def create_api(self) -> OpenCTIApiClient:
+        api = OpenCTIApiClient(
             url=self.opencti_url,
             token=self.opencti_token,
             log_level=self.log_level,
             ssl_verify=self.ssl_verify,
             json_logging=self.json_logging,
         )
-        self.worker_logger = self.api.logger_class("worker")
+        # Clients only keep their own headers, connections come from the worker
+        # pool so keep-alive sockets and TLS sessions are reused across queues.
+        if self.api_session is not None:
+            api.session = self.api_session
+        return api
 
-        # Start ping
-        self.ping = PingAlive(self.worker_logger, self.api)
-        self.ping.start()
+    def thread_api(self) -> OpenCTIApiClient:
+        api = getattr(self.thread_local, "api", None)
+        if api is None:
+            api = self.create_api()
+            self.thread_local.api = api
+        return api
 
-        self.queue_name = self.connector["config"]["push"]
-        self.pika_credentials = pika.PlainCredentials(
-            self.connector["config"]["connection"]["user"],
-            self.connector["config"]["connection"]["pass"],
-        )
-        ssl_options = None
-        if self.connector["config"]["connection"]["use_ssl"]:
-            ssl_options = pika.SSLOptions(
-                create_mq_ssl_context(self.config),
-                self.connector["config"]["connection"]["host"],
-            )
-
-        self.pika_parameters = pika.ConnectionParameters(
-            self.connector["config"]["connection"]["host"],
-            self.connector["config"]["connection"]["port"],
-            self.connector["config"]["connection"]["vhost"],
-            self.pika_credentials,
-            ssl_options=ssl_options,
-        )
-        self.pika_connection = pika.BlockingConnection(self.pika_parameters)
-        self.channel = self.pika_connection.channel()
-        try:
-            self.channel.confirm_delivery()
-        except Exception as err:  # pylint: disable=broad-except
-            self.worker_logger.warning(str(err))
-        self.channel.basic_qos(prefetch_count=1)
-        assert self.channel is not None
-        self.processing_count: int = 0
-        self.current_bundle_id: [str, None] = None
-        self.current_bundle_seq: int = 0
-
-    @property
-    def id(self) -> Any:  # pylint: disable=inconsistent-return-statements
-        if hasattr(self, "_thread_id"):
-            return self._thread_id  # type: ignore  # pylint: disable=no-member
-        # pylint: disable=protected-access
-        for id_, thread in threading._active.items():  # type: ignore
-            if thread is self:
-                return id_
-
-    def terminate(self) -> None:
-        thread_id = self.id
-        self.ping.stop()
-        res = ctypes.pythonapi.PyThreadState_SetAsyncExc(
-            thread_id, ctypes.py_object(SystemExit)
-        )
-        if res > 1:
-            ctypes.pythonapi.PyThreadState_SetAsyncExc(thread_id, 0)
-            self.worker_logger.info("Unable to kill the thread")
-
-    def nack_message(self, channel: BlockingChannel, delivery_tag: int) -> None:
+    # Coalesced events are processed as one message with the tags of all events
+    def nack_message(
+        self, channel: BlockingChannel, delivery_tag: Union[int, List[int]]
+    ) -> None:
+        self.message_done(delivery_tag)
         if channel.is_open:
             self.worker_logger.info("Message rejected", {"tag": delivery_tag})
-            channel.basic_nack(delivery_tag)
+            tags = delivery_tag if isinstance(delivery_tag, list) else [delivery_tag]
+            if self.ack_batcher is not None and self.ack_batcher.channel is channel:
+                self.ack_batcher.nack(tags)
+                return
+            for tag in tags:
+                channel.basic_nack(tag)
         else:
             self.worker_logger.info(
                 "Message NOT rejected (channel closed)", {"tag": delivery_tag}
             )
 
-    def ack_message(self, channel: BlockingChannel, delivery_tag: int) -> None:
+    def ack_message(
+        self, channel: BlockingChannel, delivery_tag: Union[int, List[int]]
+    ) -> None:
+        self.message_done(delivery_tag)
         if channel.is_open:
             self.worker_logger.info("Message acknowledged", {"tag": delivery_tag})
-            channel.basic_ack(delivery_tag)
+            tags = delivery_tag if isinstance(delivery_tag, list) else [delivery_tag]
+            if self.ack_batcher is not None and self.ack_batcher.channel is channel:
+                self.ack_batcher.ack(tags)
+                return
+            for tag in tags:
+                channel.basic_ack(tag)
         else:
             self.worker_logger.info(
                 "Message NOT acknowledged (channel closed)", {"tag": delivery_tag}
             )
 
-    def stop_consume(self, channel: BlockingChannel) -> None:
-        self.ping.stop()
-        if channel.is_open:
-            channel.stop_consuming()
+    def message_priority(self, data: Dict[str, Any]) -> int:
+        # Class of the queue first, then priority of the message in the queue
+        message_priority = min(int(data.get("priority") or 0), 255)
+        return PRIORITY_CLASSES.get(self.priority_class, 1) * 256 + message_priority
 
-    # Callable for consuming a message
-    def _process_message(
+    def record_drain(self, start: float) -> None:
+        outcome = "drained" if self.in_flight <= 0 else "requeued"
+        duration = time.monotonic() - start
+        drain_duration_histogram.record(
+            duration * 1000, {"queue": self.queue_name, "outcome": outcome}
+        )
+        if outcome == "requeued":
+            # Closing the channel gives the unacked messages back to the broker
+            self.worker_logger.warning(
+                "Drain timeout, messages in flight requeued",
+                {"queue": self.queue_name, "in_flight": self.in_flight},
+            )
+        else:
+            self.worker_logger.info(
+                "Queue drained", {"queue": self.queue_name, "duration": duration}
+            )
+
+    def prefetch_count(self) -> int:
+        # Room for the acks waiting for their batch and for the parked messages
+        # on top of the processing. Past max_parked, parked messages keep their
+        # slot: a platform failing every message does not empty the queue into
+        # the worker.
+        prefetch = (
+            self.concurrency + self.ack_batch_size + min(self.parked, self.max_parked)
+        )
+        if self.event_coalescing_window > 0:
+            # Events waiting for their window are unacked too, without room for
+            # them bundles would never hold more events than the concurrency
+            prefetch += self.event_coalescing_max_size
+        return prefetch
+
+    @abstractmethod
+    def apply_prefetch(self) -> None:
+        """Set the prefetch of the channel to prefetch_count, if open."""
+
+    def set_parked(self, count: int) -> None:
+        # Runs on the connection thread, like the deliveries
+        prefetch = self.prefetch_count()
+        self.parked += count
+        if self.prefetch_count() != prefetch:
+            self.apply_prefetch()
+
+    def create_ack_batcher(
+        self, channel: Any, call_later: Callable[[float, Callable[[], Any]], Any]
+    ) -> Optional[AckBatcher]:
+        if self.ack_batch_size <= 1:
+            return None
+        return AckBatcher(
+            channel, self.ack_batch_size, self.ack_batch_delay / 1000, call_later
+        )
+
+    def message_done(self, delivery_tag: Union[int, List[int]]) -> None:
+        # Acks and nacks run on the connection thread, like the deliveries
+        count = len(delivery_tag) if isinstance(delivery_tag, list) else 1
+        self.in_flight -= count
+        self.processed += count
+
+    def metric_attributes(
+        self, event_type: str, outcome: Optional[str] = None
+    ) -> Dict[str, str]:
+        attributes = {
+            "queue": self.queue_name,
+            "connector": self.connector["name"],
+            "connector_type": self.connector_type,
+            "event_type": event_type,
+        }
+        if outcome is not None:
+            attributes["outcome"] = outcome
+        return attributes
+
+    def work_ordering_keys(self, data: Dict[str, Any]) -> List[str]:
+        # Messages of the same work are processed in order, messages without
+        # work (live stream events) share one key to keep their ordering too.
+        work_id = data["work_id"] if "work_id" in data else ""
+        return [self.queue_name + ":" + work_id]
+
+    def entities_ordering_keys(self, data: Dict[str, Any]) -> List[str]:
+        # Messages touching the same entities are processed in order, keys are
+        # shared by all the queues of the execution pool.
+        event_type = data["type"] if "type" in data else "bundle"
+        if event_type == "event":
+            content = decode_event(data["content"])
+            objects = [content["data"]]
+            if "context" in content and "sources" in content["context"]:
+                objects.extend(content["context"]["sources"])
+            ids = bundle_entities_ids(objects)
+        else:
+            # Bundles are only decoded by their processing, the single
+            # dispatcher thread of the pool scans their ids
+            ids = scan_entities_ids(data["content"])
+        # One key per entity: hashed lanes made bundles without any entity in
+        # common wait for each other as soon as bundles had a few dozen objects
+        return ["entity:" + stix_id for stix_id in ids]
+
+    def submit_message(
         self,
+        connection: Any,
         channel: BlockingChannel,
-        method: Any,
-        properties: None,  # pylint: disable=unused-argument
-        body: str,
+        delivery_tag: int,
+        body: bytes,
+        priority: Optional[int] = None,
+    ) -> None:
+        self.in_flight += 1
+        if self.ack_batcher is not None and self.ack_batcher.channel is channel:
+            self.ack_batcher.delivered(delivery_tag)
+        with tracer.start_as_current_span(
+            "worker.receive",
+            kind=SpanKind.CONSUMER,
+            attributes={
+                "messaging.destination.name": self.queue_name,
+                "messaging.message.body.size": len(body),
+            },
+        ):
+            with tracer.start_as_current_span("worker.decode_envelope"):
+                data = json.loads(body)
+            if priority is not None:
+                data["priority"] = priority
+            # Processing spans, retries included, are children of this span
+            data["trace_context"] = {}
+            propagate.inject(data["trace_context"])
+            self.worker_logger.info(
+                "Processing a new message, submitting to the execution pool...",
+                {"tag": delivery_tag},
+            )
+            if self.event_coalescing_window <= 0:
+                self.submit_data(connection, channel, delivery_tag, data)
+                return
+            with self.coalescing_lock:
+                event = coalescable_event(data)
+                if event is None:
+                    # Delete, merge and bundles are barriers: previous events first
+                    self.flush_events()
+                    self.submit_data(connection, channel, delivery_tag, data)
+                    return
+                group = (
+                    data["applicant_id"],
+                    data["synchronized"] if "synchronized" in data else False,
+                    data["entities_types"] if "entities_types" in data else None,
+                )
+                if len(self.coalesced_events) > 0 and group != self.coalescing_group:
+                    self.flush_events()
+                if len(self.coalesced_events) == 0:
+                    self.coalescing_group = group
+                    self.retry_scheduler.schedule(
+                        self.event_coalescing_window / 1000,
+                        functools.partial(
+                            self.flush_events, self.coalescing_generation
+                        ),
+                    )
+                self.coalesced_events.append(
+                    CoalescedEvent(connection, channel, delivery_tag, data, event)
+                )
+                if len(self.coalesced_events) >= self.event_coalescing_max_size:
+                    self.flush_events()
+
+    def flush_events(self, generation: Optional[int] = None) -> None:
+        with self.coalescing_lock:
+            # Window of an already flushed set of events
+            if generation is not None and generation != self.coalescing_generation:
+                return
+            events = self.coalesced_events
+            if len(events) == 0:
+                return
+            self.coalesced_events = []
+            self.coalescing_generation += 1
+            first = events[0]
+            if len(events) == 1:
+                self.submit_data(
+                    first.connection, first.channel, first.delivery_tag, first.data
+                )
+                return
+            # The coalesced bundle is linked to the spans of its events
+            links = [
+                trace.Link(
+                    trace.get_current_span(
+                        propagate.extract(event.data.get("trace_context", {}))
+                    ).get_span_context()
+                )
+                for event in events
+            ]
+            with tracer.start_as_current_span(
+                "worker.coalesce",
+                context=otel_context.Context(),
+                links=links,
+                attributes={"opencti.events": len(events)},
+            ):
+                data = self.coalesced_data(events)
+                data["trace_context"] = {}
+                propagate.inject(data["trace_context"])
+            self.submit_data(
+                first.connection,
+                first.channel,
+                [event.delivery_tag for event in events],
+                data,
+            )
+
+    def coalesced_data(self, events: List[CoalescedEvent]) -> Dict[str, Any]:
+        # Latest state of each entity, in one bundle for all the events
+        first = events[0]
+        objects: Dict[str, Any] = {}
+        for index, event in enumerate(events):
+            stix_object = event.event["data"]
+            objects[stix_object.get("id", str(index))] = stix_object
+        bundle = {"type": "bundle", "objects": list(objects.values())}
+        content = base64.b64encode(json.dumps(bundle).encode("utf-8"))
+        data = {
+            "type": "bundle",
+            "applicant_id": first.data["applicant_id"],
+            "synchronized": self.coalescing_group[1],
+            "update": True,
+            "coalesced": len(events),
+            "priority": max(event.data.get("priority") or 0 for event in events),
+            "content": content.decode("utf-8"),
+        }
+        if self.coalescing_group[2] is not None:
+            data["entities_types"] = self.coalescing_group[2]
+        self.worker_logger.info(
+            "Events coalesced", {"events": len(events), "objects": len(objects)}
+        )
+        return data
+
+    def submit_data(
+        self,
+        connection: Any,
+        channel: BlockingChannel,
+        delivery_tag: Union[int, List[int]],
+        data: Dict[str, Any],
     ) -> None:
-        data = json.loads(body)
+        if self.ordering == "entities":
+            self.execution_pool.dispatch(
+                functools.partial(self.entities_ordering_keys, data),
+                self.data_handler,
+                connection,
+                channel,
+                delivery_tag,
+                data,
+                priority=self.message_priority(data),
+            )
+        else:
+            self.execution_pool.submit(
+                self.work_ordering_keys(data),
+                self.data_handler,
+                connection,
+                channel,
+                delivery_tag,
+                data,
+                priority=self.message_priority(data),
+            )
+
+    def retry_later(  # pylint: disable=too-many-arguments
+        self,
+        policy_name: str,
+        connection: Any,
+        channel: BlockingChannel,
+        delivery_tag: Union[int, List[int]],
+        data: Dict[str, Any],
+        attempt: int,
+    ) -> Any:
+        delay = self.retry_policies[policy_name].next_delay(attempt)
         self.worker_logger.info(
-            "Processing a new message, launching a thread...",
-            {"tag": method.delivery_tag},
+            "Message reprocess scheduled",
+            {"tag": delivery_tag, "count": attempt, "delay": delay},
+        )
+        return self.resume_later(
+            delay, connection, channel, delivery_tag, data, attempt + 1
+        )
+
+    def resume_later(  # pylint: disable=too-many-arguments
+        self,
+        delay: float,
+        connection: Any,
+        channel: BlockingChannel,
+        delivery_tag: Union[int, List[int]],
+        data: Dict[str, Any],
+        attempt: int,
+    ) -> Any:
+        # Park the message: the thread is released for other messages while the
+        # ordering keys are kept until the message is processed again.
+        retry = functools.partial(
+            self.execution_pool.resume,
+            self.execution_pool.current_keys(),
+            self.data_handler,
+            connection,
+            channel,
+            delivery_tag,
+            data,
+            attempt,
+            priority=self.message_priority(data),
         )
-        thread = Thread(
-            target=self.data_handler,
-            args=[self.pika_connection, channel, method.delivery_tag, data],
+        return self.park(delay, connection, delivery_tag, retry)
+
+    def reject_later(
+        self,
+        policy_name: str,
+        connection: Any,
+        channel: BlockingChannel,
+        delivery_tag: Union[int, List[int]],
+        data: Dict[str, Any],
+    ) -> Any:
+        # Give the message back to the broker after a delay, without holding
+        # a thread while waiting.
+        delay = self.retry_policies[policy_name].next_delay(1)
+        reject = functools.partial(
+            self.execution_pool.resume,
+            self.execution_pool.current_keys(),
+            connection.add_callback_threadsafe,
+            functools.partial(self.nack_message, channel, delivery_tag),
+            priority=self.message_priority(data),
         )
-        thread.start()
-        while thread.is_alive():  # Loop while the thread is processing
-            self.pika_connection.sleep(0.05)
-        self.worker_logger.info("Message processed, thread terminated")
+        return self.park(delay, connection, delivery_tag, reject)
+
+    def park(
+        self,
+        delay: float,
+        connection: Any,
+        delivery_tag: Union[int, List[int]],
+        resume: Callable[[], Any],
+    ) -> Any:
+        # Unacked parked messages would fill the prefetch window and stall the
+        # queue behind them, the window is widened (see prefetch_count) until
+        # they are resumed.
+        count = len(delivery_tag) if isinstance(delivery_tag, list) else 1
+        connection.add_callback_threadsafe(functools.partial(self.set_parked, count))
+
+        def unpark() -> None:
+            resume()
+            connection.add_callback_threadsafe(
+                functools.partial(self.set_parked, -count)
+            )
+
+        self.retry_scheduler.schedule(delay, unpark)
+        return OrderedExecutor.PARKED
+
+    def import_bundle_batches(  # pylint: disable=too-many-arguments
+        self,
+        api: OpenCTIApiClient,
+        work_id: Optional[str],
+        data: Dict[str, Any],
+        bundle: Dict[str, Any],
+        hashes: Optional[Dict[str, str]],
+        update: bool,
+        types: Optional[List[str]],
+        processing_count: Optional[int],
+    ) -> None:
+        # Progress is kept in the message so retries start from the failed batch
+        batches = split_bundle(bundle.pop("objects"), self.bundle_split_size)
+        if "split_batches" not in data:
+            if work_id is not None and len(batches) > 1:
+                # One expectation was set for the whole bundle
+                api.work.add_expectations(work_id, len(batches) - 1)
+            data["split_batches"] = len(batches)
+            data["split_index"] = 0
+        for index in range(data["split_index"], len(batches)):
+            self.worker_logger.info(
+                "Importing bundle batch",
+                {"index": index, "batches": len(batches), "work_id": work_id},
+            )
+            batch = {**bundle, "objects": batches[index]}
+            with tracer.start_as_current_span(
+                "worker.import_batch",
+                attributes={
+                    "opencti.batch": index,
+                    "opencti.objects": len(batches[index]),
+                },
+            ):
+                api.stix2.import_bundle(batch, update, types, processing_count)
+            self.record_imported(data, batches[index], hashes, update)
+            data["split_index"] = index + 1
+            # Expectation of the last batch is reported with the message ack
+            if work_id is not None and index < len(batches) - 1:
+                api.work.report_expectation(work_id, None)
+
+    @staticmethod
+    def skip_failed_batch(data: Dict[str, Any]) -> bool:
+        # Failed batch of a split bundle is reported, the next ones still have
+        # to be imported.
+        if "split_batches" not in data:
+            return False
+        data["split_index"] += 1
+        return bool(data["split_index"] < data["split_batches"])
+
+    def is_upsert(self, data: Dict[str, Any], update: bool) -> bool:
+        # Versions are only compared for imports overwriting the entities
+        return bool(update or data.get("synchronized", False))
+
+    def trim_imported(
+        self,
+        data: Dict[str, Any],
+        bundle: Dict[str, Any],
+        update: bool,
+        types: Optional[List[str]],
+    ) -> Optional[Dict[str, str]]:
+        # Objects imported recently or unchanged since their last upsert are not
+        # sent again, hashes of the remaining ones are recorded once imported.
+        # Imports restricted to some types skip the other objects, which are
+        # neither trimmed nor recorded.
+        versioned = self.version_index is not None and self.is_upsert(data, update)
+        if (
+            (self.dedup_cache is None and not versioned)
+            or "objects" not in bundle
+            or types is not None
+        ):
+            return None
+        objects = bundle["objects"]
+        if "trimmed_indexes" in data:
+            # Retries import the objects kept by the first attempt: trimmed
+            # again, the batches already imported would be dropped and the
+            # progress of a split bundle would apply to other batches.
+            bundle["objects"] = [objects[index] for index in data["trimmed_indexes"]]
+            return data["trimmed_hashes"]
+        kept = objects
+        # A plain import does not overwrite the entities: not a reason to skip
+        # the same content sent again for an update
+        prefix = "update:" if update else ""
+        keys = [prefix + object_hash(stix_object) for stix_object in objects]
+        if self.dedup_cache is not None:
+            kept, keys = self.dedup_cache.trim(kept, keys)
+        if versioned:
+            kept, keys = self.version_index.changed(kept, keys)
+        kept_ids = {id(stix_object) for stix_object in kept}
+        data["trimmed_indexes"] = [
+            index
+            for index, stix_object in enumerate(objects)
+            if id(stix_object) in kept_ids
+        ]
+        data["trimmed_hashes"] = {
+            stix_object.get("id", ""): key for stix_object, key in zip(kept, keys)
+        }
+        bundle["objects"] = kept
+        return data["trimmed_hashes"]
+
+    def record_imported(
+        self,
+        data: Dict[str, Any],
+        objects: List[Dict[str, Any]],
+        hashes: Optional[Dict[str, str]],
+        update: bool,
+    ) -> None:
+        if hashes is None:
+            return
+        if self.dedup_cache is not None:
+            self.dedup_cache.add(objects, hashes)
+        if self.version_index is not None and self.is_upsert(data, update):
+            self.version_index.record(objects, hashes)
+
+    def forget_imported(self, stix_ids: List[str]) -> None:
+        # Deleted and merged entities must be imported again
+        if self.dedup_cache is not None:
+            self.dedup_cache.invalidate(stix_ids)
+        if self.version_index is not None:
+            self.version_index.remove(stix_ids)
+
+    def import_objects(  # pylint: disable=too-many-arguments
+        self,
+        api: OpenCTIApiClient,
+        data: Dict[str, Any],
+        bundle: Dict[str, Any],
+        hashes: Optional[Dict[str, str]],
+        update: bool,
+        types: Optional[List[str]],
+        processing_count: Optional[int],
+    ) -> None:
+        if hashes is not None and len(bundle["objects"]) == 0:
+            # Every object was already imported
+            return
+        with tracer.start_as_current_span(
+            "worker.import_bundle",
+            attributes={"opencti.objects": len(bundle.get("objects", []))},
+        ):
+            api.stix2.import_bundle(bundle, update, types, processing_count)
+        self.record_imported(data, bundle["objects"], hashes, update)
 
     # Data handling
-    def data_handler(  # pylint: disable=too-many-statements, too-many-locals
+    def data_handler(
+        self,
+        connection: Any,
+        channel: BlockingChannel,
+        delivery_tag: Union[int, List[int]],
+        data: Dict[str, Any],
+        attempt: int = 1,
+    ) -> Any:
+        if not channel.is_open:
+            # Consumer stopped, the broker gave the message to another consumer
+            self.worker_logger.info(
+                "Message dropped (channel closed)", {"tag": delivery_tag}
+            )
+            return False
+        with tracer.start_as_current_span(
+            "worker.process",
+            context=propagate.extract(data.get("trace_context", {})),
+            attributes={
+                "messaging.destination.name": self.queue_name,
+                "opencti.applicant_id": data.get("applicant_id", ""),
+                "opencti.work_id": data.get("work_id") or "",
+                "opencti.attempt": attempt,
+            },
+        ):
+            return self.process_data(connection, channel, delivery_tag, data, attempt)
+
+    def process_data(  # pylint: disable=too-many-statements, too-many-locals
         self,
         connection: Any,
         channel: BlockingChannel,
-        delivery_tag: str,
+        delivery_tag: Union[int, List[int]],
         data: Dict[str, Any],
-    ) -> Optional[bool]:
+        attempt: int,
+    ) -> Any:
         start_processing = datetime.datetime.now()
+        api = self.thread_api()
         # Set the API headers
         applicant_id = data["applicant_id"]
-        self.api.set_applicant_id_header(applicant_id)
+        api.set_applicant_id_header(applicant_id)
         work_id = data["work_id"] if "work_id" in data else None
         synchronized = data["synchronized"] if "synchronized" in data else False
-        self.api.set_synchronized_upsert_header(synchronized)
+        api.set_synchronized_upsert_header(synchronized)
+        event_type = data["type"] if "type" in data else "bundle"
+        metric_event_type = "coalesced" if "coalesced" in data else event_type
+        outcome = "unknown"
         # Execute the import
-        self.processing_count += 1
-        content = "Unparseable"
         try:
-            event_type = data["type"] if "type" in data else "bundle"
             types = (
                 data["entities_types"]
                 if "entities_types" in data and len(data["entities_types"]) > 0
                 else None
             )
-            processing_count = self.processing_count
-            if self.processing_count == PROCESSING_COUNT:
-                processing_count = None  # type: ignore
+            processing_count: Optional[int] = attempt
+            if attempt == PROCESSING_COUNT:
+                processing_count = None
             if event_type == "bundle":
-                content = base64.b64decode(data["content"]).decode("utf-8")
+                with tracer.start_as_current_span("worker.decode_bundle"):
+                    bundle = decode_bundle(data["content"])
                 update = data["update"] if "update" in data else False
-                self.api.stix2.import_bundle_from_json(
-                    content, update, types, processing_count
-                )
+                if attempt == 1 and "split_batches" not in data:
+                    attributes = self.metric_attributes(metric_event_type)
+                    bundles_size_histogram.record(
+                        len(data["content"]) * 3 // 4, attributes
+                    )
+                    bundles_objects_histogram.record(
+                        len(bundle["objects"]) if "objects" in bundle else 0,
+                        attributes,
+                    )
+                hashes = self.trim_imported(data, bundle, update, types)
+                if 0 < self.bundle_split_size < len(data["content"]) * 3 // 4:
+                    self.import_bundle_batches(
+                        api,
+                        work_id,
+                        data,
+                        bundle,
+                        hashes,
+                        update,
+                        types,
+                        processing_count,
+                    )
+                else:
+                    self.import_objects(
+                        api, data, bundle, hashes, update, types, processing_count
+                    )
                 # Ack the message
-                cb = functools.partial(self.ack_message, channel, delivery_tag)
+                cb = traced_callback(
+                    "worker.ack",
+                    functools.partial(self.ack_message, channel, delivery_tag),
+                )
                 connection.add_callback_threadsafe(cb)
                 if work_id is not None:
-                    self.api.work.report_expectation(work_id, None)
-                self.processing_count = 0
-                bundles_success_counter.add(1)
+                    api.work.report_expectation(work_id, None)
+                outcome = "success"
+                bundles_success_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 return True
             elif event_type == "event":
-                event = base64.b64decode(data["content"]).decode("utf-8")
-                event_content = json.loads(event)
+                with tracer.start_as_current_span("worker.decode_event"):
+                    event_content = decode_event(data["content"])
                 event_type = event_content["type"]
+                metric_event_type = event_type
+                if attempt == 1:
+                    bundles_size_histogram.record(
+                        len(data["content"]) * 3 // 4,
+                        self.metric_attributes(metric_event_type),
+                    )
                 if event_type == "create" or event_type == "update":
                     bundle = {
                         "type": "bundle",
                         "objects": [event_content["data"]],
                     }
-                    self.api.stix2.import_bundle(bundle, True, types, processing_count)
+                    hashes = self.trim_imported(
+                        data, bundle, event_type == "update", types
+                    )
+                    self.import_objects(
+                        api, data, bundle, hashes, True, types, processing_count
+                    )
                 elif event_type == "delete":
                     delete_id = event_content["data"]["id"]
-                    self.api.stix.delete(id=delete_id)
+                    self.forget_imported([delete_id])
+                    with tracer.start_as_current_span("worker.delete"):
+                        api.stix.delete(id=delete_id)
                 elif event_type == "merge":
                     # Start with a merge
                     target_id = event_content["data"]["id"]
@@ -296,118 +1172,239 @@ class Consumer(Thread):  # pylint: disable=too-many-instance-attributes
                             event_content["context"]["sources"],
                         )
                     )
-                    self.api.stix.merge(id=target_id, object_ids=source_ids)
+                    self.forget_imported([target_id] + source_ids)
+                    with tracer.start_as_current_span("worker.merge"):
+                        api.stix.merge(id=target_id, object_ids=source_ids)
                     # Update the target entity after merge
                     bundle = {
                         "type": "bundle",
                         "objects": [event_content["data"]],
                     }
-                    self.api.stix2.import_bundle(bundle, True, types, processing_count)
+                    with tracer.start_as_current_span("worker.import_bundle"):
+                        api.stix2.import_bundle(bundle, True, types, processing_count)
                 # Ack the message
-                cb = functools.partial(self.ack_message, channel, delivery_tag)
+                cb = traced_callback(
+                    "worker.ack",
+                    functools.partial(self.ack_message, channel, delivery_tag),
+                )
                 connection.add_callback_threadsafe(cb)
-                self.processing_count = 0
-                bundles_success_counter.add(1)
+                outcome = "success"
+                bundles_success_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 return True
             else:
-                # Unknown type, just move on.
+                # Unknown type, just move on: acked so the message leaves the
+                # messages in flight and its prefetch slot is given back.
+                self.worker_logger.warning(
+                    "Message of unknown type acknowledged",
+                    {"tag": delivery_tag, "type": event_type},
+                )
+                cb = traced_callback(
+                    "worker.ack",
+                    functools.partial(self.ack_message, channel, delivery_tag),
+                )
+                connection.add_callback_threadsafe(cb)
                 return True
         except Timeout:
-            bundles_timeout_error_counter.add(1)
+            outcome = "timeout"
+            bundles_timeout_error_counter.add(
+                1, self.metric_attributes(metric_event_type, outcome)
+            )
             self.worker_logger.warning("A connection timeout occurred")
-            time.sleep(60)
-            # Platform is under heavy load: wait for unlock & retry almost indefinitely.
-            sleep_jitter = round(random.uniform(10, 30), 2)
-            time.sleep(sleep_jitter)
-            self.data_handler(connection, channel, delivery_tag, data)
-            return True
+            if self.retry_policies["timeout"].can_retry(attempt):
+                return self.retry_later(
+                    "timeout", connection, channel, delivery_tag, data, attempt
+                )
+            self.worker_logger.error(
+                "Message NOT acknowledged",
+                {"tag": delivery_tag, "type": "Timeout"},
+            )
+            cb = traced_callback(
+                "worker.nack",
+                functools.partial(self.nack_message, channel, delivery_tag),
+            )
+            connection.add_callback_threadsafe(cb)
+            return False
         except RequestException:
-            bundles_request_error_counter.add(1, {"origin": "opencti-worker"})
+            outcome = "request_error"
+            bundles_request_error_counter.add(
+                1,
+                {
+                    **self.metric_attributes(metric_event_type, outcome),
+                    "origin": "opencti-worker",
+                },
+            )
+            if "split_batches" in data:
+                # A redelivered split bundle would add its expectations and
+                # import its first batches again, it is retried in place
+                return self.retry_later(
+                    "bad_gateway", connection, channel, delivery_tag, data, attempt
+                )
             self.worker_logger.error(
                 "Message NOT acknowledged",
                 {"tag": delivery_tag, "type": "RequestException"},
             )
-            cb = functools.partial(self.nack_message, channel, delivery_tag)
+            cb = traced_callback(
+                "worker.nack",
+                functools.partial(self.nack_message, channel, delivery_tag),
+            )
             connection.add_callback_threadsafe(cb)
-            self.processing_count = 0
             return False
         except Exception as ex:  # pylint: disable=broad-except
+            outcome = "technical_error"
             error = str(ex)
             error_msg = traceback.format_exc()
-            if (
-                "LOCK_ERROR" in error_msg
-                and self.processing_count < MAX_PROCESSING_COUNT
-            ):
-                bundles_lock_error_counter.add(1)
+            policies = self.retry_policies
+            if "LOCK_ERROR" in error_msg and policies["lock"].can_retry(attempt):
+                outcome = "lock_error"
+                bundles_lock_error_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 # Platform is under heavy load:
                 # wait for unlock & retry almost indefinitely.
-                sleep_jitter = round(random.uniform(10, 30), 2)
-                time.sleep(sleep_jitter)
-                self.data_handler(connection, channel, delivery_tag, data)
-            elif (
-                "MISSING_REFERENCE_ERROR" in error_msg
-                and self.processing_count < PROCESSING_COUNT
-            ):
-                bundles_missing_reference_error_counter.add(1)
+                return self.retry_later(
+                    "lock", connection, channel, delivery_tag, data, attempt
+                )
+            elif "MISSING_REFERENCE_ERROR" in error_msg and policies[
+                "missing_reference"
+            ].can_retry(attempt):
+                outcome = "missing_reference_error"
+                bundles_missing_reference_error_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 # In case of missing reference, wait & retry
-                sleep_jitter = round(random.uniform(1, 3), 2)
-                time.sleep(sleep_jitter)
-                self.worker_logger.info(
-                    "Message reprocess",
-                    {"tag": delivery_tag, "count": self.processing_count},
+                return self.retry_later(
+                    "missing_reference",
+                    connection,
+                    channel,
+                    delivery_tag,
+                    data,
+                    attempt,
                 )
-                self.data_handler(connection, channel, delivery_tag, data)
             elif "MISSING_REFERENCE_ERROR" in error_msg:
                 self.worker_logger.warning(error_msg)
-                self.processing_count = 0
-                cb = functools.partial(self.ack_message, channel, delivery_tag)
-                connection.add_callback_threadsafe(cb)
                 if work_id is not None:
-                    self.api.work.report_expectation(
+                    api.work.report_expectation(
                         work_id,
-                        {
-                            "error": error,
-                            "source": (
-                                content if len(content) < 50000 else "Bundle too large"
-                            ),
-                        },
+                        {"error": error, "source": message_source(data)},
+                    )
+                if self.skip_failed_batch(data):
+                    return self.resume_later(
+                        0, connection, channel, delivery_tag, data, 1
                     )
+                cb = traced_callback(
+                    "worker.ack",
+                    functools.partial(self.ack_message, channel, delivery_tag),
+                )
+                connection.add_callback_threadsafe(cb)
                 return False
             elif "Bad Gateway" in error_msg:
-                bundles_bad_gateway_error_counter.add(1)
+                outcome = "bad_gateway_error"
+                bundles_bad_gateway_error_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 self.worker_logger.error("A connection error occurred")
-                time.sleep(60)
+                if "split_batches" in data:
+                    # Progress of a split bundle is lost with a redelivery
+                    return self.retry_later(
+                        "bad_gateway", connection, channel, delivery_tag, data, attempt
+                    )
                 self.worker_logger.info(
                     "Message NOT acknowledged (Bad Gateway)", {"tag": delivery_tag}
                 )
-                cb = functools.partial(self.nack_message, channel, delivery_tag)
-                connection.add_callback_threadsafe(cb)
-                self.processing_count = 0
-                return False
+                return self.reject_later(
+                    "bad_gateway", connection, channel, delivery_tag, data
+                )
             else:
-                bundles_technical_error_counter.add(1)
+                outcome = "technical_error"
+                bundles_technical_error_counter.add(
+                    1, self.metric_attributes(metric_event_type, outcome)
+                )
                 # Platform does not know what to do and raises an error:
                 # fail and acknowledge the message.
                 self.worker_logger.error(error)
-                self.processing_count = 0
-                cb = functools.partial(self.ack_message, channel, delivery_tag)
-                connection.add_callback_threadsafe(cb)
                 if work_id is not None:
-                    self.api.work.report_expectation(
+                    api.work.report_expectation(
                         work_id,
-                        {
-                            "error": error,
-                            "source": (
-                                content if len(content) < 50000 else "Bundle too large"
-                            ),
-                        },
+                        {"error": error, "source": message_source(data)},
+                    )
+                if self.skip_failed_batch(data):
+                    return self.resume_later(
+                        0, connection, channel, delivery_tag, data, 1
                     )
+                cb = traced_callback(
+                    "worker.ack",
+                    functools.partial(self.ack_message, channel, delivery_tag),
+                )
+                connection.add_callback_threadsafe(cb)
                 return False
-            return None
         finally:
-            bundles_global_counter.add(1)
+            span = trace.get_current_span()
+            span.set_attribute("opencti.event_type", metric_event_type)
+            span.set_attribute("opencti.outcome", outcome)
+            if outcome not in ("success", "unknown"):
+                span.set_status(Status(StatusCode.ERROR, outcome))
+            attributes = self.metric_attributes(metric_event_type, outcome)
+            bundles_global_counter.add(1, attributes)
             processing_delta = datetime.datetime.now() - start_processing
-            bundles_processing_time_gauge.record(processing_delta.seconds)
+            bundles_processing_time_gauge.record(
+                processing_delta.total_seconds(), attributes
+            )
+            processing_duration_histogram.record(
+                processing_delta.total_seconds() * 1000, attributes
+            )
+
+
+@dataclass(unsafe_hash=True)
+class Consumer(MessageProcessor, Thread):  # pylint: disable=too-many-ancestors
+    def __post_init__(self) -> None:
+        Thread.__init__(self)
+        super().__post_init__()
+
+        self.transport = self.create_transport()
+        self.transport.basic_qos(prefetch_count=self.prefetch_count())
+        self.ack_batcher = self.create_ack_batcher(
+            self.transport, self.transport.call_later
+        )
+        self.execution_pool = OrderedExecutor(
+            max(self.execution_pool_size, self.max_concurrency),
+            "worker-" + self.queue_name,
+        )
+
+    def create_transport(self) -> Transport:
+        return PikaTransport(self.connector, self.config, self.worker_logger)
+
+    def apply_prefetch(self) -> None:
+        if self.transport.is_open:
+            self.transport.basic_qos(prefetch_count=self.prefetch_count())
+
+    def set_concurrency(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.transport.add_callback_threadsafe(self.apply_prefetch)
+
+    def drain(self) -> None:
+        # Stop consuming, the consumer thread then finishes the messages in
+        # flight (see drain_in_flight) and closes its transport
+        self.transport.add_callback_threadsafe(self.transport.stop_consuming)
+
+    def drain_in_flight(self) -> None:
+        start = time.monotonic()
+        self.flush_events()
+        while self.in_flight > 0 and time.monotonic() - start < self.drain_timeout:
+            # Run the acks sent by the processing threads
+            self.transport.sleep(0.1)
+        if self.ack_batcher is not None:
+            self.ack_batcher.flush()
+        self.record_drain(start)
+
+    # Callable for consuming a message
+    def _process_message(
+        self, delivery_tag: int, priority: Optional[int], body: bytes
+    ) -> None:
+        self.submit_message(
+            self.transport, self.transport, delivery_tag, body, priority
+        )
 
     def run(self) -> None:
         try:
@@ -415,28 +1412,497 @@ class Consumer(Thread):  # pylint: disable=too-many-instance-attributes
             self.worker_logger.info(
                 "Thread for queue started", {"queue": self.queue_name}
             )
-            self.channel.basic_consume(
-                queue=self.queue_name,
-                on_message_callback=self._process_message,
-            )
-            self.channel.start_consuming()
+            self.transport.consume(self.queue_name, self._process_message)
+            self.drain_in_flight()
         finally:
-            self.channel.stop_consuming()
+            self.execution_pool.shutdown(wait=False)
+            try:
+                self.transport.close()
+            except Exception as e:  # pylint: disable=broad-except
+                self.worker_logger.warning(str(e))
             self.worker_logger.info(
                 "Thread for queue terminated", {"queue": self.queue_name}
             )
 
 
 @dataclass(unsafe_hash=True)
-class Worker:  # pylint: disable=too-few-public-methods, too-many-instance-attributes
-    logs_all_queue: str = "logs_all"
-    consumer_threads: Dict[str, Any] = field(default_factory=dict, hash=False)
-    logger_threads: Dict[str, Any] = field(default_factory=dict, hash=False)
+class AsyncConsumer(MessageProcessor):
+    """Consumer of one queue, using a channel of the engine shared connection."""
+
+    engine: Any = field(default=None, hash=False, compare=False)
 
     def __post_init__(self) -> None:
-        # Get configuration
-        config_file_path = os.path.join(
-            os.path.dirname(os.path.abspath(__file__)), "config.yml"
+        super().__post_init__()
+        self.execution_pool = self.engine.execution_pool
+        self.connection: Optional[AsyncioConnection] = None
+        self.channel: Any = None
+        self.consumer_tag: Optional[str] = None
+
+    def open(self, connection: AsyncioConnection) -> None:
+        self.connection = connection
+        connection.channel(on_open_callback=self.on_channel_open)
+
+    def on_channel_open(self, channel: Any) -> None:
+        self.channel = channel
+        channel.add_on_close_callback(self.on_channel_closed)
+        assert self.engine.loop is not None
+        self.ack_batcher = self.create_ack_batcher(channel, self.engine.loop.call_later)
+        channel.basic_qos(prefetch_count=self.prefetch_count(), callback=self.on_qos_ok)
+
+    def on_qos_ok(self, _frame: Any) -> None:
+        self.worker_logger.info("Channel for queue started", {"queue": self.queue_name})
+        self.consumer_tag = self.channel.basic_consume(
+            queue=self.queue_name, on_message_callback=self._process_message
+        )
+
+    def on_channel_closed(self, _channel: Any, reason: Exception) -> None:
+        self.worker_logger.info(
+            "Channel for queue terminated",
+            {"queue": self.queue_name, "reason": str(reason)},
+        )
+        self.engine.remove_consumer(self)
+
+    def is_alive(self) -> bool:
+        return self.connection is not None and self.connection.is_open
+
+    def apply_prefetch(self) -> None:
+        if self.channel is not None and self.channel.is_open:
+            self.channel.basic_qos(prefetch_count=self.prefetch_count())
+
+    def set_concurrency(self, concurrency: int) -> None:
+        self.concurrency = concurrency
+        self.engine.add_callback_threadsafe(self.apply_prefetch)
+
+    def cancel(self) -> None:
+        # Messages delivered after the cancel are rejected by the channel
+        if self.channel is not None and self.channel.is_open:
+            if self.consumer_tag is not None:
+                self.channel.basic_cancel(self.consumer_tag)
+        self.flush_events()
+
+    def close(self) -> None:
+        if self.channel is not None and self.channel.is_open:
+            if self.ack_batcher is not None:
+                self.ack_batcher.flush()
+            self.channel.close()
+
+    # Callable for consuming a message
+    def _process_message(
+        self,
+        channel: Any,
+        method: Any,
+        properties: Any,
+        body: bytes,
+    ) -> None:
+        self.submit_message(
+            self.engine,
+            channel,
+            method.delivery_tag,
+            body,
+            properties.priority if properties is not None else None,
+        )
+
+
+class AsyncEngine:
+    """Consume every queue from one event loop.
+
+    Queues sharing the same broker settings use one AMQP connection with a channel
+    per queue, messages are processed by one executor shared by all the queues.
+    """
+
+    def __init__(self, worker: "Worker") -> None:
+        self.worker = worker
+        self.worker_logger = worker.worker_logger
+        self.thread_local = threading.local()
+        self.execution_pool = OrderedExecutor(worker.engine_pool_size, "worker")
+        self.connections: Dict[Any, AsyncioConnection] = {}
+        self.consumers: Dict[str, AsyncConsumer] = {}
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.stopping: Optional[asyncio.Event] = None
+
+    # Used by the processing threads to marshal acks back to the event loop
+    def add_callback_threadsafe(self, callback: Callable[[], Any]) -> None:
+        assert self.loop is not None
+        self.loop.call_soon_threadsafe(callback)
+
+    def remove_consumer(self, consumer: AsyncConsumer) -> None:
+        if self.consumers.get(consumer.queue_name) is consumer:
+            self.consumers.pop(consumer.queue_name, None)
+
+    def on_connection_closed(
+        self, connection: AsyncioConnection, reason: Exception
+    ) -> None:
+        self.worker_logger.warning(
+            "Connection to the broker closed", {"reason": str(reason)}
+        )
+        for key, value in list(self.connections.items()):
+            if value is connection:
+                self.connections.pop(key, None)
+        for consumer in list(self.consumers.values()):
+            if consumer.connection is connection:
+                self.remove_consumer(consumer)
+
+    async def get_connection(self, connector: Dict[str, Any]) -> AsyncioConnection:
+        key = broker_key(connector)
+        connection = self.connections.get(key)
+        if connection is not None and connection.is_open:
+            return connection
+        assert self.loop is not None
+        opened: asyncio.Future[AsyncioConnection] = self.loop.create_future()
+
+        def on_open(conn: AsyncioConnection) -> None:
+            if not opened.done():
+                opened.set_result(conn)
+
+        def on_open_error(_conn: AsyncioConnection, err: Any) -> None:
+            if not opened.done():
+                opened.set_exception(
+                    err if isinstance(err, BaseException) else Exception(str(err))
+                )
+
+        AsyncioConnection(
+            build_pika_parameters(connector, self.worker.config),
+            on_open_callback=on_open,
+            on_open_error_callback=on_open_error,
+            on_close_callback=self.on_connection_closed,
+            custom_ioloop=self.loop,
+        )
+        connection = await opened
+        self.connections[key] = connection
+        return connection
+
+    async def reconcile(self, connectors: List[Any]) -> None:
+        assert self.loop is not None
+        connectors_by_queue = {
+            connector["config"]["push"]: connector for connector in connectors
+        }
+        for queue, connector in connectors_by_queue.items():
+            fingerprint = self.worker.connector_fingerprint(connector)
+            consumer = self.consumers.get(queue)
+            if consumer is not None and consumer.is_alive():
+                if consumer.fingerprint == fingerprint:
+                    continue
+                self.worker_logger.info(
+                    "Settings of queue changed, draining channel...", {"queue": queue}
+                )
+                self.loop.create_task(self.drain([self.consumers.pop(queue)]))
+            self.worker_logger.info("Opening channel for queue", {"queue": queue})
+            connection = await self.get_connection(connector)
+            consumer = AsyncConsumer(
+                connector,
+                self.worker.config,
+                self.worker.opencti_url,
+                self.worker.opencti_token,
+                self.worker.log_level,
+                self.worker.opencti_ssl_verify,
+                self.worker.opencti_json_logging,
+                self.worker.get_execution_pool_size(connector),
+                api=self.worker.api,
+                thread_local=self.thread_local,
+                api_session=self.worker.api_session,
+                retry_scheduler=self.worker.retry_scheduler,
+                retry_policies=self.worker.retry_policies,
+                ordering=self.worker.ordering,
+                bundle_split_size=self.worker.bundle_split_size,
+                event_coalescing_window=self.worker.event_coalescing_window,
+                event_coalescing_max_size=self.worker.event_coalescing_max_size,
+                max_concurrency=self.worker.max_concurrency,
+                priority_class=self.worker.get_priority_class(connector),
+                connector_type=self.worker.connectors_types.get(connector["id"], ""),
+                drain_timeout=self.worker.drain_timeout,
+                fingerprint=fingerprint,
+                ack_batch_size=self.worker.ack_batch_size,
+                ack_batch_delay=self.worker.ack_batch_delay,
+                max_parked=self.worker.max_parked,
+                dedup_cache=self.worker.dedup_cache,
+                version_index=self.worker.version_index,
+                engine=self,
+            )
+            self.consumers[queue] = consumer
+            consumer.open(connection)
+        for queue in self.consumers.keys() - connectors_by_queue.keys():
+            self.worker_logger.info(
+                "Queue no longer exists, draining channel...", {"queue": queue}
+            )
+            self.loop.create_task(self.drain([self.consumers.pop(queue)]))
+
+    async def drain(self, consumers: List[AsyncConsumer]) -> None:
+        start = time.monotonic()
+        for consumer in consumers:
+            consumer.cancel()
+        # Acks of the processing threads are run by the loop while waiting
+        pending = list(consumers)
+        while len(pending) > 0 and time.monotonic() - start < self.worker.drain_timeout:
+            for consumer in [c for c in pending if c.in_flight <= 0]:
+                consumer.record_drain(start)
+                consumer.close()
+                pending.remove(consumer)
+            await asyncio.sleep(0.1)
+        for consumer in pending:
+            consumer.record_drain(start)
+            consumer.close()
+
+    def stop(self) -> None:
+        self.worker_logger.info("Stopping the asyncio engine")
+        if self.stopping is not None:
+            self.stopping.set()
+
+    async def run(self) -> None:
+        self.loop = asyncio.get_running_loop()
+        self.stopping = asyncio.Event()
+        for signum in (signal.SIGTERM, signal.SIGINT):
+            self.loop.add_signal_handler(signum, self.stop)
+        self.worker.health.consumers = self.consumers
+        if self.worker.autoscaler is not None:
+            self.worker.autoscaler.consumers = self.consumers
+        try:
+            while not self.stopping.is_set():
+                try:
+                    # Fetch queue configuration from API
+                    connectors = await self.loop.run_in_executor(
+                        None, self.worker.list_connectors
+                    )
+                    await self.reconcile(connectors)
+                except Exception as e:  # pylint: disable=broad-except
+                    self.worker_logger.error(type(e).__name__, {"reason": str(e)})
+                try:
+                    await asyncio.wait_for(
+                        self.stopping.wait(), self.worker.connectors_refresh_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+            await self.drain(list(self.consumers.values()))
+        finally:
+            for consumer in list(self.consumers.values()):
+                consumer.close()
+            for connection in list(self.connections.values()):
+                if connection.is_open:
+                    connection.close()
+            self.execution_pool.shutdown(wait=False)
+
+    def start(self) -> None:
+        asyncio.run(self.run())
+
+
+def process_ports(base_port: int, processes: int, index: int) -> Tuple[int, int]:
+    # Telemetry and health endpoint ports of a worker process, each kind of
+    # endpoint in its own range
+    return base_port + index, base_port + processes + index
+
+
+def run_worker_process(process_index: int, heartbeat: Any) -> None:
+    Worker(process_index=process_index, heartbeat=heartbeat).start()
+
+
+class ProcessesCollector:
+    """Metrics of the worker processes, scraped and labelled with their index."""
+
+    def __init__(self, supervisor: "Supervisor") -> None:
+        self.supervisor = supervisor
+
+    def collect(self) -> Iterable[Metric]:
+        families: Dict[str, Metric] = {}
+        for index in range(self.supervisor.processes):
+            port = process_ports(
+                self.supervisor.base_port, self.supervisor.processes, index
+            )[0]
+            url = "http://127.0.0.1:%d/metrics" % port
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    text = response.read().decode("utf-8")
+            except OSError:
+                # Process restarting, its metrics are missing from this scrape
+                continue
+            for family in text_string_to_metric_families(text):
+                merged = families.get(family.name)
+                if merged is None:
+                    merged = Metric(family.name, family.documentation, family.type)
+                    families[family.name] = merged
+                merged.samples.extend(
+                    sample._replace(labels={**sample.labels, "process": str(index)})
+                    for sample in family.samples
+                )
+        yield from families.values()
+        up = GaugeMetricFamily(
+            "opencti_worker_process_up",
+            "1 if the worker process is running",
+            labels=["process"],
+        )
+        restarts = CounterMetricFamily(
+            "opencti_worker_process_restarts",
+            "number of restarts of the worker process",
+            labels=["process"],
+        )
+        for index, process in enumerate(self.supervisor.children):
+            alive = process is not None and process.is_alive()
+            up.add_metric([str(index)], 1 if alive else 0)
+            restarts.add_metric([str(index)], self.supervisor.restarts[index])
+        yield up
+        yield restarts
+
+
+class Supervisor:
+    """Worker processes of a multi-process worker, to use every core of a node.
+
+    Every child process is a whole worker (consumers, retries, health monitor)
+    consuming its share of the queues. Children are restarted when they exit or
+    stop sending heartbeats, with a backoff while they keep failing. Their
+    metrics are served together on the telemetry endpoint of the supervisor,
+    their heartbeats and readiness on its health endpoint.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        worker_logger: Any,
+        processes: int,
+        heartbeat_timeout: int,
+        stop_timeout: int,
+        base_port: int,
+        telemetry: Optional[Tuple[str, int]] = None,
+        health_endpoint: Optional[Tuple[str, int]] = None,
+    ) -> None:
+        self.worker_logger = worker_logger
+        self.processes = processes
+        self.heartbeat_timeout = heartbeat_timeout
+        self.stop_timeout = stop_timeout
+        self.base_port = base_port
+        self.telemetry = telemetry
+        self.health_endpoint = health_endpoint
+        # Spawned: the supervisor threads and connections are not inherited
+        self.context = multiprocessing.get_context("spawn")
+        self.children: List[Any] = [None] * processes
+        self.heartbeats = [self.context.Value("d", 0.0) for _ in range(processes)]
+        self.started = [0.0] * processes
+        self.restarts = [0] * processes
+        self.failures = [0] * processes
+        self.next_start = [0.0] * processes
+        self.exit_event = threading.Event()
+
+    def start_child(self, index: int) -> None:
+        self.heartbeats[index].value = time.time()
+        process = self.context.Process(
+            target=run_worker_process,
+            args=(index, self.heartbeats[index]),
+            name="opencti-worker-%d" % index,
+        )
+        process.start()
+        self.children[index] = process
+        self.started[index] = time.monotonic()
+        self.worker_logger.info(
+            "Worker process started", {"process": index, "pid": process.pid}
+        )
+
+    def check_child(self, index: int) -> None:
+        process = self.children[index]
+        if process is not None and process.is_alive():
+            if time.time() - self.heartbeats[index].value <= self.heartbeat_timeout:
+                return
+            self.worker_logger.error(
+                "Worker process not responding, killing it", {"process": index}
+            )
+            process.kill()
+            process.join(5)
+        if process is not None:
+            self.worker_logger.error(
+                "Worker process exited",
+                {"process": index, "exitcode": process.exitcode},
+            )
+            self.children[index] = None
+            self.restarts[index] += 1
+            # Crash loop: restarts are delayed exponentially, up to one minute
+            if time.monotonic() - self.started[index] > 60:
+                self.failures[index] = 0
+            self.failures[index] += 1
+            self.next_start[index] = time.monotonic() + min(
+                2 ** (self.failures[index] - 1), 60
+            )
+        if time.monotonic() >= self.next_start[index]:
+            self.start_child(index)
+
+    def health(self) -> Dict[str, Any]:
+        # Alive while every process is running and sending its heartbeats
+        now = time.time()
+        processes = {}
+        for index, process in enumerate(self.children):
+            heartbeat = self.heartbeats[index].value
+            processes[str(index)] = {
+                "alive": process is not None
+                and process.is_alive()
+                and now - heartbeat <= self.heartbeat_timeout,
+                "heartbeat": heartbeat,
+            }
+        return {
+            "alive": all(state["alive"] for state in processes.values()),
+            "processes": processes,
+        }
+
+    def ready(self) -> Dict[str, Any]:
+        # Ready when every process answers it is ready
+        processes = {}
+        for index in range(self.processes):
+            port = process_ports(self.base_port, self.processes, index)[1]
+            url = "http://127.0.0.1:%d/ready" % port
+            try:
+                with urllib.request.urlopen(url, timeout=5) as response:
+                    processes[str(index)] = json.loads(response.read())
+            except urllib.error.HTTPError as e:
+                # Not ready (503), with the state of the process
+                processes[str(index)] = json.loads(e.read())
+            except (OSError, ValueError):
+                # Process restarting
+                processes[str(index)] = {"ready": False}
+        return {
+            "ready": all(state["ready"] for state in processes.values()),
+            "processes": processes,
+        }
+
+    def stop(self, *_args: Any) -> None:
+        self.worker_logger.info("Stopping the worker processes")
+        self.exit_event.set()
+
+    def stop_children(self) -> None:
+        # SIGTERM: every process drains its consumers
+        children = [process for process in self.children if process is not None]
+        for process in children:
+            process.terminate()
+        deadline = time.monotonic() + self.stop_timeout
+        for process in children:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.kill()
+                process.join()
+
+    def run(self) -> None:
+        if self.telemetry is not None:
+            registry = CollectorRegistry(auto_describe=False)
+            registry.register(ProcessesCollector(self))  # type: ignore
+            start_http_server(
+                port=self.telemetry[1], addr=self.telemetry[0], registry=registry
+            )
+        if self.health_endpoint is not None:
+            start_health_server(self.health_endpoint, self.health, self.ready)
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.exit_event.is_set():
+            for index in range(self.processes):
+                self.check_child(index)
+            self.exit_event.wait(1)
+        self.stop_children()
+
+
+@dataclass(unsafe_hash=True)
+class Worker:  # pylint: disable=too-few-public-methods, too-many-instance-attributes
+    logs_all_queue: str = "logs_all"
+    consumer_threads: Dict[str, Any] = field(default_factory=dict, hash=False)
+    logger_threads: Dict[str, Any] = field(default_factory=dict, hash=False)
+    # Index and heartbeat of a worker process started by the supervisor
+    process_index: int = -1
+    heartbeat: Any = field(default=None, hash=False, compare=False)
+
+    def __post_init__(self) -> None:
+        # Get configuration
+        config_file_path = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)), "config.yml"
         )
         if os.path.isfile(config_file_path):
             with open(config_file_path, "r") as f:
@@ -462,6 +1928,214 @@ class Worker:  # pylint: disable=too-few-public-methods, too-many-instance-attri
         self.log_level = get_config_variable(
             "WORKER_LOG_LEVEL", ["worker", "log_level"], config
         )
+        # Concurrency
+        self.execution_pool_size = get_config_variable(
+            "WORKER_EXECUTION_POOL_SIZE",
+            ["worker", "execution_pool_size"],
+            config,
+            True,
+            1,
+        )
+        # Per queue override, keyed by connector id or name (config.yml only)
+        self.queues_execution_pool_size: Dict[str, int] = (
+            config.get("worker", {}).get("queues_execution_pool_size") or {}
+        )
+        # Priority class ("interactive", "default" or "bulk") of the queues, keyed
+        # by connector id, name or type (config.yml only)
+        self.queues_priority: Dict[str, str] = (
+            config.get("worker", {}).get("queues_priority") or {}
+        )
+        # Ordering of the messages processed in parallel, "work" (messages of
+        # the same work in order) or "entities" (messages touching the same
+        # entities in order)
+        self.ordering = get_config_variable(
+            "WORKER_ORDERING", ["worker", "ordering"], config, False, "work"
+        )
+        # Bundles larger than this size (bytes) are imported in batches of this
+        # size, 0 to import bundles as a whole
+        self.bundle_split_size = get_config_variable(
+            "WORKER_BUNDLE_SPLIT_SIZE",
+            ["worker", "bundle_split_size"],
+            config,
+            True,
+            0,
+        )
+        # Create and update events received within this window (ms) are imported
+        # as one bundle with the latest state of each entity, 0 to disable
+        self.event_coalescing_window = get_config_variable(
+            "WORKER_EVENT_COALESCING_WINDOW",
+            ["worker", "event_coalescing_window"],
+            config,
+            True,
+            0,
+        )
+        self.event_coalescing_max_size = get_config_variable(
+            "WORKER_EVENT_COALESCING_MAX_SIZE",
+            ["worker", "event_coalescing_max_size"],
+            config,
+            True,
+            500,
+        )
+        # API connection pool
+        self.api_pool_hosts = get_config_variable(
+            "WORKER_API_POOL_HOSTS", ["worker", "api_pool_hosts"], config, True, 10
+        )
+        self.api_pool_max_per_host = get_config_variable(
+            "WORKER_API_POOL_MAX_PER_HOST",
+            ["worker", "api_pool_max_per_host"],
+            config,
+            True,
+            32,
+        )
+        self.api_pool_idle_timeout = get_config_variable(
+            "WORKER_API_POOL_IDLE_TIMEOUT",
+            ["worker", "api_pool_idle_timeout"],
+            config,
+            True,
+            60,
+        )
+        # Engine, "threads" (one consumer thread per queue) or "asyncio"
+        self.engine = get_config_variable(
+            "WORKER_ENGINE", ["worker", "engine"], config, False, "threads"
+        )
+        self.engine_pool_size = get_config_variable(
+            "WORKER_ENGINE_POOL_SIZE",
+            ["worker", "engine_pool_size"],
+            config,
+            True,
+            16,
+        )
+        # Acks sent in batches of up to ack_batch_size messages, at most after
+        # ack_batch_delay ms (0 to ack every message on its own)
+        self.ack_batch_size = get_config_variable(
+            "WORKER_ACK_BATCH_SIZE", ["worker", "ack_batch_size"], config, True, 0
+        )
+        self.ack_batch_delay = get_config_variable(
+            "WORKER_ACK_BATCH_DELAY", ["worker", "ack_batch_delay"], config, True, 100
+        )
+        # Messages parked for a retry widening the prefetch of their queue
+        self.max_parked = get_config_variable(
+            "WORKER_MAX_PARKED", ["worker", "max_parked"], config, True, 100
+        )
+        # Cache of the objects imported recently (canonical hash), skipped when
+        # sent again by feeds or redelivered by the broker
+        self.dedup_cache_enabled = get_config_variable(
+            "WORKER_DEDUP_CACHE_ENABLED",
+            ["worker", "dedup_cache_enabled"],
+            config,
+            False,
+            False,
+        )
+        self.dedup_cache_size = get_config_variable(
+            "WORKER_DEDUP_CACHE_SIZE",
+            ["worker", "dedup_cache_size"],
+            config,
+            True,
+            100000,
+        )
+        self.dedup_cache_ttl = get_config_variable(
+            "WORKER_DEDUP_CACHE_TTL",
+            ["worker", "dedup_cache_ttl"],
+            config,
+            True,
+            3600,
+        )
+        self.dedup_cache_path = get_config_variable(
+            "WORKER_DEDUP_CACHE_PATH", ["worker", "dedup_cache_path"], config, False, ""
+        )
+        # Index of the last version of the objects upserted, shared by the
+        # worker processes of the node, unchanged objects are not sent again
+        self.version_index_enabled = get_config_variable(
+            "WORKER_VERSION_INDEX_ENABLED",
+            ["worker", "version_index_enabled"],
+            config,
+            False,
+            False,
+        )
+        self.version_index_path = get_config_variable(
+            "WORKER_VERSION_INDEX_PATH",
+            ["worker", "version_index_path"],
+            config,
+            False,
+            "versions.db",
+        )
+        self.version_index_mmap_size = get_config_variable(
+            "WORKER_VERSION_INDEX_MMAP_SIZE",
+            ["worker", "version_index_mmap_size"],
+            config,
+            True,
+            268435456,
+        )
+        self.version_index_size = get_config_variable(
+            "WORKER_VERSION_INDEX_SIZE",
+            ["worker", "version_index_size"],
+            config,
+            True,
+            1000000,
+        )
+        self.version_index_ttl = get_config_variable(
+            "WORKER_VERSION_INDEX_TTL",
+            ["worker", "version_index_ttl"],
+            config,
+            True,
+            604800,
+        )
+        # Seconds between two reconciliations of the consumers with the
+        # connectors of the platform
+        self.connectors_refresh_interval = get_config_variable(
+            "WORKER_CONNECTORS_REFRESH_INTERVAL",
+            ["worker", "connectors_refresh_interval"],
+            config,
+            True,
+            60,
+        )
+        # Seconds given to the messages in flight to finish when stopping a
+        # consumer, remaining messages are given back to the broker
+        self.drain_timeout = get_config_variable(
+            "WORKER_DRAIN_TIMEOUT",
+            ["worker", "drain_timeout"],
+            config,
+            True,
+            60,
+        )
+        # Autoscaling, the budget of messages processed in parallel is shared
+        # between the queues according to their backlog
+        self.autoscaling_enabled = get_config_variable(
+            "WORKER_AUTOSCALING_ENABLED",
+            ["worker", "autoscaling_enabled"],
+            config,
+            False,
+            False,
+        )
+        self.autoscaling_budget = get_config_variable(
+            "WORKER_AUTOSCALING_BUDGET",
+            ["worker", "autoscaling_budget"],
+            config,
+            True,
+            16,
+        )
+        self.autoscaling_max_queue_slots = get_config_variable(
+            "WORKER_AUTOSCALING_MAX_QUEUE_SLOTS",
+            ["worker", "autoscaling_max_queue_slots"],
+            config,
+            True,
+            0,
+        )
+        self.autoscaling_interval = get_config_variable(
+            "WORKER_AUTOSCALING_INTERVAL",
+            ["worker", "autoscaling_interval"],
+            config,
+            True,
+            15,
+        )
+        # Seconds to drain the backlog of a queue the slots are sized for
+        self.autoscaling_latency_target = get_config_variable(
+            "WORKER_AUTOSCALING_LATENCY_TARGET",
+            ["worker", "autoscaling_latency_target"],
+            config,
+            True,
+            300,
+        )
         # Telemetry
         self.telemetry_enabled = get_config_variable(
             "WORKER_TELEMETRY_ENABLED",
@@ -484,18 +2158,178 @@ class Worker:  # pylint: disable=too-few-public-methods, too-many-instance-attri
             False,
             "0.0.0.0",
         )
+        self.telemetry_latency_buckets = get_config_variable(
+            "WORKER_TELEMETRY_LATENCY_BUCKETS",
+            ["worker", "telemetry_latency_buckets"],
+            config,
+            False,
+            DEFAULT_LATENCY_BUCKETS,
+        )
+        self.telemetry_size_buckets = get_config_variable(
+            "WORKER_TELEMETRY_SIZE_BUCKETS",
+            ["worker", "telemetry_size_buckets"],
+            config,
+            False,
+            DEFAULT_SIZE_BUCKETS,
+        )
+        self.telemetry_objects_buckets = get_config_variable(
+            "WORKER_TELEMETRY_OBJECTS_BUCKETS",
+            ["worker", "telemetry_objects_buckets"],
+            config,
+            False,
+            DEFAULT_OBJECTS_BUCKETS,
+        )
+        # Tracing
+        self.tracing_enabled = get_config_variable(
+            "WORKER_TRACING_ENABLED",
+            ["worker", "tracing_enabled"],
+            config,
+            False,
+            False,
+        )
+        self.tracing_exporter = get_config_variable(
+            "WORKER_TRACING_EXPORTER",
+            ["worker", "tracing_exporter"],
+            config,
+            False,
+            "otlp",
+        )
+        self.tracing_otlp_endpoint = get_config_variable(
+            "WORKER_TRACING_OTLP_ENDPOINT",
+            ["worker", "tracing_otlp_endpoint"],
+            config,
+            False,
+            "http://localhost:4318/v1/traces",
+        )
+        self.tracing_file_path = get_config_variable(
+            "WORKER_TRACING_FILE_PATH",
+            ["worker", "tracing_file_path"],
+            config,
+            False,
+            "traces.jsonl",
+        )
+        self.tracing_sampling_ratio = float(
+            get_config_variable(
+                "WORKER_TRACING_SAMPLING_RATIO",
+                ["worker", "tracing_sampling_ratio"],
+                config,
+                False,
+                0.01,
+            )
+        )
 
-        # Telemetry
-        if self.telemetry_enabled:
+        # Health
+        self.health_interval = get_config_variable(
+            "WORKER_HEALTH_INTERVAL", ["worker", "health_interval"], config, True, 30
+        )
+        self.health_max_interval = get_config_variable(
+            "WORKER_HEALTH_MAX_INTERVAL",
+            ["worker", "health_max_interval"],
+            config,
+            True,
+            300,
+        )
+        self.health_endpoint_enabled = get_config_variable(
+            "WORKER_HEALTH_ENDPOINT_ENABLED",
+            ["worker", "health_endpoint_enabled"],
+            config,
+            False,
+            False,
+        )
+        self.health_endpoint_port = get_config_variable(
+            "WORKER_HEALTH_ENDPOINT_PORT",
+            ["worker", "health_endpoint_port"],
+            config,
+            True,
+            14269,
+        )
+        self.health_endpoint_host = get_config_variable(
+            "WORKER_HEALTH_ENDPOINT_HOST",
+            ["worker", "health_endpoint_host"],
+            config,
+            False,
+            "0.0.0.0",
+        )
+        # Multi-process mode: a supervisor starting processes worker processes,
+        # sharing the queues ("queues", each queue consumed by one process) or
+        # all consuming every queue ("competing", messages of one queue spread
+        # between the processes, ordering kept within each process only)
+        self.processes = get_config_variable(
+            "WORKER_PROCESSES", ["worker", "processes"], config, True, 1
+        )
+        self.processes_sharing = get_config_variable(
+            "WORKER_PROCESSES_SHARING",
+            ["worker", "processes_sharing"],
+            config,
+            False,
+            "queues",
+        )
+        self.process_heartbeat_timeout = get_config_variable(
+            "WORKER_PROCESS_HEARTBEAT_TIMEOUT",
+            ["worker", "process_heartbeat_timeout"],
+            config,
+            True,
+            60,
+        )
+        self.processes_base_port = get_config_variable(
+            "WORKER_PROCESSES_BASE_PORT",
+            ["worker", "processes_base_port"],
+            config,
+            True,
+            14300,
+        )
+        self.supervising = self.processes > 1 and self.process_index < 0
+        if self.process_index >= 0:
+            # Local endpoints of the worker processes, served on the configured
+            # ones by the supervisor
+            self.telemetry_prometheus_host = "127.0.0.1"
+            self.health_endpoint_host = "127.0.0.1"
+            self.telemetry_prometheus_port, self.health_endpoint_port = process_ports(
+                self.processes_base_port, self.processes, self.process_index
+            )
+
+        # Telemetry, served by the supervisor for all the worker processes
+        if self.telemetry_enabled and not self.supervising:
             start_http_server(
                 port=self.telemetry_prometheus_port, addr=self.telemetry_prometheus_host
             )
             provider = MeterProvider(
-                resource=resource, metric_readers=[PrometheusMetricReader()]
+                resource=resource,
+                metric_readers=[PrometheusMetricReader()],
+                views=telemetry_views(
+                    parse_buckets(self.telemetry_latency_buckets),
+                    parse_buckets(self.telemetry_size_buckets),
+                    parse_buckets(self.telemetry_objects_buckets),
+                ),
             )
             metrics.set_meter_provider(provider)
+        if self.tracing_enabled:
+            tracer_provider = TracerProvider(
+                resource=resource,
+                sampler=ParentBased(TraceIdRatioBased(self.tracing_sampling_ratio)),
+            )
+            tracer_provider.add_span_processor(
+                BatchSpanProcessor(
+                    create_span_exporter(
+                        self.tracing_exporter,
+                        self.tracing_otlp_endpoint,
+                        self.tracing_file_path,
+                    )
+                )
+            )
+            trace.set_tracer_provider(tracer_provider)
+
+        logger_class = logger(self.log_level.upper(), self.opencti_json_logging)
+        self.worker_logger = logger_class("worker")
+        self.exit_event = threading.Event()
+        if self.supervising:
+            # Client, caches and services are built by the worker processes
+            return
 
         # Check if openCTI is available
+        self.api_session = ApiSession(
+            self.api_pool_hosts, self.api_pool_max_per_host, self.api_pool_idle_timeout
+        )
         self.api = OpenCTIApiClient(
             url=self.opencti_url,
             token=self.opencti_token,
@@ -503,77 +2337,273 @@ class Worker:  # pylint: disable=too-few-public-methods, too-many-instance-attri
             ssl_verify=self.opencti_ssl_verify,
             json_logging=self.opencti_json_logging,
         )
-        self.worker_logger = self.api.logger_class("worker")
+        self.api.session = self.api_session
+        # Failing messages are parked in one delay queue for the whole worker
+        self.retry_policies = load_retry_policies(config)
+        self.retry_scheduler = RetryScheduler(self.worker_logger)
+        # One health monitor for all the consumers of the worker
+        self.health = HealthMonitor(
+            self.worker_logger,
+            self.api,
+            self.health_interval,
+            self.health_max_interval,
+            (
+                (self.health_endpoint_host, self.health_endpoint_port)
+                if self.health_endpoint_enabled
+                else None
+            ),
+        )
+        self.dedup_cache: Optional[DedupCache] = None
+        if self.dedup_cache_enabled:
+            self.dedup_cache = DedupCache(
+                self.dedup_cache_size, self.dedup_cache_ttl, self.dedup_cache_path
+            )
+        self.version_index: Optional[VersionIndex] = None
+        if self.version_index_enabled:
+            self.version_index = VersionIndex(
+                self.version_index_path,
+                self.version_index_mmap_size,
+                self.version_index_size,
+                self.version_index_ttl,
+            )
+        self.autoscaler: Optional[Autoscaler] = None
+        self.max_concurrency = 0
+        if self.autoscaling_enabled:
+            self.max_concurrency = (
+                self.autoscaling_max_queue_slots or self.autoscaling_budget
+            )
+            self.autoscaler = Autoscaler(
+                self.worker_logger,
+                config,
+                self.autoscaling_budget,
+                self.max_concurrency,
+                self.autoscaling_interval,
+                self.autoscaling_latency_target,
+            )
         # Initialize variables
         self.connectors: List[Any] = []
-        self.queues: List[Any] = []
+        self.connectors_types: Dict[str, str] = {}
+        self.connectors_types_checked: Set[str] = set()
+        self.queues: Set[str] = set()
+
+    def get_execution_pool_size(self, connector: Dict[str, Any]) -> int:
+        for key in (connector["id"], connector["name"]):
+            if key in self.queues_execution_pool_size:
+                return int(self.queues_execution_pool_size[key])
+        return int(self.execution_pool_size)
+
+    def owns_queue(self, queue: str) -> bool:
+        if self.process_index < 0 or self.processes_sharing == "competing":
+            return True
+        return zlib.crc32(queue.encode("utf-8")) % self.processes == self.process_index
+
+    def list_connectors(self) -> List[Any]:
+        connectors = [
+            connector
+            for connector in self.api.connector.list()
+            if self.owns_queue(connector["config"]["push"])
+        ]
+        # Types are not part of the worker query, they are only used to
+        # choose the priority class of the queues: fetched for new connectors
+        connectors_ids = {connector["id"] for connector in connectors}
+        if connectors_ids <= self.connectors_types_checked:
+            return connectors
+        try:
+            result = self.api.query(
+                """
+                query GetConnectorsTypes {
+                  connectors {
+                    id
+                    connector_type
+                  }
+                }
+              """
+            )
+            self.connectors_types = {
+                connector["id"]: connector["connector_type"]
+                for connector in result["data"]["connectors"]
+            }
+            self.connectors_types_checked = connectors_ids
+        except Exception as e:  # pylint: disable=broad-except
+            self.worker_logger.warning(
+                "Unable to fetch the connectors types", {"reason": str(e)}
+            )
+        return connectors
+
+    def connector_fingerprint(self, connector: Dict[str, Any]) -> str:
+        # Everything a consumer is built from, consumers are only rebuilt when
+        # their fingerprint changes
+        settings = {
+            "config": connector["config"],
+            "execution_pool_size": self.get_execution_pool_size(connector),
+            "priority_class": self.get_priority_class(connector),
+            "connector_type": self.connectors_types.get(connector["id"], ""),
+        }
+        content = json.dumps(settings, sort_keys=True).encode("utf-8")
+        return hashlib.sha256(content).hexdigest()
+
+    def get_priority_class(self, connector: Dict[str, Any]) -> str:
+        connector_type = self.connectors_types.get(connector["id"])
+        for key in (connector["id"], connector["name"], connector_type):
+            if key in self.queues_priority:
+                return str(self.queues_priority[key])
+        return CONNECTOR_TYPES_PRIORITY_CLASSES.get(connector_type or "", "default")
+
+    def create_consumer(self, connector: Dict[str, Any]) -> Consumer:
+        return Consumer(
+            connector,
+            self.config,
+            self.opencti_url,
+            self.opencti_token,
+            self.log_level,
+            self.opencti_ssl_verify,
+            self.opencti_json_logging,
+            self.get_execution_pool_size(connector),
+            api_session=self.api_session,
+            retry_scheduler=self.retry_scheduler,
+            retry_policies=self.retry_policies,
+            ordering=self.ordering,
+            bundle_split_size=self.bundle_split_size,
+            event_coalescing_window=self.event_coalescing_window,
+            event_coalescing_max_size=self.event_coalescing_max_size,
+            max_concurrency=self.max_concurrency,
+            priority_class=self.get_priority_class(connector),
+            connector_type=self.connectors_types.get(connector["id"], ""),
+            drain_timeout=self.drain_timeout,
+            fingerprint=self.connector_fingerprint(connector),
+            ack_batch_size=self.ack_batch_size,
+            ack_batch_delay=self.ack_batch_delay,
+            max_parked=self.max_parked,
+            dedup_cache=self.dedup_cache,
+            version_index=self.version_index,
+        )
+
+    def stop(self, *_args: Any) -> None:
+        self.worker_logger.info("Stopping the worker")
+        self.exit_event.set()
+
+    def stop_services(self) -> None:
+        if self.autoscaler is not None:
+            self.autoscaler.stop()
+        self.retry_scheduler.stop()
+        self.health.stop()
+        if self.dedup_cache is not None:
+            self.dedup_cache.close()
+        if self.version_index is not None:
+            self.version_index.close()
+
+    def drain_consumer(self, queue: str) -> None:
+        try:
+            self.consumer_threads.pop(queue).drain()
+        except Exception as e:  # pylint: disable=broad-except
+            # Connection already closed, the thread is ending
+            self.worker_logger.warning(str(e))
+
+    def reconcile(self, connectors: List[Any]) -> None:
+        connectors_by_queue = {
+            connector["config"]["push"]: connector for connector in connectors
+        }
+        self.connectors = connectors
+        self.queues = set(connectors_by_queue)
+        for queue, connector in connectors_by_queue.items():
+            fingerprint = self.connector_fingerprint(connector)
+            consumer = self.consumer_threads.get(queue)
+            if consumer is None:
+                self.worker_logger.info("Starting thread for queue", {"queue": queue})
+            elif not consumer.is_alive():
+                self.worker_logger.info(
+                    "Thread for queue not alive, creating a new one...",
+                    {"queue": queue},
+                )
+            elif consumer.fingerprint != fingerprint:
+                self.worker_logger.info(
+                    "Settings of queue changed, draining thread...", {"queue": queue}
+                )
+                self.drain_consumer(queue)
+            else:
+                continue
+            self.consumer_threads[queue] = self.create_consumer(connector)
+            self.consumer_threads[queue].start()
+        # Check if some threads must be stopped
+        for queue in self.consumer_threads.keys() - self.queues:
+            self.worker_logger.info(
+                "Queue no longer exists, draining thread...", {"queue": queue}
+            )
+            self.drain_consumer(queue)
+
+    def drain_consumers(self) -> None:
+        # Consumers finish their messages in flight in parallel
+        for consumer in self.consumer_threads.values():
+            try:
+                consumer.drain()
+            except Exception as e:  # pylint: disable=broad-except
+                # Connection already closed, the thread is ending
+                self.worker_logger.warning(str(e))
+        deadline = time.monotonic() + self.drain_timeout + 5
+        for consumer in self.consumer_threads.values():
+            consumer.join(max(0.0, deadline - time.monotonic()))
+
+    def beat(self) -> None:
+        # Heartbeats of a worker process, which stops with its supervisor
+        supervisor_pid = os.getppid()
+        while not self.exit_event.is_set():
+            if os.getppid() != supervisor_pid:
+                self.worker_logger.error("Supervisor exited, stopping")
+                os.kill(os.getpid(), signal.SIGTERM)
+                return
+            self.heartbeat.value = time.time()
+            self.exit_event.wait(5)
 
     # Start the main loop
     def start(self) -> None:
-        sleep_delay = 60
-        while True:
+        if self.supervising:
+            self.worker_logger.info(
+                "Starting the worker processes", {"processes": self.processes}
+            )
+            Supervisor(
+                self.worker_logger,
+                self.processes,
+                self.process_heartbeat_timeout,
+                self.drain_timeout + 30,
+                self.processes_base_port,
+                (
+                    (self.telemetry_prometheus_host, self.telemetry_prometheus_port)
+                    if self.telemetry_enabled
+                    else None
+                ),
+                (
+                    (self.health_endpoint_host, self.health_endpoint_port)
+                    if self.health_endpoint_enabled
+                    else None
+                ),
+            ).run()
+            return
+        if self.heartbeat is not None:
+            Thread(target=self.beat, daemon=True).start()
+        self.health.start()
+        self.retry_scheduler.start()
+        if self.autoscaler is not None:
+            self.autoscaler.start()
+        if self.engine == "asyncio":
+            self.worker_logger.info("Starting the asyncio engine")
+            AsyncEngine(self).start()
+            self.stop_services()
+            return
+        self.health.consumers = self.consumer_threads
+        if self.autoscaler is not None:
+            self.autoscaler.consumers = self.consumer_threads
+        # Graceful stop: consumers are drained before exiting
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        while not self.exit_event.is_set():
             try:
                 # Fetch queue configuration from API
-                self.connectors = self.api.connector.list()
-                self.queues = list(
-                    map(lambda x: x["config"]["push"], self.connectors)  # type: ignore
-                )
-                # Check if all queues are consumed
-                for connector in self.connectors:
-                    queue = connector["config"]["push"]
-                    if queue in self.consumer_threads:
-                        if not self.consumer_threads[queue].is_alive():
-                            self.worker_logger.info(
-                                "Thread for queue not alive, creating a new one...",
-                                {"queue": queue},
-                            )
-                            self.consumer_threads[queue] = Consumer(
-                                connector,
-                                self.config,
-                                self.opencti_url,
-                                self.opencti_token,
-                                self.log_level,
-                                self.opencti_ssl_verify,
-                                self.opencti_json_logging,
-                            )
-                            self.consumer_threads[queue].start()
-                    else:
-                        self.consumer_threads[queue] = Consumer(
-                            connector,
-                            self.config,
-                            self.opencti_url,
-                            self.opencti_token,
-                            self.log_level,
-                            self.opencti_ssl_verify,
-                            self.opencti_json_logging,
-                        )
-                        self.consumer_threads[queue].start()
-
-                # Check if some threads must be stopped
-                for thread in list(self.consumer_threads):
-                    if thread not in self.queues:
-                        self.worker_logger.info(
-                            "Queue no longer exists, killing thread...",
-                            {"thread": thread},
-                        )
-                        try:
-                            self.consumer_threads[thread].terminate()
-                            self.consumer_threads.pop(thread, None)
-                        except:
-                            self.worker_logger.info(
-                                "Unable to kill the thread for queue, an operation is running, keep trying...",
-                                {"thread": thread},
-                            )
-                time.sleep(sleep_delay)
-            except KeyboardInterrupt:
-                # Graceful stop
-                for thread in self.consumer_threads:
-                    if thread not in self.queues:
-                        self.consumer_threads[thread].terminate()
-                sys.exit(0)
+                self.reconcile(self.list_connectors())
             except Exception as e:  # pylint: disable=broad-except
                 self.worker_logger.error(type(e).__name__, {"reason": str(e)})
-                time.sleep(60)
+            self.exit_event.wait(self.connectors_refresh_interval)
+        self.drain_consumers()
+        self.stop_services()
 
 
 if __name__ == "__main__":
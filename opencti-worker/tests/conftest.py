@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+sys.path.insert(0, os.path.join(ROOT, "src"))
+# In-memory broker and fake API of the benchmarks
+sys.path.insert(0, os.path.join(ROOT, "benchmark"))
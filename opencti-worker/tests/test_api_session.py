@@ -0,0 +1,46 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, List
+
+from worker import ApiSession
+
+
+def start_server(peers: List[Any]) -> ThreadingHTTPServer:
+    class KeepAliveHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self) -> None:  # pylint: disable=invalid-name
+            peers.append(self.client_address)
+            self.send_response(200)
+            self.send_header("Content-Length", "2")
+            self.end_headers()
+            self.wfile.write(b"{}")
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def test_idle_connections_opened_again() -> None:
+    peers: List[Any] = []
+    server = start_server(peers)
+    url = "http://127.0.0.1:%d/" % server.server_address[1]
+    session = ApiSession(10, 2, 1)
+    try:
+        # Kept alive while used within idle_timeout
+        for _ in range(3):
+            session.get(url)
+        time.sleep(0.5)
+        session.get(url)
+        assert len(set(peers)) == 1
+        time.sleep(1.2)
+        session.get(url)
+        assert len(set(peers)) == 2 and peers[-1] != peers[0]
+    finally:
+        session.close()
+        server.shutdown()
+        server.server_close()
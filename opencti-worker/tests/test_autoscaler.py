@@ -0,0 +1,29 @@
+from autoscaler import allocate_slots
+
+
+def test_demands_within_budget_fully_served() -> None:
+    assert allocate_slots({"a": 3, "b": 2}, 10) == {"a": 3, "b": 2}
+
+
+def test_every_queue_keeps_one_slot() -> None:
+    allocation = allocate_slots({"a": 1, "b": 50, "c": 50}, 3)
+    assert allocation == {"a": 1, "b": 1, "c": 1}
+
+
+def test_max_min_fair_share() -> None:
+    # "a" asks for less than an equal share, what it leaves goes to the others
+    allocation = allocate_slots({"a": 2, "b": 20, "c": 20}, 12)
+    assert allocation == {"a": 2, "b": 5, "c": 5}
+    assert sum(allocation.values()) == 12
+
+
+def test_leftover_goes_to_biggest_demands() -> None:
+    allocation = allocate_slots({"a": 10, "b": 30}, 9)
+    assert allocation == {"a": 4, "b": 5}
+
+
+def test_higher_priority_served_first() -> None:
+    allocation = allocate_slots(
+        {"bulk": 20, "interactive": 6}, 10, {"bulk": 0, "interactive": 2}
+    )
+    assert allocation == {"bulk": 4, "interactive": 6}
@@ -0,0 +1,107 @@
+import base64
+import json
+from typing import Any, Dict
+
+import pytest
+from bundles import bundle_entities_ids, decode_bundle, scan_entities_ids, split_bundle
+
+
+def encode(content: Any) -> str:
+    return base64.b64encode(json.dumps(content).encode("utf-8")).decode("ascii")
+
+
+BUNDLE: Dict[str, Any] = {
+    "type": "bundle",
+    "id": "bundle--1",
+    "objects": [
+        {
+            "type": "indicator",
+            "id": "indicator--%d" % index,
+            "name": "Indicateur é %d" % index,
+            "confidence": index * 1.5,
+            "labels": ["a", "b"],
+            "extensions": {"nested": {"value": None, "flag": True}},
+        }
+        for index in range(50)
+    ],
+    "spec_version": "2.1",
+}
+
+
+@pytest.mark.parametrize("chunk_size", [4, 16, 100, 4 * 1024 * 1024])
+def test_decode_bundle_any_chunk_size(chunk_size: int) -> None:
+    # Small chunks cut the values, numbers and multi bytes characters
+    assert decode_bundle(encode(BUNDLE), chunk_size) == BUNDLE
+
+
+def test_decode_bundle_wrapped_base64() -> None:
+    content = base64.encodebytes(json.dumps(BUNDLE).encode("utf-8")).decode("ascii")
+    assert "\n" in content
+    assert decode_bundle(content, 64) == BUNDLE
+
+
+def test_decode_bundle_empty() -> None:
+    assert decode_bundle(encode({})) == {}
+    assert decode_bundle(encode({"objects": []})) == {"objects": []}
+
+
+def test_decode_bundle_invalid() -> None:
+    content = base64.b64encode(b'{"objects": [{"id": 1}').decode("ascii")
+    with pytest.raises(ValueError):
+        decode_bundle(content, 8)
+
+
+def test_split_bundle_in_dependency_order() -> None:
+    objects = [
+        {"type": "report", "id": "report--1"},
+        {"type": "relationship", "id": "relationship--1"},
+        {"type": "indicator", "id": "indicator--1"},
+        {"type": "marking-definition", "id": "marking-definition--1"},
+    ]
+    batches = split_bundle(objects, 1)
+    assert [batch[0]["type"] for batch in batches] == [
+        "marking-definition",
+        "indicator",
+        "relationship",
+        "report",
+    ]
+    assert split_bundle(objects, 10000) == [
+        [objects[3], objects[2], objects[1], objects[0]]
+    ]
+
+
+REPORT: Dict[str, Any] = {
+    "type": "bundle",
+    "id": "bundle--2",
+    "objects": [
+        {"type": "identity", "id": "identity--author", "name": "Author"},
+        {"type": "marking-definition", "id": "marking-definition--tlp"},
+        {
+            "type": "report",
+            "id": "report--1",
+            "name": 'Rapport "id": "ignored--1"',
+            "created_by_ref": "identity--author",
+            "object_marking_refs": ["marking-definition--tlp"],
+            "object_refs": ["indicator--%d" % index for index in range(20)],
+            "labels": ["id", "object_refs"],
+        },
+        {
+            "type": "relationship",
+            "id": "relationship--1",
+            "source_ref": "indicator--1",
+            "target_ref": "malware--1",
+            "confidence": 10,
+        },
+        {"type": "sighting", "id": "sighting--1", "sighting_of_ref": "malware--2"},
+    ]
+    + BUNDLE["objects"],
+}
+
+
+@pytest.mark.parametrize("chunk_size", [4, 16, 100, 4 * 1024 * 1024])
+def test_scan_entities_ids_any_chunk_size(chunk_size: int) -> None:
+    # Small chunks cut the field names and their values
+    ids = scan_entities_ids(encode(REPORT), chunk_size)
+    assert ids == bundle_entities_ids(REPORT["objects"])
+    assert "malware--2" in ids and "identity--author" not in ids
+    assert scan_entities_ids(encode({})) == set()
@@ -0,0 +1,59 @@
+import os
+import time
+from typing import Any, Dict, List
+
+from bundles import object_hash
+from caches import VersionIndex
+
+
+def indicators(count: int) -> List[Dict[str, Any]]:
+    return [
+        {"type": "indicator", "id": "indicator--%d" % index, "modified": "2024"}
+        for index in range(count)
+    ]
+
+
+def record(index: VersionIndex, objects: List[Dict[str, Any]]) -> None:
+    index.record(objects, {o["id"]: object_hash(o) for o in objects})
+
+
+def changed(index: VersionIndex, objects: List[Dict[str, Any]]) -> List[str]:
+    kept, _ = index.changed(objects, [object_hash(o) for o in objects])
+    return [stix_object["id"] for stix_object in kept]
+
+
+def test_unchanged_versions_dropped(tmp_path: Any) -> None:
+    index = VersionIndex(os.path.join(tmp_path, "versions.db"), 0, 100, 3600)
+    objects = indicators(3)
+    record(index, objects[:2])
+    assert changed(index, objects) == ["indicator--2"]
+    objects[0]["modified"] = "2025"
+    assert changed(index, objects) == ["indicator--0", "indicator--2"]
+    index.close()
+
+
+def test_versions_expire(tmp_path: Any) -> None:
+    index = VersionIndex(os.path.join(tmp_path, "versions.db"), 0, 100, 0.05)
+    objects = indicators(2)
+    record(index, objects)
+    assert changed(index, objects) == []
+    time.sleep(0.1)
+    assert changed(index, objects) == ["indicator--0", "indicator--1"]
+    index.prune()
+    assert index.db.execute("SELECT COUNT(*) FROM versions").fetchone()[0] == 0
+    index.close()
+
+
+def test_oldest_versions_pruned_over_max_size(tmp_path: Any) -> None:
+    path = os.path.join(tmp_path, "versions.db")
+    index = VersionIndex(path, 0, 3, 3600, prune_interval=0)
+    objects = indicators(5)
+    for stix_object in objects:
+        record(index, [stix_object])
+        time.sleep(0.01)
+    assert changed(index, objects) == ["indicator--0", "indicator--1"]
+    index.close()
+    # Bounded again when opened by another worker process
+    index = VersionIndex(path, 0, 1, 3600)
+    assert changed(index, objects) == ["indicator--%d" % i for i in range(4)]
+    index.close()
@@ -0,0 +1,216 @@
+import base64
+import json
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from bundles import object_hash
+from caches import DedupCache
+from fake_api import ApiProfile, FakeApiClient
+from memory_transport import MemoryBroker, MemoryTransport
+from transport import Transport
+from worker import Consumer
+
+QUEUE = "push_test"
+CONNECTOR = {"id": "test", "name": "Test", "config": {"push": QUEUE}}
+
+
+class RecordingApiClient(FakeApiClient):
+    def __init__(
+        self, imports: List[int], failing_import: int = 0, failures: int = 1
+    ) -> None:
+        super().__init__(ApiProfile(latency=0, jitter=0), "critical")
+        self.imports = imports
+        # Position of an import failing with a Bad Gateway, 0 for none, and
+        # number of times it fails
+        self.failing_import = failing_import
+        self.failures = failures
+
+    def call(self, name: str, objects: int = 0, failures: bool = True) -> None:
+        if name == "import_bundle":
+            if len(self.imports) + 1 == self.failing_import and self.failures > 0:
+                self.failures -= 1
+                raise ValueError("502 Server Error: Bad Gateway")
+            self.imports.append(objects)
+        super().call(name, objects, failures)
+
+
+@dataclass(unsafe_hash=True)
+class MemoryConsumer(Consumer):  # pylint: disable=too-many-ancestors
+    broker: Any = field(default=None, hash=False, compare=False)
+    imports: Any = field(default=None, hash=False, compare=False)
+    failing_import: int = field(default=0, hash=False, compare=False)
+    failures: int = field(default=1, hash=False, compare=False)
+
+    def create_api(self) -> Any:
+        return RecordingApiClient(self.imports, self.failing_import, self.failures)
+
+    def create_transport(self) -> Transport:
+        return MemoryTransport(self.broker)
+
+
+def event_message(index: int) -> bytes:
+    event = {
+        "type": "create",
+        "data": {"type": "indicator", "id": "indicator--%d" % index},
+    }
+    content = base64.b64encode(json.dumps(event).encode("utf-8")).decode("utf-8")
+    data: Dict[str, Any] = {"type": "event", "applicant_id": "test", "content": content}
+    return json.dumps(data).encode("utf-8")
+
+
+def bundle_message(objects: List[Dict[str, Any]], **fields: Any) -> bytes:
+    bundle = {"type": "bundle", "id": "bundle--1", "objects": objects}
+    content = base64.b64encode(json.dumps(bundle).encode("utf-8")).decode("utf-8")
+    data = {"type": "bundle", "applicant_id": "test", "content": content, **fields}
+    return json.dumps(data).encode("utf-8")
+
+
+def consume(
+    broker: MemoryBroker,
+    messages: int,
+    config: Optional[Dict[str, Any]] = None,
+    **settings: Any
+) -> List[int]:
+    imports: List[int] = []
+    consumer = MemoryConsumer(
+        CONNECTOR,
+        config or {},
+        "http://test",
+        "test",
+        "critical",
+        broker=broker,
+        **settings
+    )
+    consumer.imports = imports
+    consumer.start()
+    deadline = time.monotonic() + 10
+    while broker.acked < messages and time.monotonic() < deadline:
+        time.sleep(0.01)
+    consumer.drain()
+    consumer.join(5)
+    consumer.retry_scheduler.stop()
+    return imports
+
+
+def test_events_coalesced_up_to_max_size() -> None:
+    broker = MemoryBroker()
+    for index in range(100):
+        broker.publish(QUEUE, event_message(index))
+    imports = consume(
+        broker,
+        100,
+        execution_pool_size=2,
+        event_coalescing_window=200,
+        event_coalescing_max_size=25,
+    )
+    assert broker.acked == 100
+    assert broker.errors == []
+    # Events wait unacked for their window: the prefetch leaves room for a
+    # whole coalesced bundle, not only for the messages processed
+    assert sum(imports) == 100
+    assert max(imports) == 25
+    assert len(imports) <= 5
+
+
+def test_events_imported_one_by_one_without_coalescing() -> None:
+    broker = MemoryBroker()
+    for index in range(10):
+        broker.publish(QUEUE, event_message(index))
+    imports = consume(broker, 10, execution_pool_size=2)
+    assert broker.acked == 10
+    assert imports == [1] * 10
+
+
+def test_messages_of_unknown_type_acknowledged() -> None:
+    broker = MemoryBroker()
+    for _ in range(3):
+        data = {"type": "unknown", "applicant_id": "test", "content": ""}
+        broker.publish(QUEUE, json.dumps(data).encode("utf-8"))
+    imports = consume(broker, 3, execution_pool_size=2)
+    assert broker.acked == 3
+    assert broker.requeued == 0
+    assert imports == []
+
+
+def test_split_bundle_retried_without_trimming_again() -> None:
+    broker = MemoryBroker()
+    objects = [
+        {"type": "indicator", "id": "indicator--%d" % index, "name": "x" * 100}
+        for index in range(30)
+    ]
+    broker.publish(QUEUE, bundle_message(objects))
+    dedup_cache = DedupCache(1000, 3600)
+    imported = objects[:6]
+    dedup_cache.add(
+        imported,
+        {stix_object["id"]: object_hash(stix_object) for stix_object in imported},
+    )
+    imports = consume(
+        broker,
+        1,
+        {"worker": {"retry_policies": {"bad_gateway": {"delay": 0.01}}}},
+        execution_pool_size=2,
+        bundle_split_size=1000,
+        dedup_cache=dedup_cache,
+        failing_import=2,
+    )
+    assert broker.acked == 1
+    assert broker.requeued == 0
+    # The retry resumes after the first batch of the objects kept by the first
+    # attempt: the objects already imported are not sent again
+    assert imports == [6, 6, 6, 6]
+
+
+def test_parked_messages_widen_the_prefetch_up_to_max_parked() -> None:
+    broker = MemoryBroker()
+    for index in range(200):
+        objects = [{"type": "indicator", "id": "indicator--%d" % index}]
+        broker.publish(QUEUE, bundle_message(objects))
+    consumer = MemoryConsumer(
+        CONNECTOR,
+        {},
+        "http://test",
+        "test",
+        "critical",
+        execution_pool_size=2,
+        ordering="entities",
+        max_parked=10,
+        drain_timeout=1,
+        broker=broker,
+        imports=[],
+        failing_import=1,
+        failures=1000,
+    )
+    consumer.start()
+    # Every import fails: parked messages keep their slot past max_parked
+    deadline = time.monotonic() + 10
+    while consumer.parked < 10 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.5)
+    assert consumer.parked == 12
+    assert consumer.prefetch_count() == 12
+    assert broker.depth(QUEUE) == 200 - 12
+    consumer.drain()
+    consumer.join(5)
+    consumer.retry_scheduler.stop()
+
+
+def test_imports_restricted_or_plain_do_not_trim_the_next_ones() -> None:
+    broker = MemoryBroker()
+    objects = [
+        {"type": "indicator", "id": "indicator--1"},
+        {"type": "malware", "id": "malware--1"},
+    ]
+    # Only the indicator is imported by the first message and the update of the
+    # third one is not done by the plain import of the second one, only the
+    # fourth message is skipped
+    broker.publish(QUEUE, bundle_message(objects, entities_types=["Indicator"]))
+    broker.publish(QUEUE, bundle_message(objects))
+    broker.publish(QUEUE, bundle_message(objects, update=True))
+    broker.publish(QUEUE, bundle_message(objects, update=True))
+    imports = consume(
+        broker, 4, execution_pool_size=1, dedup_cache=DedupCache(1000, 3600)
+    )
+    assert broker.acked == 4
+    assert imports == [2, 2, 2]
@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Any, List
+
+from executor import OrderedExecutor
+
+
+def wait_for(condition: Any, timeout: float = 5) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not met in time"
+        time.sleep(0.005)
+
+
+def test_same_key_tasks_run_in_submission_order() -> None:
+    executor = OrderedExecutor(4, "test")
+    done: List[int] = []
+    lock = threading.Lock()
+
+    def task(index: int) -> None:
+        # Later tasks are faster, they would overtake without the ordering
+        time.sleep(0.01 * (5 - index))
+        with lock:
+            done.append(index)
+
+    for index in range(5):
+        executor.submit(["entity"], task, index)
+    executor.shutdown(wait=True)
+    assert done == [0, 1, 2, 3, 4]
+
+
+def test_disjoint_keys_run_in_parallel() -> None:
+    executor = OrderedExecutor(2, "test")
+    barrier = threading.Barrier(2, timeout=5)
+    executor.submit(["a"], barrier.wait)
+    executor.submit(["b"], barrier.wait)
+    # Both tasks must be running at the same time to pass the barrier
+    executor.shutdown(wait=True)
+    assert not barrier.broken
+
+
+def test_keys_released_after_failure() -> None:
+    executor = OrderedExecutor(2, "test")
+    done: List[str] = []
+
+    def fail() -> None:
+        raise ValueError("failed")
+
+    executor.submit(["a"], fail)
+    executor.submit(["a", "b"], done.append, "next")
+    executor.shutdown(wait=True)
+    assert done == ["next"]
+    assert executor.waiting == {}
+
+
+def test_parked_task_holds_its_keys_until_resumed() -> None:
+    executor = OrderedExecutor(2, "test")
+    done: List[str] = []
+
+    executor.submit(["a"], lambda: OrderedExecutor.PARKED)
+    executor.submit(["a"], done.append, "next")
+    executor.submit(["b"], done.append, "other")
+    wait_for(lambda: done == ["other"])
+    # The parked task gives its thread back, but keeps key "a"
+    time.sleep(0.05)
+    assert done == ["other"]
+    assert executor.running == 0
+
+    executor.resume(["a"], done.append, "retried")
+    executor.shutdown(wait=True)
+    assert done == ["other", "retried", "next"]
+
+
+def test_current_keys_of_the_running_task() -> None:
+    executor = OrderedExecutor(1, "test")
+    seen: List[List[str]] = []
+    executor.submit(["b", "a", "a"], lambda: seen.append(executor.current_keys()))
+    executor.shutdown(wait=True)
+    assert seen == [["a", "b"]]
+    assert executor.current_keys() == []
+
+
+def test_ready_tasks_run_by_priority() -> None:
+    executor = OrderedExecutor(1, "test")
+    started = threading.Event()
+    release = threading.Event()
+    done: List[str] = []
+
+    def block() -> None:
+        started.set()
+        release.wait(5)
+
+    executor.submit([], block)
+    started.wait(5)
+    executor.submit([], done.append, "low", priority=0)
+    executor.submit([], done.append, "high", priority=2)
+    release.set()
+    wait_for(lambda: len(done) == 2)
+    executor.shutdown(wait=True)
+    assert done == ["high", "low"]
@@ -0,0 +1,65 @@
+import threading
+from typing import Any, Dict, List, Tuple
+
+from retries import RetryPolicy, RetryScheduler, load_retry_policies
+
+
+class RecordingLogger:
+    def __init__(self) -> None:
+        self.errors: List[Tuple[str, Dict[str, Any]]] = []
+
+    def error(self, message: str, meta: Dict[str, Any]) -> None:
+        self.errors.append((message, meta))
+
+
+def test_callbacks_run_in_due_order() -> None:
+    scheduler = RetryScheduler(RecordingLogger())
+    scheduler.start()
+    done: List[str] = []
+    finished = threading.Event()
+
+    def last() -> None:
+        done.append("last")
+        finished.set()
+
+    scheduler.schedule(0.15, last)
+    scheduler.schedule(0.05, lambda: done.append("first"))
+    scheduler.schedule(0.1, lambda: done.append("second"))
+    assert finished.wait(5)
+    scheduler.stop()
+    assert done == ["first", "second", "last"]
+
+
+def test_failing_callback_does_not_stop_the_scheduler() -> None:
+    logger = RecordingLogger()
+    scheduler = RetryScheduler(logger)
+    scheduler.start()
+    finished = threading.Event()
+
+    def fail() -> None:
+        raise ValueError("failed")
+
+    scheduler.schedule(0, fail)
+    scheduler.schedule(0.05, finished.set)
+    assert finished.wait(5)
+    scheduler.stop()
+    scheduler.join(5)
+    assert not scheduler.is_alive()
+    assert logger.errors == [("ValueError", {"reason": "failed"})]
+
+
+def test_retry_policy_backoff() -> None:
+    policy = RetryPolicy(delay=1, factor=2, max_delay=5, max_attempts=3)
+    assert [policy.next_delay(retry) for retry in range(1, 5)] == [1, 2, 4, 5]
+    assert policy.can_retry(2)
+    assert not policy.can_retry(3)
+
+
+def test_retry_policies_overridden_by_config() -> None:
+    policies = load_retry_policies(
+        {"worker": {"retry_policies": {"lock": {"delay": 1, "jitter": 0}}}}
+    )
+    assert policies["lock"].delay == 1
+    assert policies["lock"].jitter == 0
+    assert policies["lock"].max_attempts == 60
+    assert policies["timeout"].delay == 70
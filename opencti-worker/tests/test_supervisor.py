@@ -0,0 +1,74 @@
+import json
+import socket
+import urllib.error
+import urllib.request
+from typing import Any, Dict
+
+from test_retries import RecordingLogger
+from worker import Supervisor, process_ports, start_health_server
+
+
+def free_base_port(count: int) -> int:
+    # First of count free consecutive ports
+    for base_port in range(20000, 60000, 97):
+        sockets = []
+        try:
+            for port in range(base_port, base_port + count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(("127.0.0.1", port))
+            return base_port
+        except OSError:
+            continue
+        finally:
+            for sock in sockets:
+                sock.close()
+    raise RuntimeError("No free ports")
+
+
+def get(port: int, path: str) -> Any:
+    try:
+        with urllib.request.urlopen("http://127.0.0.1:%d%s" % (port, path)) as r:
+            return r.status, json.loads(r.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def test_process_ports_do_not_overlap() -> None:
+    ports = [port for index in range(4) for port in process_ports(14300, 4, index)]
+    assert len(set(ports)) == 8
+    assert min(ports) == 14300 and max(ports) == 14307
+
+
+def test_supervisor_ready_when_every_process_is() -> None:
+    base_port = free_base_port(5)
+    supervisor = Supervisor(RecordingLogger(), 2, 60, 10, base_port)
+    states: Dict[int, bool] = {0: True, 1: False}
+    servers = [
+        start_health_server(
+            ("127.0.0.1", process_ports(base_port, 2, index)[1]),
+            lambda: {"alive": True},
+            lambda index=index: {"ready": states[index]},
+        )
+        for index in range(2)
+    ]
+    endpoint = start_health_server(
+        ("127.0.0.1", base_port + 4), supervisor.health, supervisor.ready
+    )
+    try:
+        code, body = get(base_port + 4, "/ready")
+        assert code == 503
+        assert body["processes"] == {"0": {"ready": True}, "1": {"ready": False}}
+        states[1] = True
+        assert get(base_port + 4, "/ready") == (
+            200,
+            {"ready": True, "processes": {"0": {"ready": True}, "1": {"ready": True}}},
+        )
+        # Processes not started by this supervisor
+        code, body = get(base_port + 4, "/health")
+        assert code == 503
+        assert not body["processes"]["0"]["alive"]
+    finally:
+        for server in servers + [endpoint]:
+            server.shutdown()
+            server.server_close()
@@ -0,0 +1,98 @@
+from typing import Any, Callable, List, Tuple
+
+from transport import AckBatcher
+
+
+class RecordingChannel:
+    def __init__(self) -> None:
+        self.is_open = True
+        self.calls: List[Tuple[str, int, bool]] = []
+
+    def basic_ack(self, delivery_tag: int, multiple: bool = False) -> None:
+        self.calls.append(("ack", delivery_tag, multiple))
+
+    def basic_nack(self, delivery_tag: int) -> None:
+        self.calls.append(("nack", delivery_tag, False))
+
+
+class Timers:
+    def __init__(self) -> None:
+        self.pending: List[Tuple[float, Callable[[], Any]]] = []
+
+    def call_later(self, delay: float, callback: Callable[[], Any]) -> None:
+        self.pending.append((delay, callback))
+
+    def fire(self) -> None:
+        pending, self.pending = self.pending, []
+        for _, callback in pending:
+            callback()
+
+
+def create_batcher(max_size: int) -> Tuple[AckBatcher, RecordingChannel, Timers]:
+    channel = RecordingChannel()
+    timers = Timers()
+    batcher = AckBatcher(channel, max_size, 0.1, timers.call_later)
+    return batcher, channel, timers
+
+
+def test_contiguous_tags_acked_at_once() -> None:
+    batcher, channel, _ = create_batcher(4)
+    for tag in range(1, 5):
+        batcher.delivered(tag)
+    # Done out of order, acked once all of them are done
+    batcher.ack([2])
+    batcher.ack([4])
+    batcher.ack([1])
+    assert channel.calls == []
+    batcher.ack([3])
+    assert channel.calls == [("ack", 4, True)]
+    assert len(batcher.outstanding) == 0
+    assert len(batcher.done) == 0
+
+
+def test_multiple_ack_stops_at_message_in_flight() -> None:
+    batcher, channel, timers = create_batcher(2)
+    for tag in range(1, 6):
+        batcher.delivered(tag)
+    batcher.ack([1, 2])
+    batcher.ack([4])
+    assert channel.calls == [("ack", 2, True)]
+    batcher.ack([5])
+    # Tag 3 in flight: 4 and 5 cannot be covered by a multiple ack
+    assert ("ack", 5, True) not in channel.calls
+    assert list(batcher.outstanding) == [3]
+    timers.fire()
+    assert list(batcher.outstanding) == [3]
+    assert len(batcher.done) == 0
+
+
+def test_messages_waiting_acked_after_delay() -> None:
+    batcher, channel, timers = create_batcher(10)
+    batcher.delivered(1)
+    batcher.delivered(2)
+    batcher.ack([1])
+    assert channel.calls == []
+    assert len(timers.pending) == 1
+    timers.fire()
+    assert channel.calls == [("ack", 1, True)]
+    assert list(batcher.outstanding) == [2]
+
+
+def test_nack_sent_right_away() -> None:
+    batcher, channel, timers = create_batcher(10)
+    batcher.delivered(1)
+    batcher.delivered(2)
+    batcher.nack([1])
+    assert channel.calls == [("nack", 1, False)]
+    batcher.ack([2])
+    timers.fire()
+    assert channel.calls == [("nack", 1, False), ("ack", 2, True)]
+
+
+def test_closed_channel_not_acked() -> None:
+    batcher, channel, timers = create_batcher(1)
+    batcher.delivered(1)
+    channel.is_open = False
+    batcher.ack([1])
+    timers.fire()
+    assert channel.calls == []